@@ -0,0 +1,359 @@
+import hashlib
+import os
+import sys
+import numpy as np
+import results_store
+# The evaluators import their sibling modules by name
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "semantics"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "singability"))
+import synonym_store
+import abair_prefetch
+import irish_g2p
+import phonetics_store
+import pronunciation_index
+import syllable_analyser_es
+from song_arrays import read_songs, song_means, song_offsets, song_syllable_stress_diffs
+
+# Incremental evaluation of every (system, language, metric) in the results store.
+# The evaluations form a small dependency graph: each reads a system's songs and the
+# songs they are scored against, and needs some of the shared stages (lemmatisation,
+# synonym lookup, phonetisation), which run once over the lines of every evaluation
+# that needs them. Every song's inputs (both songs, the evaluation's parameters and, for the
+# singability metrics, the line count all systems share) are hashed, and only songs
+# whose hash differs from the one recorded next to the column are recomputed. Fixing
+# a few translations recomputes those songs only. Run from the repository root:
+#   python evaluators/evaluation_runner.py [--language ga|es] [--evaluations bleu,...] [--offline] [--force] [system ...]
+# --offline phonetises lines missing from the phonetics store with irish_g2p, --force
+# recomputes every song. The semantic evaluations import UDPipe, NLTK and torch in
+# their own stage and score functions, so the singability evaluations run without them,
+# and singability_analyser.py, which opens the phonetics store and the rhyme index on
+# import, is only imported to score Irish singability.
+
+# Inputs and evaluations of each language. Systems scored against references.txt
+# skip the reference system itself.
+LANGUAGES = {
+    "ga": {
+        "text_dir": "ga_txt_files",
+        "singability_dir": "rhyme_files_ga",
+        "store_dir": results_store.RESULTS_STORE_DIR,
+        "system_files": {"reference": "references.txt", "google": "googles.txt", "nllb": "nllbs.txt"},
+        "udpipe_model": "irish-idt-ud-2.5-191206.udpipe",
+        "evaluations": ["bleu", "meteor", "meteor_synonym", "bert_score", "singability"],
+    },
+    "es": {
+        "text_dir": "es_txt_files",
+        "singability_dir": "es_txt_files",
+        "store_dir": syllable_analyser_es.RESULTS_STORE_DIR,
+        "system_files": syllable_analyser_es.SYSTEM_FILES,
+        # Spanish meteor_synonym is disabled (see LANGUAGES in meteor_synonym.py), as are
+        # the other lemma based evaluations, so asking for them with --language es is an error
+        "evaluations": ["singability_es"],
+    },
+}
+
+
+def line_pairs(against_song, song):
+    """Line pairs of two songs over their stanzas, as zip() pairs the lines of a song."""
+    return list(zip(sum(against_song, []), sum(song, [])))
+
+
+def flatten_pairs(against_songs, songs):
+    """(against lines, system lines, number of line pairs of each song)."""
+    against_lines, lines, song_lengths = [], [], []
+    for against_song, song in zip(against_songs, songs):
+        pairs = line_pairs(against_song, song)
+        against_lines += [against for against, _ in pairs]
+        lines += [line for _, line in pairs]
+        song_lengths.append(len(pairs))
+    return against_lines, lines, song_lengths
+
+
+def lemma_stage(against_lines, lines, context):
+    """Lemmas of every line, from the shared lemma store or parsed in a few UDPipe calls."""
+    from ufal.udpipe import Model
+    import lemma_store
+    config = context["config"]
+    model = Model.load(config["udpipe_model"])
+    if not model:
+        raise RuntimeError(f"Could not load UDPipe model {config['udpipe_model']}")
+    context["pipeline"] = lemma_store.batch_pipeline(model)
+    lemma_store.open_lemma_store(udpipe_model=config["udpipe_model"])
+    lines = list(dict.fromkeys(against_lines + lines))
+    parsed = lemma_store.tokens_and_lemmas_batch(lines, context["pipeline"])
+    context["lemmas"] = {line: lemmas for line, (_, lemmas) in zip(lines, parsed)}
+
+
+def synonym_stage(against_lines, lines, context):
+    """Synonyms of every reference word, fetched once for all systems, and the words whose lookup failed."""
+    import meteor_synonym
+    from meteor_core import build_cache_synonym_index
+    language = context["language"]
+    words = list(set(word for line in against_lines for word in line.split()))
+    meteor_synonym.load_synonym_cache(language)
+    meteor_synonym.preload_synonyms(words, context["pipeline"], language)
+    context["failed_synonyms"] = meteor_synonym.failed_lookups(words, language)
+    context["synonym_index"] = build_cache_synonym_index(synonym_store.iter_synonyms(language))
+
+
+def analyse_line_es(line):
+    """Syllable count and stress pattern of a Spanish line, in the form of analyse_line."""
+    return syllable_analyser_es.syllabize_sentence_es(line), syllable_analyser_es.stress_pattern_es(line), []
+
+
+def phonetics_stage(against_lines, lines, context):
+    """Syllables, stress and end rhyme parts of every English original and translated line."""
+    language = context["language"]
+    phonetics = {(line, "en"): pronunciation_index.lookup_line(line) for line in set(against_lines)}
+    if language == "es":
+        for line in set(lines):
+            phonetics[line, language] = analyse_line_es(line)
+    else:
+        from singability_analyser import analyse_line
+        if not irish_g2p.OFFLINE:
+            abair_prefetch.prefetch(list(dict.fromkeys(line for line in lines if line)))
+        for line in set(lines):
+            phonetics[line, language] = analyse_line(line, language)
+        if not irish_g2p.OFFLINE and irish_g2p.fallback_sentences:
+            print(f"Warning: Abair failed for {len(irish_g2p.fallback_sentences)} lines, phonetised locally. "
+                  f"Their songs are recomputed by the next run.")
+    context["phonetics"] = phonetics
+
+
+# Shared stages, run in this order before any evaluation
+STAGES = {"lemmas": lemma_stage, "synonyms": synonym_stage, "phonetics": phonetics_stage}
+
+
+def score_bleu(against_songs, songs, n_lines, context):
+    from sacrebleu.metrics import BLEU, CHRF
+    from bleu_score import scores_by_granularity
+    lemmas = context["lemmas"]
+    references, hypotheses, song_lengths = flatten_pairs(against_songs, songs)
+    scores = scores_by_granularity([" ".join(lemmas[line]) for line in hypotheses],
+                                   [" ".join(lemmas[line]) for line in references],
+                                   song_lengths, BLEU(effective_order=True), CHRF())["line"]
+    offsets = song_offsets(song_lengths)
+    return {
+        "sacrebleu": song_means(np.array([score.score for score in scores["bleu"]]), offsets).tolist(),
+        "chrf": song_means(np.array([score.score for score in scores["chrf"]]), offsets).tolist(),
+    }
+
+
+def score_meteor(against_songs, songs, n_lines, context):
+    from nltk.translate.meteor_score import meteor_score as nltk_meteor_score
+    lemmas = context["lemmas"]
+    references, hypotheses, song_lengths = flatten_pairs(against_songs, songs)
+    line_scores = [nltk_meteor_score([lemmas[ref]], lemmas[hyp]) for ref, hyp in zip(references, hypotheses)]
+    return {"meteor": song_means(np.array(line_scores, dtype=np.float64), song_offsets(song_lengths)).tolist()}
+
+
+def score_meteor_synonym(against_songs, songs, n_lines, context):
+    from meteor_core import score_lemma_lines
+    lemmas = context["lemmas"]
+    failed = context["failed_synonyms"]
+    references, hypotheses, song_lengths = flatten_pairs(against_songs, songs)
+    line_scores = score_lemma_lines([lemmas[line] for line in references], [lemmas[line] for line in hypotheses],
+                                    synonym_index=context["synonym_index"])
+    offsets = song_offsets(song_lengths)
+    return {"meteor_synonym": song_means(line_scores, offsets).tolist(),
+            "incomplete": [any(word in failed for line in references[start:end] for word in line.split())
+                           for start, end in zip(offsets, offsets[1:])]}
+
+
+def score_bert_score(against_songs, songs, n_lines, context):
+    import roberta_score
+    references, hypotheses, song_lengths = flatten_pairs(against_songs, songs)
+    # Reference embeddings are shared by the systems through the on-disk embedding cache
+    line_scores = roberta_score.score_lines(references, hypotheses)
+    return {"bert_score": song_means(np.array(line_scores, dtype=np.float64), song_offsets(song_lengths)).tolist()}
+
+
+def aligned_scores(og_analysis, hyp_analysis, n_lines):
+    """
+    syllable_diff and stress_diff of one system's songs over the first n_lines lines of
+    each song, the lines that every system has, as singability_analyser.py aligns them.
+    """
+    og_lines = [line for song, n in zip(og_analysis, n_lines) for line in sum(song, [])[:n]]
+    hyp_lines = [line for song, n in zip(hyp_analysis, n_lines) for line in sum(song, [])[:n]]
+    syllable_diffs, stress_diffs = song_syllable_stress_diffs(og_lines, {"system": hyp_lines}, song_offsets(n_lines))
+    return {"syllable_diff": [float(diff) for diff in syllable_diffs[0]],
+            "stress_diff": [float(diff) for diff in stress_diffs[0]]}
+
+
+def score_singability(against_songs, songs, n_lines, context):
+    from singability_analyser import song_rhyme_diffs
+    phonetics = context["phonetics"]
+    og_analysis = [[[phonetics[line, "en"] for line in stanza] for stanza in song] for song in against_songs]
+    hyp_analysis = [[[phonetics[line, "ga"] for line in stanza] for stanza in song] for song in songs]
+    results = aligned_scores(og_analysis, hyp_analysis, n_lines)
+    results["rhyme_diff"] = song_rhyme_diffs(against_songs, og_analysis, hyp_analysis)
+    # Lines Abair failed for were phonetised by irish_g2p, which an online run does not hash
+    fallback = set() if irish_g2p.OFFLINE else irish_g2p.fallback_sentences
+    return {**results, "incomplete": [any(line in fallback for stanza in song for line in stanza) for song in songs]}
+
+
+def score_singability_es(against_songs, songs, n_lines, context):
+    phonetics = context["phonetics"]
+    og_analysis = [[[phonetics[line, "en"] for line in stanza] for stanza in song] for song in against_songs]
+    hyp_analysis = [[[phonetics[line, "es"] for line in stanza] for stanza in song] for song in songs]
+    return aligned_scores(og_analysis, hyp_analysis, n_lines)
+
+
+# Evaluations by name. "against" is the file songs are scored against, "source" the
+# directory of the language config both files are read from, and "aligned" evaluations
+# only score the lines every system of the language has.
+EVALUATIONS = {
+    "bleu": {"metrics": ["sacrebleu", "chrf"], "stages": ["lemmas"], "against": "references.txt",
+             "source": "text_dir", "aligned": False, "score": score_bleu},
+    "meteor": {"metrics": ["meteor"], "stages": ["lemmas"], "against": "references.txt",
+               "source": "text_dir", "aligned": False, "score": score_meteor},
+    "meteor_synonym": {"metrics": ["meteor_synonym"], "stages": ["lemmas", "synonyms"], "against": "references.txt",
+                       "source": "text_dir", "aligned": False, "score": score_meteor_synonym},
+    "bert_score": {"metrics": ["bert_score"], "stages": [], "against": "references.txt",
+                   "source": "text_dir", "aligned": False, "score": score_bert_score},
+    "singability": {"metrics": ["syllable_diff", "stress_diff", "rhyme_diff"], "stages": ["phonetics"],
+                    "against": "originals.txt", "source": "singability_dir", "aligned": True,
+                    "score": score_singability},
+    "singability_es": {"metrics": ["syllable_diff", "stress_diff"], "stages": ["phonetics"],
+                       "against": "originals.txt", "source": "singability_dir", "aligned": True,
+                       "score": score_singability_es},
+}
+
+
+def evaluation_parameters(name, config):
+    """Everything besides the songs that an evaluation's results depend on."""
+    if name in ("bleu", "meteor", "meteor_synonym"):
+        return f"{name}|{config['udpipe_model']}"
+    if name == "bert_score":
+        import roberta_score
+        return f"{name}|{roberta_score.MODEL_TYPE}|{roberta_score.NUM_LAYERS}"
+    if name == "singability":
+        # Offline phonetisations may differ from Abair's
+        return f"{name}|{phonetics_store.DIALECT}|{phonetics_store.MAPPING}|{'offline' if irish_g2p.OFFLINE else 'abair'}"
+    return name
+
+
+def song_hash(parameters, against_song, song, n_lines=None):
+    text = "\n*\n".join([parameters, str(n_lines),
+                         "\n\n".join("\n".join(stanza) for stanza in against_song),
+                         "\n\n".join("\n".join(stanza) for stanza in song)])
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def stale_songs(system, metric, hashes, store_dir):
+    """Songs whose hash differs from the one recorded with the stored value."""
+    column, recorded = results_store.read_column_with_hashes(system, metric, store_dir)
+    return [i for i, song_hash in enumerate(hashes)
+            if i >= len(column) or i >= len(recorded) or recorded[i] != song_hash]
+
+
+def plan_jobs(config, evaluations, systems=None, force=False):
+    """
+    One job per (evaluation, system) with the songs to recompute.
+
+    :param systems: Systems to evaluate, all systems of the language by default.
+    :return: List of dicts with the evaluation, system, both song lists, aligned line
+        counts (None if not aligned), song hashes and the indices of stale songs.
+    """
+    songs_by_path = {}
+
+    def songs_of(path):
+        if path not in songs_by_path:
+            songs_by_path[path] = read_songs(path)
+        return songs_by_path[path]
+
+    jobs = []
+    for name in evaluations:
+        evaluation = EVALUATIONS[name]
+        directory = config[evaluation["source"]]
+        against_songs = songs_of(f"{directory}/{evaluation['against']}")
+        n_songs = len(against_songs)
+        system_songs = {system: songs_of(f"{directory}/{file_name}") for system, file_name in config["system_files"].items()
+                        if file_name != evaluation["against"]}
+        system_songs = {system: songs + [[]] * (n_songs - len(songs)) for system, songs in system_songs.items()}
+        n_lines = [None] * n_songs
+        if evaluation["aligned"]:
+            # The line count of a song depends on every system, so it is part of each system's inputs
+            n_lines = [min([len(sum(song, []))] + [len(sum(songs[i], [])) for songs in system_songs.values()])
+                       for i, song in enumerate(against_songs)]
+        parameters = evaluation_parameters(name, config)
+        for system, songs in system_songs.items():
+            if systems and system not in systems:
+                continue
+            hashes = [song_hash(parameters, against_songs[i], songs[i], n_lines[i]) for i in range(n_songs)]
+            stale = set(range(n_songs)) if force else set()
+            for metric in evaluation["metrics"]:
+                stale.update(stale_songs(system, metric, hashes, config["store_dir"]))
+            jobs.append({"evaluation": name, "system": system, "against_songs": against_songs, "songs": songs,
+                         "n_lines": n_lines, "hashes": hashes, "stale": sorted(stale)})
+    return jobs
+
+
+def store_values(system, metric, values, stale, hashes, store_dir):
+    """Write the recomputed songs of a column with their hashes."""
+    # Songs removed from the end of the files are dropped from the column too
+    if stale or len(results_store.read_column(system, metric, store_dir)) > len(hashes):
+        results_store.update_column(system, metric, stale, values, store_dir, [hashes[i] for i in stale], len(hashes))
+
+
+def run(language, evaluations=None, systems=None, force=False):
+    """Bring the stored results of a language up to date with its song files."""
+    config = LANGUAGES[language]
+    context = {"language": language, "config": config}
+    jobs = plan_jobs(config, config["evaluations"] if evaluations is None else evaluations, systems, force)
+
+    # Each stage runs once over the stale songs of every evaluation that needs it
+    for stage, run_stage in STAGES.items():
+        against_lines, lines = [], []
+        for job in jobs:
+            if stage in EVALUATIONS[job["evaluation"]]["stages"]:
+                for i in job["stale"]:
+                    against_lines += sum(job["against_songs"][i], [])
+                    lines += sum(job["songs"][i], [])
+        if against_lines or lines:
+            run_stage(against_lines, lines, context)
+
+    for job in jobs:
+        evaluation = EVALUATIONS[job["evaluation"]]
+        stale = job["stale"]
+        values = {}
+        if stale:
+            values = evaluation["score"]([job["against_songs"][i] for i in stale], [job["songs"][i] for i in stale],
+                                         [job["n_lines"][i] for i in stale], context)
+        # Songs scored without some of their inputs (failed Abair or synonym lookups) are
+        # stored without a hash, so they stay stale until a run has everything they need
+        hashes = list(job["hashes"])
+        for i, incomplete in zip(stale, values.get("incomplete", [])):
+            if incomplete:
+                hashes[i] = ""
+        for metric in evaluation["metrics"]:
+            store_values(job["system"], metric, values.get(metric, []), stale, hashes, config["store_dir"])
+        print(f"{language} {job['system']} {job['evaluation']}: {len(stale)} of {len(job['hashes'])} songs recomputed")
+
+    if "pipeline" in context:
+        import lemma_store
+        lemma_store.close_lemma_store()
+    if "synonym_index" in context:
+        synonym_store.close_synonym_store()
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    languages = list(LANGUAGES)
+    if "--language" in args:
+        languages = [args[args.index("--language") + 1]]
+        del args[args.index("--language"):args.index("--language") + 2]
+    evaluations = None
+    if "--evaluations" in args:
+        evaluations = args[args.index("--evaluations") + 1].split(",")
+        del args[args.index("--evaluations"):args.index("--evaluations") + 2]
+    irish_g2p.OFFLINE = "--offline" in args
+    force = "--force" in args
+    systems = [arg for arg in args if arg not in ("--offline", "--force")]
+    for name in evaluations or []:
+        if not any(name in LANGUAGES[language]["evaluations"] for language in languages):
+            print(f"Error: {name} is not an evaluation of {', '.join(languages)}.")
+            exit(1)
+
+    for language in languages:
+        run(language, [name for name in evaluations if name in LANGUAGES[language]["evaluations"]] if evaluations else None,
+            systems, force)
@@ -0,0 +1,205 @@
+import contextlib
+import fcntl
+import json
+import os
+import sys
+import numpy as np
+
+# Columnar per-song results shared by the semantics and singability evaluators.
+# Every (system, metric) pair is one float64 column of per-song values, NaN where a
+# song has no value, saved as <store>/<system>/<metric>.npy. A column is written to a
+# temporary file and renamed over the old one, so readers never see a partial column,
+# and evaluators writing different metrics never touch the same file. Every write of a
+# column, whole or partial, holds an exclusive lock on the system's <store>/<system>/.lock,
+# and reading a column together with its hashes holds a shared one, so the two always
+# belong together; one lock file per system leaves nothing to clean up. The results_by_song JSON
+# layout (one object per song with "index" and one key per metric) is exported on
+# demand, and existing JSON files can be imported. Next to a column, evaluation_runner.py
+# records the hash of every song's inputs in <metric>.hashes.json to find stale songs.
+#   python results_store.py export <system> [json path]
+#   python results_store.py import <system> <json path>
+#   python results_store.py summary
+RESULTS_STORE_DIR = "results_store"
+# Metric order of the exported JSON objects, other metrics follow alphabetically
+METRIC_ORDER = ["sacrebleu", "chrf", "meteor", "meteor_synonym", "bert_score", "syllable_diff", "stress_diff", "rhyme_diff"]
+
+
+def column_path(system, metric, store_dir=RESULTS_STORE_DIR):
+    return os.path.join(store_dir, system, f"{metric}.npy")
+
+
+def hashes_path(system, metric, store_dir=RESULTS_STORE_DIR):
+    return os.path.join(store_dir, system, f"{metric}.hashes.json")
+
+
+@contextlib.contextmanager
+def system_lock(system, store_dir=RESULTS_STORE_DIR, shared=False):
+    """Hold the lock file of a system's columns, exclusive for writers and shared for readers."""
+    directory = os.path.join(store_dir, system)
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, ".lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        yield
+
+
+def replace_column(system, metric, values, store_dir=RESULTS_STORE_DIR, hashes=None):
+    """write_column for a caller that already holds the system's lock."""
+    path = column_path(system, metric, store_dir)
+    # The old hashes go first, so they are never read alongside the new values
+    if os.path.exists(hashes_path(system, metric, store_dir)):
+        os.remove(hashes_path(system, metric, store_dir))
+    tmp_path = f"{path}.{os.getpid()}.tmp.npy"
+    np.save(tmp_path, np.asarray(values, dtype=np.float64))
+    os.replace(tmp_path, path)
+    if hashes is not None:
+        write_json_atomic(hashes_path(system, metric, store_dir), list(hashes))
+
+
+def write_column(system, metric, values, store_dir=RESULTS_STORE_DIR, hashes=None):
+    """
+    Replace the column of a metric with one value per song, atomically.
+
+    :param hashes: Input hash of every song the values were computed from. Without
+        them the recorded hashes are dropped, so the runner recomputes the column once.
+    """
+    with system_lock(system, store_dir):
+        replace_column(system, metric, values, store_dir, hashes)
+
+
+def update_column(system, metric, indices, values, store_dir=RESULTS_STORE_DIR, hashes=None, n_songs=None):
+    """
+    Set the values of some songs in a column, keeping the others.
+
+    The column grows with NaN if an index is past its end. The read-modify-write
+    holds the system's lock, so no other write of the column is lost.
+
+    :param hashes: Input hashes of the updated songs, aligned with indices.
+    :param n_songs: Length of the column afterwards, songs past it are dropped.
+    """
+    indices = np.asarray(indices, dtype=np.int64)
+    with system_lock(system, store_dir):
+        column = read_column(system, metric, store_dir)
+        size = max(len(column), int(indices.max()) + 1 if len(indices) else 0) if n_songs is None else n_songs
+        column = np.concatenate([column[:size], np.full(max(size - len(column), 0), np.nan)])
+        column[indices] = values
+        if hashes is not None:
+            song_hashes = read_hashes(system, metric, store_dir)[:size]
+            song_hashes += [""] * (size - len(song_hashes))
+            for i, song_hash in zip(indices.tolist(), hashes):
+                song_hashes[i] = song_hash
+            hashes = song_hashes
+        replace_column(system, metric, column, store_dir, hashes)
+
+
+def read_column(system, metric, store_dir=RESULTS_STORE_DIR):
+    """Values of a metric per song, an empty array if it was never written."""
+    path = column_path(system, metric, store_dir)
+    if not os.path.exists(path):
+        return np.zeros(0)
+    return np.load(path)
+
+
+def read_hashes(system, metric, store_dir=RESULTS_STORE_DIR):
+    """Recorded input hash of every song of a column, an empty list if there are none."""
+    path = hashes_path(system, metric, store_dir)
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def read_column_with_hashes(system, metric, store_dir=RESULTS_STORE_DIR):
+    """(read_column, read_hashes) of a column, read under the system's lock so they match."""
+    if not os.path.exists(column_path(system, metric, store_dir)):
+        return np.zeros(0), []
+    with system_lock(system, store_dir, shared=True):
+        return read_column(system, metric, store_dir), read_hashes(system, metric, store_dir)
+
+
+def write_json_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(data, file, indent=4, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def list_systems(store_dir=RESULTS_STORE_DIR):
+    if not os.path.isdir(store_dir):
+        return []
+    return sorted(name for name in os.listdir(store_dir) if os.path.isdir(os.path.join(store_dir, name)))
+
+
+def list_metrics(system, store_dir=RESULTS_STORE_DIR):
+    """Metrics of a system in METRIC_ORDER, then the others alphabetically."""
+    directory = os.path.join(store_dir, system)
+    if not os.path.isdir(directory):
+        return []
+    metrics = [name[:-len(".npy")] for name in os.listdir(directory)
+               if name.endswith(".npy") and not name.endswith(".tmp.npy")]
+    return sorted(metrics, key=lambda metric: (METRIC_ORDER.index(metric) if metric in METRIC_ORDER else len(METRIC_ORDER), metric))
+
+
+def read_results(systems=None, metrics=None, store_dir=RESULTS_STORE_DIR):
+    """
+    All requested columns as one array.
+
+    :param systems: Systems to read, all stored systems by default.
+    :param metrics: Metrics to read, every metric of any requested system by default.
+    :return: (array of shape (songs, metrics, systems) padded with NaN, metrics, systems).
+    """
+    systems = list_systems(store_dir) if systems is None else list(systems)
+    if metrics is None:
+        metrics = []
+        for system in systems:
+            metrics += [metric for metric in list_metrics(system, store_dir) if metric not in metrics]
+    columns = {(metric, system): read_column(system, metric, store_dir) for metric in metrics for system in systems}
+    n_songs = max([len(column) for column in columns.values()] + [0])
+    results = np.full((n_songs, len(metrics), len(systems)), np.nan)
+    for m, metric in enumerate(metrics):
+        for s, system in enumerate(systems):
+            column = columns[metric, system]
+            results[:len(column), m, s] = column
+    return results, metrics, systems
+
+
+def export_json(system, json_path, store_dir=RESULTS_STORE_DIR):
+    """Write a system's results in the results_by_song layout, leaving out missing values."""
+    results, metrics, _ = read_results([system], store_dir=store_dir)
+    song_objects = []
+    for i in range(results.shape[0]):
+        song_object = {"index": i}
+        for m, metric in enumerate(metrics):
+            if not np.isnan(results[i, m, 0]):
+                song_object[metric] = float(results[i, m, 0])
+        song_objects.append(song_object)
+    directory = os.path.dirname(json_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    write_json_atomic(json_path, song_objects)
+
+
+def import_json(system, json_path, store_dir=RESULTS_STORE_DIR):
+    """Store every numeric metric of a results_by_song file as columns of system."""
+    with open(json_path, "r", encoding="utf-8") as file:
+        song_objects = json.load(file)
+    metrics = {metric for song_object in song_objects for metric, value in song_object.items()
+               if metric != "index" and isinstance(value, (int, float))}
+    for metric in metrics:
+        write_column(system, metric, [song_object.get(metric, np.nan) for song_object in song_objects], store_dir)
+
+
+if __name__ == '__main__':
+    command = sys.argv[1]
+    if command == "export":
+        export_json(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else f"results_by_song/{sys.argv[2]}.json")
+    elif command == "import":
+        import_json(sys.argv[2], sys.argv[3])
+    elif command == "summary":
+        results, metrics, systems = read_results()
+        counts = np.count_nonzero(~np.isnan(results), axis=0)
+        means = np.where(counts > 0, np.nansum(results, axis=0) / np.maximum(counts, 1), np.nan)
+        print(" " * 16 + "".join(f"{system:>14}" for system in systems))
+        for m, metric in enumerate(metrics):
+            print(f"{metric:<16}" + "".join(f"{mean:>14.4f}" for mean in means[m]))
+    else:
+        print(f"Unknown command {command}, expected export, import or summary")
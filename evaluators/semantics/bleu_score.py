@@ -1,31 +1,162 @@
 from sacrebleu.metrics import BLEU, CHRF
+from sacrebleu.metrics.helpers import extract_all_char_ngrams, extract_all_word_ngrams, extract_word_ngrams
 from tqdm import tqdm
-from ufal.udpipe import Model, Pipeline
-import json
+from ufal.udpipe import Model
+from lemma_store import batch_pipeline, close_lemma_store, open_lemma_store, tokens_and_lemmas_batch
+import os
+import sys
+import numpy as np
+# results_store.py is shared with the singability evaluators, song_arrays.py with their analysers
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "singability"))
+import results_store
+from song_arrays import song_means, song_offsets
 
 
-def lemmatise(sentence, pipeline):
-    sen_output = pipeline.process(sentence.strip())
-    _ , sen_lemmas = extract_tokens_and_lemmas(sen_output)
-    return " ".join(sen_lemmas)
+def extract_statistics(hypotheses, references, bleu, chrf):
+    """
+    Extract BLEU and chrF n-gram counts for every line pair once.
 
+    Every n-gram is interned to an integer id (with its metric order kept in
+    "slots") and its counts stored in flat arrays, so the match statistics of any
+    grouping of lines (line, song, whole dataset) can later be rebuilt by summing
+    counts instead of re-tokenising.
 
-def extract_tokens_and_lemmas(conllu_output):
+    :param hypotheses: List of hypothesis lines.
+    :param references: List of reference lines, aligned with hypotheses.
+    :return: Dict of numpy arrays, consumed by group_statistics.
     """
-    Extract tokens and lemmas from CoNLL-U format output.
-    
-    :param conllu_output: CoNLL-U format string.
-    :return: A tuple of (tokens, lemmas).
+    bleu_order = bleu.max_ngram_order
+    # BLEU word n-grams, chrF character n-grams and chrF word n-grams each get their own id space.
+    # Every counter holds the n-grams of one order, so the slot is known when an n-gram is first interned.
+    vocabularies = [({}, 0), ({}, bleu_order), ({}, bleu_order + chrf.char_order)]
+    slots = []
+    columns = {"hyp": ([], [], []), "ref": ([], [], [])}  # line, ngram id, count
+    lengths = np.zeros((len(hypotheses), 2), dtype=np.int64)
+
+    def add_counts(i, counter, vocabulary, n, side):
+        ids, first_slot = vocabulary
+        for ngram in counter:
+            if ngram not in ids:
+                ids[ngram] = len(slots)
+                slots.append(first_slot + n - 1)
+        line_column, ngram_column, count_column = columns[side]
+        line_column.extend([i] * len(counter))
+        ngram_column.extend(map(ids.__getitem__, counter))
+        count_column.extend(counter.values())
+
+    for i, (hyp, ref) in enumerate(zip(hypotheses, references)):
+        for j, (sentence, side) in enumerate(((hyp, "hyp"), (ref, "ref"))):
+            segment = bleu._preprocess_segment(sentence)
+            for n in range(1, bleu_order + 1):
+                ngrams, lengths[i, j] = extract_all_word_ngrams(segment, n, n)
+                add_counts(i, ngrams, vocabularies[0], n, side)
+
+            sentence = chrf._preprocess_segment(sentence)
+            for n, counter in enumerate(extract_all_char_ngrams(sentence, chrf.char_order, chrf.whitespace), 1):
+                add_counts(i, counter, vocabularies[1], n, side)
+            if chrf.word_order > 0:
+                words = chrf._remove_punctuation(sentence)
+                for n in range(1, chrf.word_order + 1):
+                    add_counts(i, extract_word_ngrams(words, n), vocabularies[2], n, side)
+
+    statistics = {
+        "slots": np.array(slots, dtype=np.int64),
+        "lengths": lengths,
+        "n_slots": bleu_order + chrf.order,
+    }
+    for side, (line_column, ngram_column, count_column) in columns.items():
+        statistics[f"{side}_line"] = np.array(line_column, dtype=np.int64)
+        statistics[f"{side}_ngram"] = np.array(ngram_column, dtype=np.int64)
+        statistics[f"{side}_count"] = np.array(count_column, dtype=np.int64)
+    return statistics
+
+
+def group_statistics(statistics, groups, n_groups, bleu_order):
+    """
+    Build BLEU and chrF sufficient statistics with each group of lines treated as one segment.
+
+    N-gram counts are summed per (group, n-gram) before clipping, which is what
+    scoring the concatenated group as a single segment would do.
+
+    :param groups: Array mapping each line to its group id.
+    :return: (bleu_stats, chrf_stats) arrays with one row per group in sacrebleu's layout.
+    """
+    n_ngrams = len(statistics["slots"])
+    n_slots = statistics["n_slots"]
+    hyp_keys = groups[statistics["hyp_line"]] * n_ngrams + statistics["hyp_ngram"]
+    ref_keys = groups[statistics["ref_line"]] * n_ngrams + statistics["ref_ngram"]
+    keys, inverse = np.unique(np.concatenate([hyp_keys, ref_keys]), return_inverse=True)
+    n_hyp = len(hyp_keys)
+    hyp = np.bincount(inverse[:n_hyp], weights=statistics["hyp_count"], minlength=len(keys))
+    ref = np.bincount(inverse[n_hyp:], weights=statistics["ref_count"], minlength=len(keys))
+    match = np.minimum(hyp, ref)
+
+    # Reduce (group, n-gram) totals to (group, slot) totals
+    cell = (keys // n_ngrams) * n_slots + statistics["slots"][keys % n_ngrams]
+    size = n_groups * n_slots
+    hyp_total = np.bincount(cell, weights=hyp, minlength=size).reshape(n_groups, n_slots).astype(np.int64)
+    ref_total = np.bincount(cell, weights=ref, minlength=size).reshape(n_groups, n_slots).astype(np.int64)
+    match_total = np.bincount(cell, weights=match, minlength=size).reshape(n_groups, n_slots).astype(np.int64)
+
+    lengths = np.zeros((n_groups, 2), dtype=np.int64)
+    np.add.at(lengths, groups, statistics["lengths"])
+    bleu_stats = np.hstack([lengths, match_total[:, :bleu_order], hyp_total[:, :bleu_order]])
+
+    # chrF layout is [hyp, ref, match] per order, hyp only counted where the reference has n-grams
+    chrf_hyp = np.where(ref_total[:, bleu_order:] > 0, hyp_total[:, bleu_order:], 0)
+    chrf_stats = np.stack([chrf_hyp, ref_total[:, bleu_order:], match_total[:, bleu_order:]], axis=2).reshape(n_groups, -1)
+    return bleu_stats, chrf_stats
+
+
+def scores_by_granularity(hypotheses, references, song_lengths, bleu, chrf):
+    """
+    Compute BLEU and chrF at every granularity reported in results.txt from one extraction pass.
+
+    :param song_lengths: Number of line pairs in each song, in order.
+    :return: Dict with "line", "song" and "dataset" entries, each holding "bleu" and "chrf"
+        lists of scores, plus "lines_as_corpus" and "songs_as_corpus": corpus scores over
+        line and song segments.
     """
-    tokens = []
-    lemmas = []
-    for line in conllu_output.splitlines():
-        if line and not line.startswith("#"):
-            columns = line.split("\t")
-            if len(columns) > 2:  # Ensure the line has enough columns
-                tokens.append(columns[1])  # FORM is in the 2nd column
-                lemmas.append(columns[2])  # LEMMA is in the 3rd column
-    return tokens, lemmas
+    statistics = extract_statistics(hypotheses, references, bleu, chrf)
+    n_lines = len(statistics["lengths"])
+    song_of_line = np.repeat(np.arange(len(song_lengths)), song_lengths)
+    groupings = {
+        "line": (np.arange(n_lines), n_lines),
+        "song": (song_of_line, len(song_lengths)),
+        "dataset": (np.zeros(n_lines, dtype=np.int64), 1),
+    }
+
+    results = {}
+    for name, (groups, n_groups) in groupings.items():
+        bleu_stats, chrf_stats = group_statistics(statistics, groups, n_groups, bleu.max_ngram_order)
+        results[name] = {
+            "bleu": [bleu._compute_score_from_stats(row) for row in bleu_stats],
+            "chrf": [chrf._compute_score_from_stats(row) for row in chrf_stats],
+        }
+        if name in ("line", "song"):
+            results[f"{name}s_as_corpus"] = {
+                "bleu": bleu._compute_score_from_stats(bleu_stats.sum(axis=0)),
+                "chrf": chrf._compute_score_from_stats(chrf_stats.sum(axis=0)),
+            }
+    return results
+
+
+def check_against_sacrebleu(hypotheses, references, song_lengths, bleu, chrf):
+    """
+    Compare scores_by_granularity with sacrebleu's own sentence and corpus scores.
+
+    :return: Number of scores that differ by more than rounding.
+    """
+    scores = scores_by_granularity(hypotheses, references, song_lengths, bleu, chrf)
+    mismatches = 0
+    for metric, name in ((bleu, "bleu"), (chrf, "chrf")):
+        expected = [metric.sentence_score(hyp, [ref]).score for hyp, ref in zip(hypotheses, references)]
+        mismatches += sum(not np.isclose(score.score, value) for score, value in zip(scores["line"][name], expected))
+        corpus = metric.corpus_score(hypotheses, [references]).score
+        mismatches += not np.isclose(scores["lines_as_corpus"][name].score, corpus)
+        print(f"{metric.__class__.__name__}: corpus {corpus:.4f}, lines as corpus {scores['lines_as_corpus'][name].score:.4f}")
+    return mismatches
 
 
 # Function to split lines into songs based on the "*" delimiter
@@ -45,46 +176,66 @@ def split_into_songs(lines):
 
 
 if __name__ == '__main__':
+    if "--check" in sys.argv:
+        # The extracted statistics must score like sacrebleu, chrF++ included:
+        #   python bleu_score.py --check
+        with open("ga_txt_files/nllbs.txt", "r", encoding="utf-8") as f:
+            test_songs = split_into_songs([line.strip() for line in f])
+        with open("ga_txt_files/references.txt", "r", encoding="utf-8") as f:
+            ref_songs = split_into_songs([line.strip() for line in f])
+        pairs = [list(zip(ref_song, hyp_song)) for ref_song, hyp_song in zip(ref_songs, test_songs)]
+        mismatches = check_against_sacrebleu([hyp for song in pairs for _, hyp in song],
+                                             [ref for song in pairs for ref, _ in song],
+                                             [len(song) for song in pairs],
+                                             BLEU(effective_order=True), CHRF(word_order=2))
+        print(f"{mismatches} scores differ from sacrebleu")
+        exit(1 if mismatches else 0)
+
     # Set up lemmatisesr
     model = Model.load("irish-idt-ud-2.5-191206.udpipe")
     if not model:
         print("Error: Could not load the UDPipe model.")
         exit(1)
-    # Create a pipeline for tokenization and lemmatization
-    pipeline = Pipeline(model, "tokenize", Pipeline.DEFAULT, Pipeline.DEFAULT, "conllu")
+    # Create a pipeline for tokenization and lemmatization, fed whole files at a time
+    pipeline = batch_pipeline(model)
+    # Lines already parsed by any metric are read back from the shared store
+    open_lemma_store()
 
     # Load hypothesis translations (machine-generated)
     with open("ga_txt_files/nllbs.txt", "r", encoding="utf-8") as f: 
         # With lemmatisation
-        test_lines = [lemmatise(line.strip(), pipeline) for line in f.readlines()]
+        test_lines = [" ".join(lemmas) for _, lemmas in tokens_and_lemmas_batch(f.readlines(), pipeline)]
 
     # Load reference translations
     with open("ga_txt_files/references.txt", "r", encoding="utf-8") as f:
         # With lemmatisation
-        references = [lemmatise(line.strip(), pipeline) for line in f.readlines()]
+        references = [" ".join(lemmas) for _, lemmas in tokens_and_lemmas_batch(f.readlines(), pipeline)]
+    close_lemma_store()
     
     # Split references and test_lines into songs
     ref_songs = split_into_songs(references)
     test_songs = split_into_songs(test_lines)
 
-    song_results = []
+    # Flatten the aligned songs, n-gram statistics are extracted once for all granularities
+    hypotheses, flat_references, song_lengths = [], [], []
+    for ref_song, hyp_song in zip(ref_songs, test_songs):
+        pairs = list(zip(ref_song, hyp_song))
+        flat_references += [ref_line for ref_line, _ in pairs]
+        hypotheses += [hyp_line for _, hyp_line in pairs]
+        song_lengths.append(len(pairs))
+
     # Compute BLEU score
     bleu = BLEU(effective_order=True)
     chrf = CHRF()
-    for i, (ref_song, hyp_song) in enumerate(zip(ref_songs, test_songs)):
-        song_object = {
-            "index": i,
-        }
-        bleu_score = 0
-        chrf_score = 0
-        for j, (ref_line, hyp_line) in enumerate(zip(ref_song, hyp_song)):
-            bleu_score += bleu.sentence_score(ref_line, hyp_line).score
-            chrf_score += chrf.sentence_score(ref_line, hyp_line).score
-
-        song_object["sacrebleu"] = bleu_score/len(ref_song)
-        song_object["chrf"] = chrf_score/len(ref_song)
+    scores = scores_by_granularity(hypotheses, flat_references, song_lengths, bleu, chrf)
 
-        song_results.append(song_object)
+    print("line -> lyric sentence:")
+    print(f"    {scores['lines_as_corpus']['bleu']}\n    {scores['lines_as_corpus']['chrf']}")
+    print("line -> whole song:")
+    print(f"    {scores['songs_as_corpus']['bleu']}\n    {scores['songs_as_corpus']['chrf']}")
+    print("line -> entire dataset:")
+    print(f"    {scores['dataset']['bleu'][0]}\n    {scores['dataset']['chrf'][0]}")
 
-    with open("results_by_song/nllb.json", "w", encoding="utf-8") as file:
-        json.dump(song_results, file, indent=4, ensure_ascii=False)
+    offsets = song_offsets(song_lengths)
+    results_store.write_column("nllb", "sacrebleu", song_means(np.array([score.score for score in scores["line"]["bleu"]]), offsets))
+    results_store.write_column("nllb", "chrf", song_means(np.array([score.score for score in scores["line"]["chrf"]]), offsets))
@@ -0,0 +1,123 @@
+import glob
+import hashlib
+import json
+import os
+import unicodedata
+import uuid
+from collections import defaultdict
+from math import log
+import numpy as np
+from bert_score.utils import get_idf_dict
+
+# On-disk store of per-token contextual embeddings for reference lines.
+# Layout:
+#   index_<shard>.json      key -> [shard, offset, length] for the sentences in that shard
+#   embeddings_<shard>.npy  float32 (tokens, hidden) rows for every cached sentence
+#   token_ids_<shard>.npy   int32 (tokens,) token ids, used to rebuild idf weights
+#   idf_<hash>.json         idf table for a given reference set (only when idf=True)
+# Shards are never modified once written and are opened memory-mapped, so any
+# number of worker processes can read the same store without copying it. Every
+# writer creates its own uniquely named shard, so workers can also add to the
+# store at the same time without a lock.
+CACHE_DIR = "evaluators/semantics/embedding_cache"
+
+index = {}
+shards = {}
+
+
+def normalise_sentence(sentence):
+    """Normalise a line before hashing and encoding so equivalent lines share one entry."""
+    return " ".join(unicodedata.normalize("NFC", sentence).split())
+
+
+def cache_key(sentence, model_type, num_layers):
+    text = f"{model_type}|{num_layers}|{normalise_sentence(sentence)}"
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def load_embedding_cache(cache_dir=CACHE_DIR):
+    index.clear()
+    shards.clear()
+    for index_path in sorted(glob.glob(os.path.join(cache_dir, "index_*.json"))):
+        with open(index_path, "r", encoding="utf-8") as f:
+            try:
+                index.update(json.load(f))
+            except json.JSONDecodeError:
+                print(f"Warning: Invalid embedding cache index {index_path}. Skipping it.")
+
+
+def get_shard(shard, cache_dir=CACHE_DIR):
+    if shard not in shards:
+        shards[shard] = (
+            np.load(os.path.join(cache_dir, f"embeddings_{shard}.npy"), mmap_mode="r"),
+            np.load(os.path.join(cache_dir, f"token_ids_{shard}.npy"), mmap_mode="r"),
+        )
+    return shards[shard]
+
+
+def get_cached_embedding(key, cache_dir=CACHE_DIR):
+    """
+    Look up a cached sentence.
+
+    :return: (embeddings, token_ids) as read-only memory-mapped arrays, or None on a miss.
+    """
+    if key not in index:
+        return None
+    shard, offset, length = index[key]
+    embeddings, token_ids = get_shard(shard, cache_dir)
+    return embeddings[offset:offset + length], token_ids[offset:offset + length]
+
+
+def add_embeddings(entries, cache_dir=CACHE_DIR):
+    """
+    Append new sentences to the store as a fresh shard.
+
+    :param entries: Dict of key -> (embeddings (tokens, hidden), token_ids (tokens,)).
+    """
+    entries = {key: value for key, value in entries.items() if key not in index}
+    if not entries:
+        return
+    os.makedirs(cache_dir, exist_ok=True)
+    shard = uuid.uuid4().hex
+
+    shard_index = {}
+    offset = 0
+    for key, (embeddings, _) in entries.items():
+        shard_index[key] = [shard, offset, len(embeddings)]
+        offset += len(embeddings)
+    np.save(os.path.join(cache_dir, f"embeddings_{shard}.npy"),
+            np.concatenate([np.asarray(emb, dtype=np.float32) for emb, _ in entries.values()]))
+    np.save(os.path.join(cache_dir, f"token_ids_{shard}.npy"),
+            np.concatenate([np.asarray(ids, dtype=np.int32) for _, ids in entries.values()]))
+
+    # Write the shard's index last and atomically so readers never see a shard that is not there yet
+    write_json_atomic(os.path.join(cache_dir, f"index_{shard}.json"), shard_index)
+    index.update(shard_index)
+
+
+def write_json_atomic(path, data):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def load_idf_dict(references, tokenizer, model_type, cache_dir=CACHE_DIR):
+    """Load the idf table for this set of references, computing and storing it on first use."""
+    digest = hashlib.sha1(model_type.encode("utf-8"))
+    for reference in references:
+        digest.update(reference.encode("utf-8") + b"\n")
+    idf_path = os.path.join(cache_dir, f"idf_{digest.hexdigest()}.json")
+
+    if os.path.exists(idf_path):
+        with open(idf_path, "r", encoding="utf-8") as f:
+            stored = json.load(f)
+        num_docs = stored["num_docs"]
+        idf_dict = defaultdict(lambda: log((num_docs + 1) / 1))
+        idf_dict.update({int(token): value for token, value in stored["idf"].items()})
+        return idf_dict
+
+    idf_dict = get_idf_dict(references, tokenizer)
+    os.makedirs(cache_dir, exist_ok=True)
+    write_json_atomic(idf_path, {"num_docs": len(references), "idf": {str(token): value for token, value in idf_dict.items()}})
+    return idf_dict
@@ -0,0 +1,215 @@
+import json
+import sqlite3
+import threading
+from ufal.udpipe import Pipeline
+
+# Content-addressed store of UDPipe output shared by BLEU, METEOR and synonym METEOR.
+# Rows are keyed by (udpipe model, line text), so every unique line is parsed once
+# no matter how many metrics or MT systems it is scored for.
+LEMMA_CACHE_FILE = "ga_txt_files/lemma_cache.sqlite"
+UDPIPE_MODEL = "irish-idt-ud-2.5-191206.udpipe"
+COMMIT_EVERY = 500  # Pending inserts before a commit
+BATCH_LINES = 2000  # Lines sent to UDPipe in one pipeline.process call
+SQL_CHUNK = 500  # Lines per SELECT ... IN (...) lookup, below sqlite's variable limit
+
+connection = None
+model_name = UDPIPE_MODEL
+pending = 0
+lock = threading.Lock()  # The evaluators call in from thread pools
+
+
+def open_lemma_store(path=LEMMA_CACHE_FILE, udpipe_model=UDPIPE_MODEL):
+    global connection, model_name
+    model_name = udpipe_model
+    # Worker processes write to the same file, wait for their lock instead of failing
+    connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+    # WAL lets several evaluator processes read while one of them writes
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS lemmas ("
+        "model TEXT NOT NULL, line TEXT NOT NULL, tokens TEXT NOT NULL, lemmas TEXT NOT NULL, "
+        "PRIMARY KEY (model, line))"
+    )
+    connection.commit()
+
+
+def close_lemma_store():
+    global connection, pending
+    if connection is not None:
+        with lock:
+            connection.commit()
+            connection.close()
+            connection = None
+            pending = 0
+
+
+def extract_tokens_and_lemmas(conllu_output):
+    """
+    Extract tokens and lemmas from CoNLL-U format output.
+
+    :param conllu_output: CoNLL-U format string.
+    :return: A tuple of (tokens, lemmas).
+    """
+    tokens = []
+    lemmas = []
+    for line in conllu_output.splitlines():
+        if line and not line.startswith("#"):
+            columns = line.split("\t")
+            if len(columns) > 2:  # Ensure the line has enough columns
+                tokens.append(columns[1])  # FORM is in the 2nd column
+                lemmas.append(columns[2])  # LEMMA is in the 3rd column
+    return tokens, lemmas
+
+
+def lookup(line):
+    """Return the stored (tokens, lemmas) for a line, or None if it has not been parsed yet."""
+    with lock:
+        row = connection.execute(
+            "SELECT tokens, lemmas FROM lemmas WHERE model = ? AND line = ?", (model_name, line)
+        ).fetchone()
+    if row is None:
+        return None
+    return json.loads(row[0]), json.loads(row[1])
+
+
+def store(line, tokens, lemmas):
+    global pending
+    with lock:
+        connection.execute(
+            "INSERT OR REPLACE INTO lemmas (model, line, tokens, lemmas) VALUES (?, ?, ?, ?)",
+            (model_name, line, json.dumps(tokens, ensure_ascii=False), json.dumps(lemmas, ensure_ascii=False)),
+        )
+        pending += 1
+        if pending >= COMMIT_EVERY:
+            connection.commit()
+            pending = 0
+
+
+def lookup_many(lines):
+    """Return a dict of line -> (tokens, lemmas) for the lines that are already stored."""
+    found = {}
+    lines = list(lines)
+    with lock:
+        for start in range(0, len(lines), SQL_CHUNK):
+            chunk = lines[start:start + SQL_CHUNK]
+            rows = connection.execute(
+                f"SELECT line, tokens, lemmas FROM lemmas WHERE model = ? AND line IN ({','.join('?' * len(chunk))})",
+                [model_name] + chunk,
+            ).fetchall()
+            for line, tokens, lemmas in rows:
+                found[line] = (json.loads(tokens), json.loads(lemmas))
+    return found
+
+
+def store_many(parsed):
+    """Insert a dict of line -> (tokens, lemmas) in one transaction."""
+    with lock:
+        connection.executemany(
+            "INSERT OR REPLACE INTO lemmas (model, line, tokens, lemmas) VALUES (?, ?, ?, ?)",
+            [
+                (model_name, line, json.dumps(tokens, ensure_ascii=False), json.dumps(lemmas, ensure_ascii=False))
+                for line, (tokens, lemmas) in parsed.items()
+            ],
+        )
+        connection.commit()
+
+
+def batch_pipeline(model):
+    """Pipeline for tokens_and_lemmas_batch: presegmented, so every input line comes back as one sentence."""
+    return Pipeline(model, "tokenize=presegmented", Pipeline.DEFAULT, Pipeline.DEFAULT, "conllu")
+
+
+def iter_conllu_sentences(conllu_output):
+    """
+    Stream (tokens, lemmas) for each sentence of a multi-sentence CoNLL-U document.
+
+    Sentences are separated by blank lines; the document is walked once.
+    """
+    tokens = []
+    lemmas = []
+    in_sentence = False
+    for line in conllu_output.split("\n"):
+        if not line:
+            if in_sentence:
+                yield tokens, lemmas
+                tokens, lemmas = [], []
+                in_sentence = False
+        elif line.startswith("#"):
+            in_sentence = True
+        else:
+            in_sentence = True
+            columns = line.split("\t")
+            if len(columns) > 2:  # Ensure the line has enough columns
+                tokens.append(columns[1])  # FORM is in the 2nd column
+                lemmas.append(columns[2])  # LEMMA is in the 3rd column
+    if in_sentence:
+        yield tokens, lemmas
+
+
+def parse_lines(lines, pipeline):
+    """
+    Parse many lines with as few pipeline.process calls as possible.
+
+    :param lines: Non-empty, stripped lines without embedded newlines.
+    :param pipeline: A presegmented pipeline (see batch_pipeline).
+    :return: Dict of line -> (tokens, lemmas).
+    """
+    parsed = {}
+    for start in range(0, len(lines), BATCH_LINES):
+        chunk = lines[start:start + BATCH_LINES]
+        sentences = list(iter_conllu_sentences(pipeline.process("\n".join(chunk) + "\n")))
+        if len(sentences) == len(chunk):
+            parsed.update(zip(chunk, sentences))
+        else:
+            # Sentence boundaries did not survive the round trip, fall back to one call per line
+            for line in chunk:
+                parsed[line] = extract_tokens_and_lemmas(pipeline.process(line))
+    return parsed
+
+
+def tokens_and_lemmas_batch(lines, pipeline):
+    """
+    Get the tokens and lemmas of many lines at once.
+
+    Lines missing from the store are sent to UDPipe in blocks of BATCH_LINES and
+    demultiplexed back to their input positions.
+
+    :param lines: List of input lines.
+    :param pipeline: A presegmented pipeline (see batch_pipeline).
+    :return: List of (tokens, lemmas) aligned with lines.
+    """
+    if connection is None:
+        open_lemma_store()
+    lines = [line.strip() for line in lines]
+    unique_lines = list(dict.fromkeys(line for line in lines if line))
+    known = lookup_many(unique_lines)
+    missing = [line for line in unique_lines if line not in known]
+    if missing:
+        parsed = parse_lines(missing, pipeline)
+        store_many(parsed)
+        known.update(parsed)
+    return [known[line] if line else ([], []) for line in lines]
+
+
+def tokens_and_lemmas(line, pipeline):
+    """
+    Get the UDPipe tokens and lemmas of a line, parsing it only if no metric has done so before.
+
+    :param line: Input line.
+    :param pipeline: UDPipe pipeline used on a cache miss.
+    :return: A tuple of (tokens, lemmas).
+    """
+    line = line.strip()
+    if connection is None:
+        open_lemma_store()
+    cached = lookup(line)
+    if cached is not None:
+        return cached
+    tokens, lemmas = extract_tokens_and_lemmas(pipeline.process(line))
+    store(line, tokens, lemmas)
+    return tokens, lemmas
+
+
+def lemmatise(line, pipeline):
+    _, lemmas = tokens_and_lemmas(line, pipeline)
+    return " ".join(lemmas)
@@ -0,0 +1,137 @@
+import numpy as np
+
+# METEOR with synonym matching over integer arrays, used by meteor_synonym.py for
+# every language. Lemmas are interned to ids, the synonym cache is turned into
+# one sorted array of (reference lemma, synonym) pair keys, and every line of the
+# corpus is scored at once with numpy instead of a Python loop per line.
+ID_STRIDE = 1 << 31  # Pair keys are first_id * ID_STRIDE + second_id, so ids may keep growing
+
+
+def intern_lines(lemma_lines, vocabulary):
+    """
+    Intern lists of lemmas into one flat id array.
+
+    :param lemma_lines: List of lemma lists.
+    :param vocabulary: Dict of lemma -> id, extended in place.
+    :return: (ids, offsets) where line k is ids[offsets[k]:offsets[k + 1]].
+    """
+    ids = [vocabulary.setdefault(lemma, len(vocabulary)) for lemmas in lemma_lines for lemma in lemmas]
+    offsets = np.zeros(len(lemma_lines) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(lemmas) for lemmas in lemma_lines])
+    return np.array(ids, dtype=np.int64), offsets
+
+
+def build_synonym_index(vocabulary, get_synonyms):
+    """
+    Precompute every (lemma, synonym) pair that can produce a match.
+
+    Synonyms that never occur in the corpus cannot match a hypothesis word, so
+    only pairs where both sides are in the vocabulary are kept.
+
+    :param vocabulary: Dict of lemma -> id covering every reference and hypothesis line.
+    :param get_synonyms: Function returning the synonyms of a lemma.
+    :return: Sorted array of pair keys lemma_id * ID_STRIDE + synonym_id.
+    """
+    keys = set()
+    for lemma, lemma_id in vocabulary.items():
+        for synonym in get_synonyms(lemma):
+            synonym_id = vocabulary.get(synonym)
+            if synonym_id is not None:
+                keys.add(lemma_id * ID_STRIDE + synonym_id)
+    return np.array(sorted(keys), dtype=np.int64)
+
+
+def build_cache_synonym_index(synonym_items):
+    """
+    Build a corpus-independent synonym index from the whole synonym store.
+
+    The result can be built once and shared read-only by worker processes; each
+    worker interns its own lines into a copy of the vocabulary (see score_lemma_lines).
+
+    :param synonym_items: Iterable of (lemma, synonym lemmas) pairs.
+    :return: (vocabulary, pair keys).
+    """
+    vocabulary = {}
+    keys = []
+    for lemma, synonyms in synonym_items:
+        lemma_id = vocabulary.setdefault(lemma, len(vocabulary))
+        keys += [lemma_id * ID_STRIDE + vocabulary.setdefault(synonym, len(vocabulary)) for synonym in synonyms]
+    return vocabulary, np.unique(np.array(keys, dtype=np.int64))
+
+
+def line_of(offsets):
+    """Line number of every position in a flat array described by offsets."""
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def meteor_scores(ref_ids, ref_offsets, hyp_ids, hyp_offsets, synonym_keys, alpha=0.9, beta=3, gamma=0.5):
+    """
+    Calculate the synonym-aware METEOR score of every line pair at once.
+
+    Same definition as the per-line my_meteor_score: matches are distinct
+    hypothesis lemmas found among the reference lemmas or their synonyms, and
+    chunks are runs of hypothesis lemmas that occur exactly in the reference.
+
+    :return: Array of METEOR scores, one per line.
+    """
+    n_lines = len(ref_offsets) - 1
+    ref_lens = np.diff(ref_offsets)
+    hyp_lens = np.diff(hyp_offsets)
+    hyp_line = line_of(hyp_offsets)
+
+    # Every (hypothesis position, reference position) pair within the same line
+    pairs_per_hyp = ref_lens[hyp_line]
+    hyp_pos = np.repeat(np.arange(len(hyp_ids)), pairs_per_hyp)
+    pair_starts = np.cumsum(pairs_per_hyp) - pairs_per_hyp
+    ref_pos = ref_offsets[hyp_line][hyp_pos] + np.arange(len(hyp_pos)) - pair_starts[hyp_pos]
+
+    ref_word = ref_ids[ref_pos]
+    hyp_word = hyp_ids[hyp_pos]
+    exact = ref_word == hyp_word
+    matched = exact.copy()
+    if len(synonym_keys):
+        keys = ref_word * ID_STRIDE + hyp_word
+        found = np.searchsorted(synonym_keys, keys)
+        matched |= synonym_keys[np.minimum(found, len(synonym_keys) - 1)] == keys
+
+    in_ref = np.bincount(hyp_pos, weights=exact, minlength=len(hyp_ids)) > 0
+    is_match = np.bincount(hyp_pos, weights=matched, minlength=len(hyp_ids)) > 0
+
+    # Matches count distinct hypothesis lemmas per line
+    matched_types = np.unique(hyp_line[is_match] * ID_STRIDE + hyp_ids[is_match])
+    matches = np.bincount(matched_types // ID_STRIDE, minlength=n_lines).astype(float)
+
+    # A chunk starts at every exact match not preceded by an exact match in the same line
+    previous = np.concatenate([[False], in_ref[:-1]])
+    previous[hyp_offsets[:-1][hyp_lens > 0]] = False
+    chunks = np.bincount(hyp_line[in_ref & ~previous], minlength=n_lines).astype(float)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(hyp_lens > 0, matches / hyp_lens, 0)
+        recall = np.where(ref_lens > 0, matches / ref_lens, 0)
+        f_score = np.where(precision + recall > 0,
+                           precision * recall / (alpha * precision + (1 - alpha) * recall), 0)
+        frag_penalty = np.where(matches > 1, gamma * (chunks / matches) ** beta, 0)
+    return np.maximum(f_score * (1 - frag_penalty), 0)
+
+
+def score_lemma_lines(ref_lemma_lines, hyp_lemma_lines, get_synonyms=None, alpha=0.9, beta=3, gamma=0.5,
+                      synonym_index=None):
+    """
+    Score aligned lists of reference and hypothesis lemmas.
+
+    :param get_synonyms: Function returning the synonyms of a lemma, or None for exact matching only.
+    :param synonym_index: Prebuilt (vocabulary, pair keys) from build_cache_synonym_index,
+        used instead of get_synonyms so the index is not rebuilt for every call.
+    :return: Array of METEOR scores, one per line.
+    """
+    vocabulary = dict(synonym_index[0]) if synonym_index is not None else {}
+    ref_ids, ref_offsets = intern_lines(ref_lemma_lines, vocabulary)
+    hyp_ids, hyp_offsets = intern_lines(hyp_lemma_lines, vocabulary)
+    if synonym_index is not None:
+        synonym_keys = synonym_index[1]
+    elif get_synonyms:
+        synonym_keys = build_synonym_index(vocabulary, get_synonyms)
+    else:
+        synonym_keys = np.array([], dtype=np.int64)
+    return meteor_scores(ref_ids, ref_offsets, hyp_ids, hyp_offsets, synonym_keys, alpha, beta, gamma)
@@ -1,9 +1,14 @@
-from ufal.udpipe import Model, Pipeline
+from ufal.udpipe import Model
 import nltk
-import json
+import os
+import sys
 from nltk.translate import meteor_score
 from nltk.tokenize import word_tokenize
 from nltk.corpus import wordnet as wn
+from lemma_store import batch_pipeline, close_lemma_store, open_lemma_store, tokens_and_lemmas, tokens_and_lemmas_batch
+# results_store.py is shared with the singability evaluators
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import results_store
 
 
 with open("ga_txt_files/references.txt", "r", encoding="utf-8") as f:
@@ -12,9 +17,6 @@ with open("ga_txt_files/references.txt", "r", encoding="utf-8") as f:
 with open("ga_txt_files/nllbs.txt", "r", encoding="utf-8") as f:
     hypotheses = f.readlines()
 
-with open("results_by_song/nllb.json", "r", encoding="utf-8") as file:
-        song_objects = json.load(file)
-
 # Function to split lines into songs based on the "*" delimiter
 def split_into_songs(lines):
     songs = []
@@ -42,7 +44,11 @@ if not model:
     print("Error: Could not load the UDPipe model.")
     exit(1)
 
-pipeline = Pipeline(model, "tokenize", Pipeline.DEFAULT, Pipeline.DEFAULT, "conllu")
+pipeline = batch_pipeline(model)
+# Lines already parsed by any metric are read back from the shared store,
+# the rest are parsed here in a few large UDPipe calls
+open_lemma_store()
+tokens_and_lemmas_batch(references + hypotheses, pipeline)
 
 
 def extract_tokens(conllu_output):
@@ -55,34 +61,18 @@ def extract_tokens(conllu_output):
     return tokens
 
 
-def extract_tokens_and_lemmas(conllu_output):
-    """
-    Extract tokens and lemmas from CoNLL-U format output.
-    
-    :param conllu_output: CoNLL-U format string.
-    :return: A tuple of (tokens, lemmas).
-    """
-    tokens = []
-    lemmas = []
-    for line in conllu_output.splitlines():
-        if line and not line.startswith("#"):
-            columns = line.split("\t")
-            if len(columns) > 2:  # Ensure the line has enough columns
-                tokens.append(columns[1])  # FORM is in the 2nd column
-                lemmas.append(columns[2])  # LEMMA is in the 3rd column
-    return tokens, lemmas
-
-
-for i, (ref_song, hyp_song) in enumerate(zip(ref_songs, test_songs)):
+song_meteor = []
+for ref_song, hyp_song in zip(ref_songs, test_songs):
     meteor_scores = []
     for line1, line2 in zip(ref_song, hyp_song):
-        _, lemma_ref = extract_tokens_and_lemmas(pipeline.process(line1))
-        _, lemma_test = extract_tokens_and_lemmas(pipeline.process(line2))
+        _, lemma_ref = tokens_and_lemmas(line1, pipeline)
+        _, lemma_test = tokens_and_lemmas(line2, pipeline)
         score = meteor_score.meteor_score([lemma_ref], lemma_test)
         meteor_scores.append(score)
     # Calculate the songs METEOR score
     average_meteor = sum(meteor_scores) / len(meteor_scores) if meteor_scores else 0
-    song_objects[i]["meteor"] = average_meteor
+    song_meteor.append(average_meteor)
+close_lemma_store()
 
 
 ### Using nltk tokeniser ###
@@ -102,5 +92,4 @@ for i, song in enumerate(ref_songs):
     song_objects[i] = song_object
 """
 
-with open("results_by_song/nllb1.json", "w", encoding="utf-8") as file:
-    json.dump(song_objects, file, indent=4, ensure_ascii=False)
+results_store.write_column("nllb", "meteor", song_meteor)
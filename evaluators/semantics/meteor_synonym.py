@@ -1,126 +1,74 @@
-from multiprocessing import Pool, cpu_count, freeze_support
-from concurrent.futures import ThreadPoolExecutor
-from functools import lru_cache
-from tqdm import tqdm
-from ufal.udpipe import Model, Pipeline
-import requests
-from bs4 import BeautifulSoup
-import json
+from multiprocessing import Pool, freeze_support
+from ufal.udpipe import Model
+from lemma_store import batch_pipeline, close_lemma_store, open_lemma_store, tokens_and_lemmas, tokens_and_lemmas_batch
+from meteor_core import build_cache_synonym_index, score_lemma_lines
+from synonym_fetcher import ERROR_TTL, fetch_synonyms_many
+import synonym_store
 import os
-
-SYNONYM_CACHE_FILE = "evaluators/semantics/synonyms_cache_ga.json"
-synonym_cache = {}
-
-# Load cached synonyms to avoid redundant HTTP requests
-def load_synonym_cache():
-    global synonym_cache
-    if os.path.exists(SYNONYM_CACHE_FILE) and os.path.getsize(SYNONYM_CACHE_FILE) > 0:
-        with open(SYNONYM_CACHE_FILE, "r", encoding="utf-8") as f:
-            try:
-                loaded_cache = json.load(f)
-                synonym_cache = {key: set(value) for key, value in loaded_cache.items()}
-            except json.JSONDecodeError:
-                print("Warning: Invalid JSON in synonym cache. Resetting cache.")
-                synonym_cache = {}
-    else:
-        synonym_cache = {}
-
-
-def save_synonym_cache():
-    with open(SYNONYM_CACHE_FILE, "w", encoding="utf-8") as f:
-        json.dump({key: list(value) for key, value in synonym_cache.items()}, f, ensure_ascii=False, indent=4)
-
-
-# Fetch synonyms for a batch of words
+import sys
+# results_store.py is shared with the singability evaluators, song_arrays.py with their analysers
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "singability"))
+import results_store
+from song_arrays import song_means, song_offsets
+
+# METEOR with synonym matching for the Irish and Spanish translations.
+#   python meteor_synonym.py [ga|es]
+MODEL_PATH = "irish-idt-ud-2.5-191206.udpipe"
+N_WORKERS = os.cpu_count()
+# Settings of each language. synonym_cache_file is the legacy JSON cache, imported into
+# the shared synonym store on first run. Spanish scoring is disabled: no Spanish
+# UDPipe model is configured, and synonym_fetcher.py only knows the Irish Potafocal
+# thesaurus, so udpipe_model stays None until both are added.
+LANGUAGES = {
+    "ga": {
+        "synonym_cache_file": "evaluators/semantics/synonyms_cache_ga.json",
+        "text_dir": "ga_txt_files",
+        "udpipe_model": MODEL_PATH,
+        "results_store_dir": results_store.RESULTS_STORE_DIR,
+    },
+    "es": {
+        "synonym_cache_file": "evaluators/semantics/synonyms_cache_es.json",
+        "text_dir": "es_txt_files",
+        "udpipe_model": None,
+        # Spanish results are kept apart from the Irish ones
+        "results_store_dir": "results_store_es",
+    },
+}
+
+# Set in each pool worker by init_worker
+worker_model = None
+worker_pipeline = None
+worker_synonym_index = None
+
+# Open the shared synonym store to avoid redundant HTTP requests
+def load_synonym_cache(lang="ga"):
+    synonym_store.open_synonym_store()
+    synonym_store.import_json_cache(lang, LANGUAGES[lang]["synonym_cache_file"])
+
+
+# Fetch synonyms for a batch of words (async, pooled and rate limited, see synonym_fetcher.py)
 def fetch_synonyms_batch(words, pipeline):
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        results = list(executor.map(fetch_synonyms, words, [pipeline]*len(words)))
-    return dict(zip(words, results))
-
-
-# Fetch synonyms from Potafocal
-def fetch_synonyms(word, pipeline):
-    if word in synonym_cache:
-        return synonym_cache[word]
-    
-    url = f"http://www.potafocal.com/thes/?s={word}"
-    response = requests.get(url)
-    if response.status_code != 200:
-        return set()  # Return an empty set, not a list
+    return fetch_synonyms_many(words, pipeline)
 
-    soup = BeautifulSoup(response.text, "html.parser")
-    synonyms = {a.text.strip().lower() for section in soup.find_all("div", class_="sense") for a in section.find_all("a", href=True)}
-    syn_lemmas = []
-    for synonym in synonyms:
-        _, syn_lemma = extract_tokens_and_lemmas(pipeline.process(synonym))
-        syn_lemmas += syn_lemma
-    synonym_cache[word] = set(syn_lemmas)  # Store as a set to avoid list issues
-    return set(syn_lemmas)  # Ensure return value is a set
 
-
-# Get synonyms from cache
-def get_synonyms(word):
-    return set(synonym_cache.get(word, []))  # Ensure it returns a set
+# Get synonyms from the store
+def get_synonyms(word, lang="ga"):
+    return synonym_store.get_synonyms(lang, word)
 
 
 # Preload synonyms for words in references
-def preload_synonyms(word_list, pipeline):
-    new_words = [word for word in word_list if word not in synonym_cache]
+def preload_synonyms(word_list, pipeline, lang="ga"):
+    new_words = synonym_store.words_to_fetch(lang, word_list)
     if new_words:
-        synonym_cache.update(fetch_synonyms_batch(new_words, pipeline))
-        save_synonym_cache()
-
-
-# UDPipe lemmatization using parallel processing
-def process_with_pipeline(text, pipeline):
-    return pipeline.process(text.strip())
+        found, failed = fetch_synonyms_batch(new_words, pipeline)
+        synonym_store.add_synonyms(lang, found)
+        synonym_store.add_failed_lookups(lang, failed)
 
 
-def lemmatize_sentences_parallel(sentences, pipeline):
-    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
-        return list(executor.map(lambda text: process_with_pipeline(text, pipeline), sentences))
-
-
-def extract_tokens_and_lemmas(conllu_output):
-    """
-    Extract tokens and lemmas from CoNLL-U format output.
-    
-    :param conllu_output: CoNLL-U format string.
-    :return: A tuple of (tokens, lemmas).
-    """
-    tokens = []
-    lemmas = []
-    for line in conllu_output.splitlines():
-        if line and not line.startswith("#"):
-            columns = line.split("\t")
-            if len(columns) > 2:  # Ensure the line has enough columns
-                tokens.append(columns[1])  # FORM is in the 2nd column
-                lemmas.append(columns[2])  # LEMMA is in the 3rd column
-    return tokens, lemmas
-
-
-# Calculate chunks for METEOR
-def calculate_chunks(reference, hypothesis):
-    """
-    Calculate the number of contiguous matching chunks between reference and hypothesis.
-    
-    :param reference: List of reference tokens.
-    :param hypothesis: List of hypothesis tokens.
-    :return: Number of chunks.
-    """
-    if not reference or not hypothesis:
-        return 0
-
-    chunks = 0
-    in_chunk = False
-    for i, _ in enumerate(hypothesis):
-        if hypothesis[i] in reference:
-            if not in_chunk:
-                chunks += 1
-                in_chunk = True
-        else:
-            in_chunk = False
-    return chunks
+# Words whose lookup failed, so their synonyms are still unknown, rather than found nothing
+def failed_lookups(word_list, lang="ga"):
+    return synonym_store.failed_words(lang, word_list, ERROR_TTL)
 
 
 # Compute METEOR Score
@@ -145,56 +93,54 @@ def my_meteor_score(
     :param gamma: Parameter for chunk penalty.
     :return: METEOR score.
     """
-    # Lemmatize the reference and hypothesis sentences
-    ref_output = pipeline.process(reference.strip())
-    hyp_output = pipeline.process(hypothesis.strip())
-    _, ref_lemmas = extract_tokens_and_lemmas(ref_output)
-    _, hyp_lemmas = extract_tokens_and_lemmas(hyp_output)
-
-    # Initialize matches
-    matches_set = set()
+    # Lemmatize the reference and hypothesis sentences (shared lemma store)
+    _, ref_lemmas = tokens_and_lemmas(reference, pipeline)
+    _, hyp_lemmas = tokens_and_lemmas(hypothesis, pipeline)
 
-    # Exact word matches
-    for hyp_word in hyp_lemmas:
-        if hyp_word in ref_lemmas and hyp_word not in matches_set:
-            matches_set.add(hyp_word)
+    return float(score_lemma_lines([ref_lemmas], [hyp_lemmas], get_synonyms, alpha, beta, gamma)[0])
 
-    # Include synonym matches if a custom synonym function is provided
-    if get_synonyms:
-        # Create a set of all synonyms for the reference words
-        ref_synonyms = set()
-        for ref_word in ref_lemmas:
-            ref_synonyms.update(get_synonyms(ref_word))
 
-        # Check if any hypothesis word is in the synonym set
-        for hyp_word in hyp_lemmas:
-            if hyp_word in ref_synonyms and hyp_word not in matches_set:
-                matches_set.add(hyp_word)
-
-    # Total matches are the size of the matches set
-    matches = len(matches_set)
+# Score every line of the corpus at once and average per song
+def score_songs(ref_songs, test_songs, pipeline, get_synonyms=None, synonym_index=None):
+    ref_lines, hyp_lines, song_lengths = [], [], []
+    for ref_song, hyp_song in zip(ref_songs, test_songs):
+        pairs = list(zip(ref_song, hyp_song))
+        ref_lines += [ref for ref, _ in pairs]
+        hyp_lines += [hyp for _, hyp in pairs]
+        song_lengths.append(len(pairs))
+    ref_lemma_lines = [lemmas for _, lemmas in tokens_and_lemmas_batch(ref_lines, pipeline)]
+    hyp_lemma_lines = [lemmas for _, lemmas in tokens_and_lemmas_batch(hyp_lines, pipeline)]
 
-    # Calculate precision, recall, and F-measure
-    precision = matches / len(hyp_lemmas) if len(hyp_lemmas) > 0 else 0
-    recall = matches / len(ref_lemmas) if len(ref_lemmas) > 0 else 0
+    line_scores = score_lemma_lines(ref_lemma_lines, hyp_lemma_lines, get_synonyms, synonym_index=synonym_index)
+    return song_means(line_scores, song_offsets(song_lengths)).tolist()
 
-    # Calculate F-score
-    f_score = (precision * recall) / (alpha * precision + (1 - alpha) * recall) if (precision + recall) > 0 else 0
 
-    # Calculate fragmentation penalty (based on chunking)
-    chunks = calculate_chunks(ref_lemmas, hyp_lemmas)
-    frag_penalty = gamma * (chunks / matches) ** beta if matches > 1 else 0
+# Load the UDPipe model once per worker and keep the shared synonym index for its lifetime
+def init_worker(model_path, synonym_index):
+    global worker_model, worker_pipeline, worker_synonym_index
+    worker_model = Model.load(model_path)
+    if not worker_model:
+        raise RuntimeError(f"Could not load UDPipe model {model_path}")
+    worker_pipeline = batch_pipeline(worker_model)
+    worker_synonym_index = synonym_index
+    open_lemma_store(udpipe_model=model_path)
 
-    # Calculate final METEOR score
-    meteor_score = max(f_score * (1 - frag_penalty), 0)
-    return meteor_score
 
+def score_shard(shard):
+    ref_songs, test_songs = shard
+    return score_songs(ref_songs, test_songs, worker_pipeline, synonym_index=worker_synonym_index)
 
 
-# Process sentence pairs
-def process_sentence_pair(args):
-    reference, hypothesis, pipeline, get_synonyms = args
-    return my_meteor_score(reference, hypothesis, pipeline, get_synonyms)
+# Shard songs across a process pool, results come back in song order
+def score_songs_parallel(ref_songs, test_songs, synonym_index, n_workers=N_WORKERS, model_path=MODEL_PATH):
+    # A few shards per worker keeps the pool busy when songs differ in length
+    shard_size = max(1, -(-len(ref_songs) // (n_workers * 4)))
+    shards = [
+        (ref_songs[start:start + shard_size], test_songs[start:start + shard_size])
+        for start in range(0, len(ref_songs), shard_size)
+    ]
+    with Pool(n_workers, initializer=init_worker, initargs=(model_path, synonym_index)) as pool:
+        return [score for shard_scores in pool.map(score_shard, shards) for score in shard_scores]
 
 
 # Split text into songs
@@ -215,48 +161,35 @@ def split_into_songs(lines):
 
 if __name__ == '__main__':
     freeze_support()
-    
-    model = Model.load("irish-idt-ud-2.5-191206.udpipe")
+    lang = sys.argv[1] if len(sys.argv) > 1 else "ga"
+    settings = LANGUAGES[lang]
+    if settings["udpipe_model"] is None:
+        print(f"Error: Scoring {lang} is disabled, no UDPipe model is configured for it.")
+        exit(1)
+
+    model = Model.load(settings["udpipe_model"])
     if not model:
         print("Error: Could not load UDPipe model.")
         exit(1)
-    pipeline = Pipeline(model, "tokenize", Pipeline.DEFAULT, Pipeline.DEFAULT, "conllu")
+    pipeline = batch_pipeline(model)
     
-    load_synonym_cache()
+    load_synonym_cache(lang)
+    open_lemma_store(udpipe_model=settings["udpipe_model"])
 
-    json_path = "results_by_song/nllb.json"
-    if os.path.exists(json_path) and os.path.getsize(json_path) > 0:
-        with open(json_path, "r", encoding="utf-8") as file:
-            try:
-                song_objects = json.load(file)
-            except json.JSONDecodeError:
-                print("Error: google.json is not valid. Resetting it.")
-                song_objects = []
-    else:
-        song_objects = []
-    
-    with open("ga_txt_files/references.txt", "r", encoding="utf-8") as f, open("ga_txt_files/nllbs.txt", "r", encoding="utf-8") as f2:
+    text_dir = settings["text_dir"]
+    with open(f"{text_dir}/references.txt", "r", encoding="utf-8") as f, open(f"{text_dir}/nllbs.txt", "r", encoding="utf-8") as f2:
         references = [line.strip() for line in f]
         hypotheses = [line.strip() for line in f2]
     
     ref_songs, test_songs = split_into_songs(references), split_into_songs(hypotheses)
     all_ref_words = list(set(word for song in ref_songs for line in song for word in line.split()))
-    preload_synonyms(all_ref_words, pipeline)
+    preload_synonyms(all_ref_words, pipeline, lang)
 
-    song_scores = []
-    for ref_song, hyp_song in zip(ref_songs, test_songs):
-        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
-            song_results = list(executor.map(process_sentence_pair, [(ref, hyp, pipeline, get_synonyms) for ref, hyp in zip(ref_song, hyp_song)]))
-
-        avg_score = sum(song_results) / len(song_results) if song_results else 0
-        song_scores.append(avg_score)  # Store the average score per song
+    # Lemmatisation and scoring run in the worker pool, the synonym index is built once here
+    song_scores = score_songs_parallel(ref_songs, test_songs, build_cache_synonym_index(synonym_store.iter_synonyms(lang)),
+                                       model_path=settings["udpipe_model"])
 
-        print("song processed")
-
-    for i, score in enumerate(song_scores):
-        song_objects[i]["meteor_synonym"] = score
-    
-    with open("results_by_song/nllb1.json", "w", encoding="utf-8") as file:
-        json.dump(song_objects, file, indent=4, ensure_ascii=False)
+    results_store.write_column("nllb", "meteor_synonym", song_scores, settings["results_store_dir"])
     
-    save_synonym_cache()
\ No newline at end of file
+    synonym_store.close_synonym_store()
+    close_lemma_store()
\ No newline at end of file
@@ -1,14 +1,37 @@
 import gc
-import json
+import multiprocessing
 import os
+import sys
+from collections import defaultdict
+import numpy as np
 import torch
-from bert_score import score
-from transformers import AutoTokenizer
-from joblib import Parallel, delayed
-from tqdm import tqdm  # Import tqdm for progress bar
+from torch.nn.utils.rnn import pad_sequence
+from bert_score.utils import get_bert_embedding, get_idf_dict, get_model, get_tokenizer, greedy_cos_idf, model2layers, sent_encode
+from embedding_cache import add_embeddings, cache_key, get_cached_embedding, load_embedding_cache, load_idf_dict, normalise_sentence
+# results_store.py is shared with the singability evaluators, song_arrays.py with their analysers
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "singability"))
+import results_store
+from song_arrays import song_means, song_offsets
+
+MODEL_TYPE = "xlm-roberta-base"
+NUM_LAYERS = model2layers[MODEL_TYPE]
+BATCH_SIZE = 64  # Line pairs per batch, scored in order of length so padding stays short
+CACHE_SHARD_LINES = 2048  # New reference embeddings held before they are written as one cache shard
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+# "threads": one model in this process, torch's intra-op threads use every core.
+# "processes": N_WORKERS processes, each loading its own model once in the pool
+# initializer and limited to THREADS_PER_WORKER torch threads so they don't
+# oversubscribe the cores.
+EXECUTION_MODE = "threads"
+N_WORKERS = 4
+THREADS_PER_WORKER = max(1, (os.cpu_count() or 1) // N_WORKERS)
+
+# Model and tokenizer are loaded once per process and reused for every batch
+model = None
+tokenizer = None
 
-# Load tokenizer and model globally to avoid loading them multiple times
-tokenizer = AutoTokenizer.from_pretrained("xlm-roberta-base")
 
 def split_into_songs(lines):
     songs = []
@@ -25,14 +48,193 @@ def split_into_songs(lines):
     return songs
 
 
-def compute_bertscore(ref_song, test_song):
+def load_model(device=DEVICE):
+    """Load xlm-roberta-base (truncated to the BERTScore layer) the first time it is needed."""
+    global model, tokenizer
+    if model is None:
+        tokenizer = get_tokenizer(MODEL_TYPE, False)
+        model = get_model(MODEL_TYPE, NUM_LAYERS)
+        model.to(device)
+    return model, tokenizer
+
+
+def default_idf_dict(tokenizer):
+    # Same weights bert_score.score uses when idf=False: 1 for every token except [CLS]/[SEP]
+    idf_dict = defaultdict(lambda: 1.0)
+    idf_dict[tokenizer.sep_token_id] = 0
+    idf_dict[tokenizer.cls_token_id] = 0
+    return idf_dict
+
+
+def encode_sentences(sentences, batch_size=BATCH_SIZE, device=DEVICE):
+    """
+    Run sentences through the model in length-sorted batches.
+
+    :return: Dict of sentence -> (embeddings (tokens, hidden), token_ids (tokens,)) on the CPU.
+    """
+    model, tokenizer = load_model(device)
+    idf_dict = default_idf_dict(tokenizer)
+    sentences = sorted(set(sentences), key=lambda sen: len(sen.split(" ")), reverse=True)
+    encoded = {}
+    for start in range(0, len(sentences), batch_size):
+        sen_batch = sentences[start:start + batch_size]
+        embs, masks, _ = get_bert_embedding(sen_batch, model, tokenizer, idf_dict, device=device)
+        embs, masks = embs.cpu(), masks.cpu()
+        for i, sen in enumerate(sen_batch):
+            sequence_len = int(masks[i].sum().item())
+            encoded[sen] = (embs[i, :sequence_len], torch.tensor(sent_encode(tokenizer, sen)))
+    return encoded
+
+
+def pad_batch(stats, idf_dict, device):
+    """Pad a batch of (embeddings, token_ids) into the tensors greedy_cos_idf expects."""
+    embs = [emb.to(device) for emb, _ in stats]
+    idfs = [torch.tensor([idf_dict[int(token)] for token in token_ids], dtype=torch.float) for _, token_ids in stats]
+    lens = torch.tensor([emb.size(0) for emb in embs], dtype=torch.long)
+    emb_pad = pad_sequence(embs, batch_first=True, padding_value=2.0)
+    idf_pad = pad_sequence(idfs, batch_first=True).to(device)
+    mask = (torch.arange(int(lens.max())).expand(len(lens), -1) < lens.unsqueeze(1)).to(device)
+    return emb_pad, mask, idf_pad
+
+
+def f1_scores(references, hypotheses, stats, idf_dict, batch_size=BATCH_SIZE, device=DEVICE):
+    """
+    BERTScore F1 of every line pair from embeddings computed beforehand.
+
+    :param stats: Dict of normalised line -> (embeddings, token_ids), see encode_sentences.
+    :return: List of F1 scores, one per line pair.
+    """
+    references = [normalise_sentence(sen) for sen in references]
+    hypotheses = [normalise_sentence(sen) for sen in hypotheses]
     scores = []
-    for ref_sen, test_sen in zip(ref_song, test_song):
-        with torch.no_grad():
-            _, _, F1 = score([ref_sen], [test_sen], lang="ga", model_type="xlm-roberta-base", verbose=False, device=torch.device('cpu'))
-        scores.append(F1.item())
-    clear_memory()
-    return sum(scores) / len(scores)
+    with torch.no_grad():
+        for start in range(0, len(references), batch_size):
+            ref_stats = pad_batch([stats[sen] for sen in references[start:start + batch_size]], idf_dict, device)
+            hyp_stats = pad_batch([stats[sen] for sen in hypotheses[start:start + batch_size]], idf_dict, device)
+            _, _, F1 = greedy_cos_idf(*ref_stats, *hyp_stats)
+            scores += F1.cpu().tolist()
+    return scores
+
+
+def score_lines(references, hypotheses, batch_size=BATCH_SIZE, device=DEVICE, idf=False, use_cache=True, idf_references=None):
+    """
+    Compute BERTScore F1 for every (reference, hypothesis) line pair.
+
+    Pairs are embedded and scored a length-sorted batch at a time and each batch's
+    embeddings are dropped once it is scored, so memory holds one batch rather than
+    the corpus. Reference embeddings are read from the memory-mapped cache when
+    present; new ones are written to it every CACHE_SHARD_LINES lines.
+
+    :param references: List of reference lines.
+    :param hypotheses: List of hypothesis lines, aligned with references.
+    :param idf: Weight tokens by idf computed over the references, as bert_score does with idf=True.
+    :param use_cache: Read and extend the reference embedding cache.
+    :param idf_references: Lines to compute idf over, defaults to references. Workers
+        scoring a slice of the corpus pass the full reference list here.
+    :return: List of F1 scores, one per line pair.
+    """
+    model, tokenizer = load_model(device)
+    references = [normalise_sentence(sen) for sen in references]
+    hypotheses = [normalise_sentence(sen) for sen in hypotheses]
+
+    if idf:
+        if idf_references is None:
+            idf_references = references
+        idf_references = [normalise_sentence(sen) for sen in idf_references]
+        idf_dict = load_idf_dict(idf_references, tokenizer, MODEL_TYPE) if use_cache else get_idf_dict(idf_references, tokenizer)
+    else:
+        idf_dict = default_idf_dict(tokenizer)
+
+    if use_cache:
+        load_embedding_cache()
+    new_references = {}  # Cache key -> (embeddings, token_ids) not written to the cache yet
+    order = sorted(range(len(references)), key=lambda i: len(references[i].split(" ")) + len(hypotheses[i].split(" ")),
+                   reverse=True)
+    scores = [0.0] * len(references)
+    for start in range(0, len(order), batch_size):
+        batch = order[start:start + batch_size]
+        batch_references = [references[i] for i in batch]
+        batch_hypotheses = [hypotheses[i] for i in batch]
+        stats = {}
+        if use_cache:
+            for sen in set(batch_references):
+                key = cache_key(sen, MODEL_TYPE, NUM_LAYERS)
+                cached = new_references.get(key)
+                if cached is None:
+                    cached = get_cached_embedding(key)
+                if cached is not None:
+                    embeddings, token_ids = cached
+                    stats[sen] = (torch.from_numpy(np.array(embeddings)), torch.from_numpy(np.array(token_ids)))
+        new_sentences = set(batch_references) | set(batch_hypotheses)
+        stats.update(encode_sentences([sen for sen in new_sentences if sen not in stats], batch_size, device))
+        if use_cache:
+            for sen in set(batch_references):
+                key = cache_key(sen, MODEL_TYPE, NUM_LAYERS)
+                if get_cached_embedding(key) is None and key not in new_references:
+                    # Copied, so the batch tensor the rows are views of can be freed
+                    new_references[key] = (stats[sen][0].numpy().copy(), stats[sen][1].numpy().copy())
+            if len(new_references) >= CACHE_SHARD_LINES:
+                add_embeddings(new_references)
+                new_references = {}
+
+        for i, score in zip(batch, f1_scores(batch_references, batch_hypotheses, stats, idf_dict, batch_size, device)):
+            scores[i] = score
+        del stats
+    if new_references:
+        add_embeddings(new_references)
+    return scores
+
+
+def flatten_songs(ref_songs, test_songs):
+    """Flatten aligned songs into line lists plus the number of line pairs in each song."""
+    references, hypotheses, song_lengths = [], [], []
+    for ref_song, test_song in zip(ref_songs, test_songs):
+        pairs = list(zip(ref_song, test_song))
+        references += [ref for ref, _ in pairs]
+        hypotheses += [hyp for _, hyp in pairs]
+        song_lengths.append(len(pairs))
+    return references, hypotheses, song_lengths
+
+
+def init_worker(num_threads, device=DEVICE):
+    """Pool initializer: pin torch's thread count and load the model once for the worker's lifetime."""
+    torch.set_num_threads(num_threads)
+    torch.set_num_interop_threads(1)
+    load_model(device)
+
+
+def score_chunk(args):
+    references, hypotheses, batch_size, device, idf, idf_references = args
+    return score_lines(references, hypotheses, batch_size, device, idf=idf, idf_references=idf_references)
+
+
+def score_songs(ref_songs, test_songs, batch_size=BATCH_SIZE, device=DEVICE, idf=False,
+                mode=EXECUTION_MODE, n_workers=N_WORKERS, threads_per_worker=THREADS_PER_WORKER):
+    """
+    Score every song of the corpus and return the per-song average F1.
+
+    :param mode: "threads" to score everything in this process with all cores, or
+        "processes" to split the lines across n_workers processes with one model each.
+    """
+    references, hypotheses, song_lengths = flatten_songs(ref_songs, test_songs)
+
+    if mode == "processes":
+        # One contiguous slice of lines per worker keeps each worker's batches as full as possible
+        chunk_size = -(-len(references) // n_workers)
+        chunks = [
+            (references[start:start + chunk_size], hypotheses[start:start + chunk_size], batch_size, device, idf,
+             references if idf else None)
+            for start in range(0, len(references), chunk_size)
+        ]
+        # Fork is not safe once torch has started its thread pools
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(n_workers, initializer=init_worker, initargs=(threads_per_worker, device)) as pool:
+            line_scores = [score for chunk_scores in pool.map(score_chunk, chunks) for score in chunk_scores]
+    else:
+        torch.set_num_threads(os.cpu_count() or 1)
+        line_scores = score_lines(references, hypotheses, batch_size, device, idf=idf)
+
+    return song_means(np.array(line_scores, dtype=np.float64), song_offsets(song_lengths)).tolist()
 
 
 def clear_memory():
@@ -48,18 +250,6 @@ if __name__ == "__main__":
     with open("ga_txt_files/nllbs.txt", "r", encoding="utf-8") as f:
         hypotheses = f.readlines()
 
-    # Ensure JSON file exists
-    json_path = "results_by_song/nllb.json"
-    if os.path.exists(json_path) and os.path.getsize(json_path) > 0:
-        with open(json_path, "r", encoding="utf-8") as file:
-            try:
-                song_objects = json.load(file)
-            except json.JSONDecodeError:
-                print(f"Error: {json_path} is not valid. Resetting it.")
-                song_objects = []
-    else:
-        song_objects = []
-
     # Split into songs
     ref_songs = split_into_songs(references)
     test_songs = split_into_songs(hypotheses)
@@ -67,18 +257,10 @@ if __name__ == "__main__":
     if len(ref_songs) != len(test_songs):
         raise ValueError(f"Mismatch in song count: {len(ref_songs)} references vs {len(test_songs)} hypotheses")
 
-    # Process each song in parallel and collect results
-    results = Parallel(n_jobs=10)(
-        delayed(compute_bertscore)(ref_song, test_song)
-        for ref_song, test_song in tqdm(zip(ref_songs, test_songs), total=len(ref_songs), desc="Processing Songs")
-    )
-
-    # Update song_objects with results
-    for i, result in enumerate(results):
-        song_objects[i]["bert_score"] = result  # Ensure consistent key usage
+    # Score the whole corpus at once, then average the line scores per song
+    results = score_songs(ref_songs, test_songs)
 
-    # Save updated results to JSON file
-    with open("results_by_song/nllb1.json", "w", encoding="utf-8") as file:
-        json.dump(song_objects, file, indent=4, ensure_ascii=False)
+    # Save the results as the system's bert_score column
+    results_store.write_column("nllb", "bert_score", results)
 
     clear_memory()
@@ -0,0 +1,241 @@
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+from aiohttp import web
+from bs4 import BeautifulSoup
+from lemma_store import close_lemma_store, open_lemma_store, tokens_and_lemmas_batch
+import synonym_store
+
+# Async Potafocal thesaurus client used by meteor_synonym.py.
+# Requests share one pooled session, are limited by a token bucket and a concurrency
+# cap, and are retried with exponential backoff. Failures are not reported as empty
+# synonym sets; they come back with an expiry so the caller can retry them later.
+# Point base_url at a local server serving recorded pages to test without the network;
+#   python synonym_fetcher.py [udpipe_model]
+# runs check_stub_server, which does that with a stub that fails in every way handled here.
+THESAURUS_URL = "http://www.potafocal.com/thes/"
+MAX_CONCURRENCY = 10
+REQUESTS_PER_SECOND = 5
+BURST = 10
+MAX_RETRIES = 4
+BACKOFF_BASE = 0.5  # Seconds, doubled on every retry
+TIMEOUT = 20  # Seconds per request
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+ERROR_TTL = 60 * 60  # Retry words whose lookup failed after an hour
+NO_SYNONYMS_TTL = 30 * 24 * 60 * 60  # Words with no thesaurus entry are checked again after 30 days
+
+
+def make_rate_limiter(rate, burst):
+    """Token bucket: returns a coroutine function that waits until a request may be sent."""
+    tokens = burst
+    updated = time.monotonic()
+    lock = asyncio.Lock()
+
+    async def acquire():
+        nonlocal tokens, updated
+        async with lock:
+            while True:
+                now = time.monotonic()
+                tokens = min(burst, tokens + (now - updated) * rate)
+                updated = now
+                if tokens >= 1:
+                    tokens -= 1
+                    return
+                await asyncio.sleep((1 - tokens) / rate)
+
+    return acquire
+
+
+def parse_synonym_page(html, pipeline):
+    """Extract the synonyms from a thesaurus page and lemmatise them in one UDPipe call."""
+    soup = BeautifulSoup(html, "html.parser")
+    synonyms = {a.text.strip().lower() for section in soup.find_all("div", class_="sense") for a in section.find_all("a", href=True)}
+    syn_lemmas = set()
+    for _, lemmas in tokens_and_lemmas_batch(list(synonyms), pipeline):
+        syn_lemmas.update(lemmas)
+    return syn_lemmas
+
+
+async def fetch_page(session, word, acquire, semaphore, base_url):
+    """Fetch the thesaurus page of a word, retrying transient failures. Returns None if it never succeeds."""
+    for attempt in range(MAX_RETRIES + 1):
+        await acquire()
+        try:
+            async with semaphore:
+                async with session.get(base_url, params={"s": word}) as response:
+                    if response.status == 200:
+                        return await response.text()
+                    if response.status not in RETRY_STATUSES:
+                        print(f"Error: {response.status} fetching synonyms for {word}")
+                        return None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if attempt == MAX_RETRIES:
+                print(f"Request failed for {word}: {e}")
+        if attempt < MAX_RETRIES:
+            await asyncio.sleep(BACKOFF_BASE * 2 ** attempt * (1 + random.random()))
+    return None
+
+
+async def fetch_all(words, pipeline, base_url=THESAURUS_URL):
+    """
+    Fetch and lemmatise the synonyms of many words concurrently.
+
+    HTML parsing and UDPipe run on a worker thread so they never block the event loop.
+
+    :return: Dict of word -> set of synonym lemmas, or None where the lookup failed.
+    """
+    acquire = make_rate_limiter(REQUESTS_PER_SECOND, BURST)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+    loop = asyncio.get_running_loop()
+    results = {}
+
+    # One parsing thread: the UDPipe pipeline is shared and not safe to call concurrently
+    with ThreadPoolExecutor(max_workers=1) as parse_executor:
+        connector = aiohttp.TCPConnector(limit=MAX_CONCURRENCY)
+        timeout = aiohttp.ClientTimeout(total=TIMEOUT)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+
+            async def fetch_one(word):
+                html = await fetch_page(session, word, acquire, semaphore, base_url)
+                if html is None:
+                    results[word] = None
+                else:
+                    results[word] = await loop.run_in_executor(parse_executor, parse_synonym_page, html, pipeline)
+
+            await asyncio.gather(*(fetch_one(word) for word in words))
+    return results
+
+
+def fetch_synonyms_many(words, pipeline, base_url=THESAURUS_URL):
+    """
+    Fetch synonyms for a batch of words.
+
+    :return: (found, failed) where found maps words to their set of synonym lemmas
+        and failed maps words whose lookup failed or found nothing to the time
+        after which they should be fetched again.
+    """
+    results = asyncio.run(fetch_all(words, pipeline, base_url))
+    now = time.time()
+    found = {}
+    failed = {}
+    for word, synonyms in results.items():
+        if synonyms is None:
+            failed[word] = now + ERROR_TTL
+        elif not synonyms:
+            failed[word] = now + NO_SYNONYMS_TTL
+        else:
+            found[word] = synonyms
+    return found, failed
+
+
+# Pages of the stub thesaurus, a word's synonyms are "<word> a" and "<word> b"
+STUB_PAGE = '<html><body><div class="sense"><a href="#">{word} a</a><a href="#">{word} b</a></div></body></html>'
+STUB_EMPTY_PAGE = "<html><body><p>Níor aimsíodh aon rud.</p></body></html>"
+
+
+def check_stub_server(pipeline, store_path, lang="ga"):
+    """
+    Fetch words from a local stub of the thesaurus and check what lands in the synonym store.
+
+    The stub answers "broken" with 500 every time, "missing" with 404, "flaky" with 429
+    twice before its page, "empty" with a page without synonyms and every other word
+    with synonyms, so the retries, both expiries, the token bucket and the concurrency
+    cap are exercised without the network.
+
+    :param store_path: sqlite file for the synonym store, created if missing.
+    :return: List of the checks that failed, empty if everything matched.
+    """
+    words = ["broken", "missing", "flaky", "empty"] + [f"focal{i}" for i in range(2 * BURST)]
+    requests_seen = []  # (monotonic time, word) of every request
+    in_flight = [0, 0]  # Requests being answered, and the most there ever were
+
+    async def answer(request):
+        word = request.query["s"]
+        requests_seen.append((time.monotonic(), word))
+        in_flight[0] += 1
+        in_flight[1] = max(in_flight)
+        try:
+            await asyncio.sleep(0.05)
+            if word == "broken":
+                return web.Response(status=500)
+            if word == "missing":
+                return web.Response(status=404)
+            if word == "flaky" and sum(seen == "flaky" for _, seen in requests_seen) <= 2:
+                return web.Response(status=429)
+            page = STUB_EMPTY_PAGE if word == "empty" else STUB_PAGE.format(word=word)
+            return web.Response(text=page, content_type="text/html")
+        finally:
+            in_flight[0] -= 1
+
+    # The stub runs on its own event loop, fetch_synonyms_many starts another one
+    loop = asyncio.new_event_loop()
+    app = web.Application()
+    app.router.add_get("/thes/", answer)
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    loop.run_until_complete(site.start())
+    port = runner.addresses[0][1]
+    server = threading.Thread(target=loop.run_forever, daemon=True)
+    server.start()
+    try:
+        start = time.monotonic()
+        found, failed = fetch_synonyms_many(words, pipeline, f"http://127.0.0.1:{port}/thes/")
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        server.join()
+        loop.run_until_complete(runner.cleanup())
+        loop.close()
+
+    synonym_store.open_synonym_store(store_path)
+    synonym_store.add_synonyms(lang, found)
+    synonym_store.add_failed_lookups(lang, failed)
+    stored = dict(synonym_store.iter_synonyms(lang))
+    problems = []
+    if set(stored) != set(words) - {"broken", "missing", "empty"}:
+        problems.append(f"words stored with synonyms: {sorted(stored)}")
+    if any(not synonyms for synonyms in stored.values()):
+        problems.append("a word was stored with an empty synonym list")
+    if synonym_store.failed_words(lang, words, ERROR_TTL) != {"broken", "missing"}:
+        problems.append(f"failed lookups: {sorted(synonym_store.failed_words(lang, words, ERROR_TTL))}")
+    if synonym_store.failed_words(lang, words, NO_SYNONYMS_TTL) != {"broken", "missing", "empty"}:
+        problems.append("empty was not stored with the NO_SYNONYMS_TTL expiry")
+    if synonym_store.words_to_fetch(lang, words):
+        problems.append(f"words fetched again before their expiry: {synonym_store.words_to_fetch(lang, words)}")
+    synonym_store.close_synonym_store()
+
+    counts = {word: sum(seen == word for _, seen in requests_seen) for word in ("broken", "missing", "flaky")}
+    if counts != {"broken": MAX_RETRIES + 1, "missing": 1, "flaky": 3}:
+        problems.append(f"requests per word: {counts}")
+    # After the first BURST requests, the bucket lets one through every 1 / REQUESTS_PER_SECOND seconds
+    for k, (sent, _) in enumerate(sorted(requests_seen)):
+        if sent - start < (k + 1 - BURST) / REQUESTS_PER_SECOND - 0.05:
+            problems.append(f"request {k + 1} was sent after {sent - start:.2f}s, faster than the rate limit")
+            break
+    if in_flight[1] > MAX_CONCURRENCY:
+        problems.append(f"{in_flight[1]} requests in flight, more than MAX_CONCURRENCY")
+    return problems
+
+
+if __name__ == '__main__':
+    from ufal.udpipe import Model
+    from lemma_store import UDPIPE_MODEL, batch_pipeline
+    model = Model.load(sys.argv[1] if len(sys.argv) > 1 else UDPIPE_MODEL)
+    if not model:
+        print("Error: Could not load the UDPipe model.")
+        exit(1)
+    with tempfile.TemporaryDirectory() as directory:
+        # The stub's words are lemmatised into a throwaway lemma store
+        open_lemma_store(os.path.join(directory, "lemmas.sqlite"))
+        problems = check_stub_server(batch_pipeline(model), os.path.join(directory, "synonyms.sqlite"))
+        close_lemma_store()
+    for problem in problems:
+        print(f"Failed: {problem}")
+    print("All checks passed" if not problems else f"{len(problems)} checks failed")
+    exit(1 if problems else 0)
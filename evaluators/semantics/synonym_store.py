@@ -0,0 +1,122 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Crash-safe synonym store shared by the languages of meteor_synonym.py.
+# One row per (language, word): found synonyms have no expiry, failed or empty
+# lookups carry the time after which they should be fetched again. Every batch
+# of new entries is one sqlite transaction, so an interrupted run never leaves
+# a half-written cache, and single words are looked up without loading the rest.
+SYNONYM_STORE_FILE = "evaluators/semantics/synonyms.sqlite"
+
+connection = None
+lock = threading.Lock()
+
+
+def open_synonym_store(path=SYNONYM_STORE_FILE):
+    global connection
+    connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute(
+        "CREATE TABLE IF NOT EXISTS synonyms ("
+        "lang TEXT NOT NULL, word TEXT NOT NULL, synonyms TEXT NOT NULL, expires REAL, "
+        "PRIMARY KEY (lang, word))"
+    )
+    connection.commit()
+
+
+def close_synonym_store():
+    global connection
+    if connection is not None:
+        with lock:
+            connection.close()
+            connection = None
+
+
+def import_json_cache(lang, path):
+    """One-off migration of a synonyms_cache_<lang>.json file into the store."""
+    with lock:
+        if connection.execute("SELECT 1 FROM synonyms WHERE lang = ? LIMIT 1", (lang,)).fetchone():
+            return
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        try:
+            loaded_cache = json.load(f)
+        except json.JSONDecodeError:
+            print(f"Warning: Invalid JSON in {path}. Nothing imported.")
+            return
+    # Empty entries were written for failed requests, leave them out so they are fetched again
+    add_synonyms(lang, {word: synonyms for word, synonyms in loaded_cache.items() if synonyms})
+
+
+def get_synonyms(lang, word):
+    with lock:
+        row = connection.execute(
+            "SELECT synonyms FROM synonyms WHERE lang = ? AND word = ?", (lang, word)
+        ).fetchone()
+    return set(json.loads(row[0])) if row else set()
+
+
+def iter_synonyms(lang):
+    """Stream (word, synonyms) for every word with synonyms, without building a dict of everything."""
+    with lock:
+        rows = connection.execute(
+            "SELECT word, synonyms FROM synonyms WHERE lang = ? AND expires IS NULL", (lang,)
+        ).fetchall()
+    for word, synonyms in rows:
+        yield word, json.loads(synonyms)
+
+
+def words_to_fetch(lang, words):
+    """Words that have neither synonyms stored nor an unexpired failed lookup."""
+    known = set()
+    words = list(dict.fromkeys(words))
+    now = time.time()
+    with lock:
+        for start in range(0, len(words), 500):
+            chunk = words[start:start + 500]
+            rows = connection.execute(
+                f"SELECT word FROM synonyms WHERE lang = ? AND (expires IS NULL OR expires > ?) "
+                f"AND word IN ({','.join('?' * len(chunk))})",
+                [lang, now] + chunk,
+            ).fetchall()
+            known.update(word for (word,) in rows)
+    return [word for word in words if word not in known]
+
+
+def failed_words(lang, words, ttl):
+    """Words whose failed lookup expires within ttl seconds, the lookups that errored rather than found nothing."""
+    failed = set()
+    words = list(dict.fromkeys(words))
+    limit = time.time() + ttl
+    with lock:
+        for start in range(0, len(words), 500):
+            chunk = words[start:start + 500]
+            rows = connection.execute(
+                f"SELECT word FROM synonyms WHERE lang = ? AND expires IS NOT NULL AND expires <= ? "
+                f"AND word IN ({','.join('?' * len(chunk))})",
+                [lang, limit] + chunk,
+            ).fetchall()
+            failed.update(word for (word,) in rows)
+    return failed
+
+
+def add_synonyms(lang, found):
+    """Store a dict of word -> synonyms in one transaction."""
+    with lock, connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO synonyms (lang, word, synonyms, expires) VALUES (?, ?, ?, NULL)",
+            [(lang, word, json.dumps(sorted(synonyms), ensure_ascii=False)) for word, synonyms in found.items()],
+        )
+
+
+def add_failed_lookups(lang, expiries):
+    """Store a dict of word -> expiry timestamp for lookups that failed or found nothing."""
+    with lock, connection:
+        connection.executemany(
+            "INSERT OR REPLACE INTO synonyms (lang, word, synonyms, expires) VALUES (?, ?, '[]', ?)",
+            [(lang, word, expiry) for word, expiry in expiries.items()],
+        )
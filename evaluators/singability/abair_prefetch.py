@@ -0,0 +1,238 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import requests
+import phonetics_store
+from phonetics_store import DIALECT, MAPPING
+
+# Prefetch stage for the Abair phonetiser, run before the singability analysers.
+# Every unique line (syllable and stress analysers) and line-final word (rhyme analyser)
+# of the Irish outputs of all systems is collected, packed into multi-word requests,
+# and sent concurrently over one pooled session, so scoring only reads the phonetics
+# store. Lines whose words are all stored already are not requested again.
+# Pass a base URL as the first argument to run against a local mock server, or
+# --check to run check_stub_server, which prefetches from a stub that returns the
+# wrong number of words for some lines and fails for others.
+PHONETISE_URL = "https://synthesis.abair.ie/api/phonetise"
+MAX_WORKERS = 8
+WORDS_PER_REQUEST = 40  # Keeps the query string well under URL length limits
+TIMEOUT = 30  # Seconds per request
+
+SENTENCE_SOURCES = ["ga_txt_files", "singability_files"]
+WORD_SOURCES = ["rhyme_files_ga"]
+SYSTEM_FILES = ["references.txt", "googles.txt", "nllbs.txt"]  # originals.txt is English
+
+
+def collect_lines(directories):
+    """Unique non-empty lines of every system file, skipping '*' song separators."""
+    lines = {}
+    for directory in directories:
+        for name in SYSTEM_FILES:
+            with open(f"{directory}/{name}", "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if line and "*" not in line:
+                        lines[line] = None
+    return list(lines)
+
+
+def collect_last_words(directories):
+    """Unique last words of every line, the words the rhyme analyser phonetises."""
+    words = {}
+    for directory in directories:
+        for name in SYSTEM_FILES:
+            with open(f"{directory}/{name}", "r", encoding="utf-8") as f:
+                for line in f:
+                    line_words = line.replace("*", " ").split()
+                    if line_words:
+                        words[line_words[-1]] = None
+    return list(words)
+
+
+def pack(items):
+    """Group items into requests of at most WORDS_PER_REQUEST words (a longer item goes alone)."""
+    packs = []
+    current = []
+    n_words = 0
+    for item in items:
+        item_words = len(item.split())
+        if current and n_words + item_words > WORDS_PER_REQUEST:
+            packs.append(current)
+            current, n_words = [], 0
+        current.append(item)
+        n_words += item_words
+    if current:
+        packs.append(current)
+    return packs
+
+
+def request_phonetics(session, text, base_url):
+    """One phonetise call, returning the list of word phonetisations or None on failure."""
+    params = {"text": text, "dialect": DIALECT, "mapping": MAPPING, "add_origins": "false"}
+    try:
+        response = session.get(base_url, params=params, timeout=TIMEOUT)
+        if response.status_code == 200:
+            result = response.json()
+            if isinstance(result, list):
+                return result
+        print(f"Error: {response.status_code} - {response.text[:200]}")
+    except Exception as e:
+        print(f"Request failed: {e}")
+    return None
+
+
+def phonetise_pack(session, items, base_url):
+    """
+    Phonetise a pack of items with a single request and split the result back per item.
+
+    Abair returns one entry per word, so the result is split by the word count of
+    each item. If the counts do not line up, the items are requested one by one.
+
+    :return: Dict of item -> list of word phonetisations, leaving out failed items.
+    """
+    counts = [len(item.split()) for item in items]
+    result = request_phonetics(session, " ".join(items), base_url) if len(items) > 1 else None
+    if result is not None and len(result) == sum(counts):
+        phonetics = {}
+        start = 0
+        for item, count in zip(items, counts):
+            phonetics[item] = result[start:start + count]
+            start += count
+        return phonetics
+
+    phonetics = {}
+    for item in items:
+        result = request_phonetics(session, item, base_url)
+        if result:
+            phonetics[item] = result
+    return phonetics
+
+
+def prefetch(items, base_url=PHONETISE_URL, words=False):
+    """
+    Fill the open phonetics store with every item it is missing.
+
+    :param items: Lines or single words to phonetise.
+    :param words: Items are single words, phonetised on their own rather than in context.
+    :return: Number of items added to the store.
+    """
+    items = list(dict.fromkeys(items))
+    missing_set = set(phonetics_store.missing_words(word for item in items for word in item.split()))
+    missing = [item for item in items if any(word in missing_set for word in item.split())]
+    if not missing:
+        return 0
+    added = 0
+    with requests.Session() as session:
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=MAX_WORKERS)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            packs = pack(missing)
+            # Results come back to this thread, so only one thread writes to the store
+            for phonetics in executor.map(lambda items: phonetise_pack(session, items, base_url), packs):
+                for item, result in phonetics.items():
+                    if words:
+                        phonetics_store.add_words({item: result})
+                    else:
+                        phonetics_store.add_sentence(item, result)
+                    added += 1
+    print(f"Prefetched {added} of {len(missing)} missing phonetisations")
+    return added
+
+
+def stub_phonetics(text):
+    """
+    What the stub server returns for text: one entry per word, except that the number
+    "21" is read as three words and a text with "briste" in it fails.
+    """
+    if "briste" in text.split():
+        return None
+    phonetics = []
+    for word in text.split():
+        spoken = ["fiche", "a", "haon"] if word == "21" else [word]
+        phonetics += [" ".join(spoken_word) for spoken_word in spoken]
+    return phonetics
+
+
+def check_stub_server():
+    """
+    Prefetch lines from a local stub of the phonetiser into a throwaway store and check
+    that every line gets its own phonetics back.
+
+    A pack holding the "21" line comes back with more entries than it has words, and a
+    pack holding the "briste" line fails, so both must be requested again one item at a
+    time; the other lines of those packs must not pick up a neighbour's words.
+
+    :return: List of the checks that failed, empty if everything matched.
+    """
+    lines = [f"seo líne eile focal{i}" for i in range(30)]
+    lines[7] = "bhí 21 duine ann"
+    lines[18] = "tá an líne seo briste"
+    requested = []
+
+    class StubHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            text = parse_qs(urlparse(self.path).query)["text"][0]
+            requested.append(text)
+            phonetics = stub_phonetics(text)
+            body = json.dumps(phonetics if phonetics is not None else {"error": "briste"}).encode("utf-8")
+            self.send_response(200 if phonetics is not None else 500)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    problems = []
+    with tempfile.TemporaryDirectory() as directory:
+        # The store opens relative to the working directory, so no legacy cache is imported
+        working_directory = os.getcwd()
+        os.chdir(directory)
+        try:
+            phonetics_store.open_phonetics_store(os.path.join(directory, "phonetics_store.json"))
+            added = prefetch(lines, f"http://127.0.0.1:{server.server_address[1]}/")
+            for line in lines:
+                stored = phonetics_store.sentence_phonetics(line)
+                if stored != stub_phonetics(line):
+                    problems.append(f"{line!r} was stored as {stored}, expected {stub_phonetics(line)}")
+            phonetics_store.close_phonetics_store()
+        finally:
+            os.chdir(working_directory)
+            server.shutdown()
+            server.server_close()
+
+    if added != len(lines) - 1:
+        problems.append(f"{added} lines added, expected {len(lines) - 1}")
+    # Packs with a bad line are requested once whole and then once per line
+    expected = sorted(" ".join(items) for items in pack(lines))
+    expected += sorted(item for items in pack(lines) if {lines[7], lines[18]} & set(items) for item in items)
+    if len(requested) != len(expected) or sorted(requested) != sorted(expected):
+        problems.append(f"{len(requested)} requests sent, expected {len(expected)}")
+    return problems
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ["--check"]:
+        problems = check_stub_server()
+        for problem in problems:
+            print(f"Failed: {problem}")
+        print("All checks passed" if not problems else f"{len(problems)} checks failed")
+        exit(1 if problems else 0)
+
+    base_url = sys.argv[1] if len(sys.argv) > 1 else PHONETISE_URL
+
+    phonetics_store.open_phonetics_store()
+    # Words first: the rhyme analyser needs them on their own, and lines then only
+    # need requesting where they contain words the rhyme files did not
+    prefetch(collect_last_words(WORD_SOURCES), base_url, words=True)
+    prefetch(collect_lines(SENTENCE_SOURCES), base_url)
+    phonetics_store.close_phonetics_store()
@@ -0,0 +1,323 @@
+import json
+import re
+import sys
+import unicodedata
+import phonetics_cache
+import phonetics_store
+from rhyme_index import irish_rhyme_part
+
+# Rule-based Irish phonetiser, the offline counterpart of the Abair API.
+# Produces Abair-style strings ("1 b u nn", syllables joined by " . ", each starting
+# with its stress digit) for the Connemara dialect and the mrpai mapping, so words
+# missing from the phonetics store resolve locally instead of failing the run.
+# A word is split into alternating consonant and vowel groups. Each vowel group has
+# one nucleus, consonants take their broad or slender quality from the vowel letters
+# next to them (caol le caol, leathan le leathan), and lenited, eclipsed and prefixed
+# initials are rewritten first. Stress falls on the first syllable except for the
+# adverbs in SECOND_SYLLABLE_STRESS and the function words in UNSTRESSED_WORDS, and
+# short vowels of unstressed syllables are reduced to @. The rules are tuned against
+# the Abair entries of the phonetics caches, and
+#   python irish_g2p.py [phonetics_cache.json]
+# prints how often the local phonetisation agrees with them.
+VALIDATION_FILE = "rhyme_files_ga/phonetics_cache.json"
+# Never call the Abair API and phonetise everything that is not in the phonetics store locally
+OFFLINE = False
+# Sentences with words phonetised here since the start of the run, so callers can tell
+# which results would change once Abair answers for them
+fallback_sentences = set()
+
+# ə and ɪ are the broad and slender epenthetic vowels inserted by split_groups
+VOWEL_LETTERS = "aeiouáéíóúəɪ"
+SLENDER_LETTERS = "eiéíɪ"
+REDUCED_VOWELS = {"a", "e", "i", "o", "u"}
+
+# Vowel group spelling -> nucleus in a stressed syllable, glide letters only mark quality
+VOWEL_GROUPS = {
+    "a": "a", "e": "e", "i": "i", "o": "o", "u": "u",
+    "á": "aa", "é": "ee", "í": "ii", "ó": "oo", "ú": "uu",
+    "ai": "a", "ea": "a", "eai": "a", "ei": "e", "oi": "o", "ui": "i", "io": "i", "iu": "u",
+    "ái": "aa", "eá": "aa", "eái": "aa", "éa": "ee", "éi": "ee", "ae": "ee", "aei": "ee",
+    "aí": "ii", "uí": "ii", "oí": "ii", "ío": "ii", "uío": "ii", "aío": "ii", "ao": "ii", "aoi": "ii",
+    "ó": "oo", "ói": "oo", "eo": "oo", "eoi": "oo", "eó": "oo", "eói": "oo",
+    "úi": "uu", "iú": "uu", "iúi": "uu",
+    "ia": "i@", "iai": "i@", "ua": "u@", "uai": "u@", "ə": "@", "ɪ": "@",
+}
+# Consonant spelling -> (broad, slender) phoneme, "" for silent letters
+CONSONANTS = {
+    "b": ("b", "bj"), "bh": ("v", "vj"), "c": ("k", "kj"), "ch": ("x", "xj"),
+    "d": ("d", "dj"), "dh": ("gf", "gfj"), "f": ("f", "fj"), "fh": ("", ""),
+    "g": ("g", "gj"), "gh": ("gf", "gfj"), "h": ("h", "h"), "j": ("dj", "dj"),
+    "k": ("k", "kj"), "l": ("ll", "lj"), "ll": ("ll", "llj"), "m": ("m", "mj"),
+    "mh": ("v", "vj"), "n": ("nn", "nj"), "nn": ("nn", "nnj"), "ng": ("ng", "ngj"),
+    "p": ("p", "pj"), "ph": ("f", "fj"), "q": ("k", "kj"), "r": ("r", "rj"),
+    "rr": ("r", "r"), "s": ("s", "sj"), "sh": ("h", "xj"), "t": ("t", "tj"),
+    "th": ("h", "h"), "v": ("v", "vj"), "w": ("v", "v"), "x": ("k s", "kj sj"),
+    "y": ("", ""), "z": ("z", "zj"),
+}
+DIGRAPHS = {"bh", "ch", "dh", "fh", "gh", "mh", "ph", "sh", "th", "ll", "nn", "rr", "ng"}
+# Eclipsed and t-prefixed initials -> the consonant that is pronounced
+ECLIPSES = {"bhf": "bh", "mb": "m", "gc": "g", "nd": "nn", "bp": "b", "dt": "d", "ts": "t", "ng": "ng"}
+# Initial clusters whose n is pronounced r in Connemara
+NASAL_R_CLUSTERS = {"cn": "cr", "gn": "gr", "mn": "mr", "tn": "tr"}
+# Consonants that begin a syllable together with a following l or r
+OBSTRUENTS = {"b", "bj", "p", "pj", "t", "tj", "d", "dj", "k", "kj", "g", "gj", "f", "fj", "v", "vj", "gf", "x"}
+LIQUIDS = {"r", "rj", "ll", "lj"}
+# l, n or r and a following consonant that are split by an epenthetic vowel after a short vowel
+EPENTHESIS = {"l": ("b", "bh", "m", "mh", "g", "ch", "f"), "r": ("b", "bh", "m", "mh", "g", "ch", "f"),
+              "n": ("b", "bh", "m", "mh")}
+# Stressed short vowels lengthened before these clusters at the end of a word
+LENGTHENING = {"a": "aa", "ea": "aa", "o": "au", "ai": "ii", "oi": "ii", "ui": "ii", "i": "ii"}
+LONG_VOWELS = {"aa", "ee", "ii", "oo", "uu"}
+# Adverbs and similar words stressed on their second syllable
+SECOND_SYLLABLE_STRESS = {
+    "amach", "isteach", "istigh", "amuigh", "anois", "arís", "inniu", "inné", "amárach", "anocht",
+    "anseo", "ansin", "ansiúd", "aníos", "anuas", "aniar", "anoir", "anall", "anonn", "abhaile",
+    "amháin", "ariamh", "aréir", "anuraidh", "fadó", "tobac", "buidéal", "bradán",
+}
+# Articles, particles and prepositions that Abair leaves unstressed
+UNSTRESSED_WORDS = {"a", "ag", "an", "ar", "ba", "de", "do", "go", "gur", "i", "is", "le", "mo", "na", "sa", "san", "sna", "sé"}
+
+word_table = {}  # word -> phonetisation, for the words of this run
+
+
+def normalise_word(word):
+    word = unicodedata.normalize("NFC", word.lower()).replace("’", "'")
+    # h-, n- and t- prefixes are pronounced as part of the word
+    return re.sub(r"[^a-záéíóú]", "", word)
+
+
+def split_groups(word):
+    """
+    Split a word into alternating consonant and vowel letter groups, starting with a consonant group.
+
+    An epenthetic vowel of the quality of the preceding vowel is inserted where
+    EPENTHESIS applies, so "dearg" is read as "dearəg".
+    """
+    groups = re.findall(f"[{VOWEL_LETTERS}]+|[^{VOWEL_LETTERS}]+", word)
+    if groups and groups[0][0] in VOWEL_LETTERS:
+        groups.insert(0, "")
+    for k in range(len(groups) - 1 - (len(groups) - 1) % 2, 1, -2):
+        group = groups[k]
+        if group[1:] in EPENTHESIS.get(group[:1], ()) and vowel_nucleus(groups[k - 1]) in REDUCED_VOWELS:
+            epenthetic = "ɪ" if groups[k - 1][-1] in SLENDER_LETTERS else "ə"
+            groups[k:k + 1] = [group[0], epenthetic, group[1:]]
+    return groups
+
+
+def vowel_nucleus(group):
+    """Nucleus of a vowel group, from the longest spelling in VOWEL_GROUPS that it contains."""
+    nucleus = VOWEL_GROUPS.get(group)
+    if nucleus is not None:
+        return nucleus
+    for length in range(len(group) - 1, 0, -1):
+        for start in range(len(group) - length + 1):
+            nucleus = VOWEL_GROUPS.get(group[start:start + length])
+            if nucleus is not None and group[start:start + length] not in SLENDER_LETTERS:
+                return nucleus
+    return VOWEL_GROUPS[group[0]]
+
+
+def consonant_units(group, initial):
+    """Split a consonant group into letters and digraphs, rewriting eclipsed and prefixed initials."""
+    if initial:
+        for spelling, pronounced in ECLIPSES.items():
+            if group.startswith(spelling) and (spelling != "ng" or len(group) == 2):
+                group = pronounced + group[len(spelling):]
+                break
+        group = NASAL_R_CLUSTERS.get(group[:2], group[:2]) + group[2:]
+    units = []
+    i = 0
+    while i < len(group):
+        if group[i:i + 2] in DIGRAPHS:
+            units.append(group[i:i + 2])
+            i += 2
+        else:
+            units.append(group[i])
+            i += 1
+    return units
+
+
+def consonant_phonemes(units, slender, position):
+    """
+    Phonemes of a consonant group.
+
+    :param slender: Whether the group is slender, from the neighbouring vowel letters.
+    :param position: "initial", "coda" (of a syllable inside the word), "medial" or "final" in the word.
+    """
+    phonemes = []
+    for i, unit in enumerate(units):
+        # dh, gh and th are silent inside and at the end of words, fh is always silent
+        if unit in ("dh", "gh") and position != "initial":
+            continue
+        if unit == "th" and (position in ("coda", "final") or i > 0):
+            continue
+        # Initial thr is a devoiced r
+        if position == "initial" and i == 0 and unit == "th" and units[1:2] == ["r"]:
+            phonemes.append("rj_d" if slender else "r_d")
+            continue
+        if position == "initial" and i == 1 and units[0] == "th" and unit == "r":
+            continue
+        quality = slender
+        # r is broad at the start of a word and before another consonant
+        if unit in ("r", "rr") and (position == "initial" and i == 0 or position == "coda" or i < len(units) - 1):
+            quality = False
+        elif position == "initial" and unit == "s" and units[i + 1:i + 2] in (["p"], ["t"], ["c"], ["m"]):
+            quality = False
+        phoneme = CONSONANTS.get(unit, ("", ""))[1 if quality else 0]
+        if position == "initial" and i == 0 and phoneme in ("lj", "nj") and len(units) == 1:
+            phoneme = {"lj": "llj", "nj": "nnj"}[phoneme]
+        if phoneme:
+            phonemes += phoneme.split()
+    return phonemes
+
+
+def split_onset(phonemes):
+    """Split the consonants between two nuclei into the coda of one syllable and the onset of the next."""
+    if not phonemes:
+        return [], []
+    onset = 1
+    if len(phonemes) >= 2 and phonemes[-2] in OBSTRUENTS and phonemes[-1] in LIQUIDS:
+        onset = 2
+    return phonemes[:-onset], phonemes[-onset:]
+
+
+def stressed_vocalisation(nucleus, group, next_units, last):
+    """
+    Diphthongs and long vowels from a stressed vowel and the consonants after it.
+
+    Short vowels before dh, gh, bh and mh become diphthongs, and before a final ll, nn
+    or rr, or before rd, rl and rn, they are lengthened.
+
+    :return: (nucleus, number of consonant units consumed).
+    """
+    if not next_units:
+        return nucleus, 0
+    unit = next_units[0]
+    if unit in ("dh", "gh") and group in ("a", "ai", "ea", "ei", "eai"):
+        return "ai", 1
+    if unit in ("bh", "mh") and group in ("a", "ea", "o") and (last or len(next_units) > 1):
+        return "au", 1
+    if unit in ("dh", "gh") and group in ("o", "oi"):
+        return "au", 1
+    if unit == "mh" and group == "o" and not last:
+        return "uu", 1
+    if unit in ("ll", "nn", "rr") and last and len(next_units) == 1 and group in LENGTHENING:
+        if group != "i" or unit == "nn":
+            return LENGTHENING[group], 0
+    if unit == "r" and next_units[1:2] in (["d"], ["l"], ["n"]) and group in ("a", "ea", "o"):
+        return LENGTHENING[group], 0
+    return nucleus, 0
+
+
+def phonetise_word(word):
+    """
+    Abair-style phonetisation of one Irish word, memoised in word_table.
+
+    :return: String like "1 b u . 0 nn @", or "" for words without letters.
+    """
+    phonetisation = word_table.get(word)
+    if phonetisation is not None:
+        return phonetisation
+
+    normalised = normalise_word(word)
+    groups = split_groups(normalised)
+    vowel_groups = groups[1::2]
+    consonant_groups = groups[0::2]
+    if not vowel_groups:
+        # Abbreviations and other words without vowels are read as one syllable
+        units = consonant_units(normalised, True)
+        phonemes = consonant_phonemes(units, False, "initial")
+        phonetisation = "1 " + " ".join(phonemes) if phonemes else ""
+        word_table[word] = phonetisation
+        return phonetisation
+    if len(consonant_groups) == len(vowel_groups):
+        consonant_groups.append("")
+
+    stressed = 1 if normalised in SECOND_SYLLABLE_STRESS and len(vowel_groups) > 1 else 0
+    if normalised in UNSTRESSED_WORDS:
+        stressed = None
+    units = [consonant_units(group, k == 0) for k, group in enumerate(consonant_groups)]
+    syllables = [[] for _ in vowel_groups]
+    onset = consonant_phonemes(units[0], vowel_groups[0][0] in SLENDER_LETTERS, "initial")
+
+    for k, group in enumerate(vowel_groups):
+        last = k == len(vowel_groups) - 1
+        nucleus = vowel_nucleus(group)
+        following = units[k + 1]
+        if k == stressed:
+            nucleus, consumed = stressed_vocalisation(nucleus, group, following, last)
+            following = following[consumed:]
+        elif nucleus in REDUCED_VOWELS:
+            nucleus = "@"
+        syllables[k] = onset + [nucleus]
+
+        slender_before = group[-1] in SLENDER_LETTERS
+        if last:
+            # A final dh or gh after a long vowel is still pronounced
+            if following in (["dh"], ["gh"]) and nucleus in LONG_VOWELS:
+                syllables[k] += consonant_phonemes(following, slender_before, "initial")
+            else:
+                syllables[k] += consonant_phonemes(following, slender_before, "final")
+            break
+        slender_after = vowel_groups[k + 1][0] in SLENDER_LETTERS
+        coda_units, onset_units = following[:-1], following[-1:]
+        consonants = (consonant_phonemes(coda_units, slender_before, "coda")
+                      + consonant_phonemes(onset_units, slender_after, "medial"))
+        coda, onset = split_onset(consonants)
+        syllables[k] += coda
+
+    phonetisation = " . ".join(("1 " if k == stressed else "0 ") + " ".join(syllable)
+                               for k, syllable in enumerate(syllables))
+    word_table[word] = phonetisation
+    return phonetisation
+
+
+def phonetise_sentence(sentence):
+    """Phonetisation of every word of a sentence, in the list format of the Abair API."""
+    return [phonetise_word(word) for word in sentence.split() if normalise_word(word)]
+
+
+def fallback_phonetics(sentence, dialect=phonetics_store.DIALECT, mapping=phonetics_store.MAPPING):
+    """
+    Phonetisation of a sentence that Abair could not give, in the list format of the API.
+
+    Words in the phonetics store keep Abair's phonetisation and only the others are
+    phonetised locally, so a line reads the same as its words do on their own.
+    """
+    phonetics = []
+    for word in sentence.split():
+        entries = phonetics_cache.peek(phonetics_store.store_key(word, dialect, mapping))
+        if entries is None:
+            entries = [phonetise_word(word)] if normalise_word(word) else []
+            fallback_sentences.add(sentence)
+        phonetics += entries
+    return phonetics
+
+
+def validate(path=VALIDATION_FILE):
+    """
+    Compare the local phonetisation with Abair's for every word of a phonetics cache.
+
+    :return: Dict of agreement rates for the whole string, the syllable count, the
+        stress pattern and the rhyme part.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    agreement = {"words": 0, "exact": 0, "syllables": 0, "stress": 0, "rhyme_part": 0}
+    for word, expected in entries.items():
+        if isinstance(expected, list):
+            expected = expected[0] if len(expected) == 1 else None
+        if not expected or " " in word.strip():
+            continue
+        local = phonetise_word(word)
+        agreement["words"] += 1
+        agreement["exact"] += local == expected
+        agreement["syllables"] += local.count(" . ") == expected.count(" . ")
+        agreement["stress"] += re.sub(r"\D", "", local) == re.sub(r"\D", "", expected)
+        agreement["rhyme_part"] += irish_rhyme_part(local) == irish_rhyme_part(expected)
+    return {key: value if key == "words" else value / max(agreement["words"], 1) for key, value in agreement.items()}
+
+
+if __name__ == '__main__':
+    for key, value in validate(sys.argv[1] if len(sys.argv) > 1 else VALIDATION_FILE).items():
+        print(f"{key}: {value if key == 'words' else f'{value:.1%}'}")
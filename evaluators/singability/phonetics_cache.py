@@ -0,0 +1,248 @@
+import atexit
+import json
+import mmap
+import os
+import sqlite3
+import time
+import numpy as np
+
+# Write-behind cache for Abair phonetisations, the storage layer of phonetics_store.py.
+# Lookups and new entries stay in memory; new entries are flushed in batches (every
+# FLUSH_EVERY entries or FLUSH_INTERVAL seconds, and at exit) instead of rewriting
+# the whole file on every miss. The JSON backend writes a temporary file and renames
+# it over the cache so a crash never leaves a truncated file. The sqlite backend
+# reads entries on demand, for vocabularies too large to keep loaded. The snapshot
+# backend is a read-only copy written by write_snapshot, sorted rows and a byte offset
+# array like the pronunciation index, which worker processes memory-map and binary
+# search; their new entries stay in memory and are handed back with take_pending.
+FLUSH_EVERY = 200
+FLUSH_INTERVAL = 30  # Seconds
+SNAPSHOT_ENTRIES = "entries.tsv"
+SNAPSHOT_OFFSETS = "offsets.npy"
+
+cache = {}  # Everything loaded (json) or looked up so far (sqlite)
+pending = {}  # Entries added since the last flush
+cache_path = None
+backend = "json"
+connection = None
+snapshot_data = None
+snapshot_offsets = None
+hits = 0
+misses = 0
+last_flush = time.monotonic()
+registered = False
+
+
+def open_phonetics_cache(path, cache_backend="json"):
+    """
+    Open the phonetics cache at path.
+
+    :param cache_backend: "json" to load the whole file, "sqlite" to read entries on demand,
+        "snapshot" to map a directory written by write_snapshot read-only.
+    """
+    global cache, pending, cache_path, backend, connection, snapshot_data, snapshot_offsets
+    global hits, misses, last_flush, registered
+    close_phonetics_cache(report=False)
+    cache, pending = {}, {}
+    cache_path, backend = path, cache_backend
+    hits = misses = 0
+    last_flush = time.monotonic()
+
+    if backend == "sqlite":
+        connection = sqlite3.connect(path, timeout=60)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS phonetics (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        connection.commit()
+    elif backend == "snapshot":
+        with open(os.path.join(path, SNAPSHOT_ENTRIES), "rb") as f:
+            # mmap cannot map an empty file
+            snapshot_data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(f.name) else b""
+        snapshot_offsets = np.load(os.path.join(path, SNAPSHOT_OFFSETS), mmap_mode="r")
+    elif os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, "r", encoding="utf-8") as f:
+            try:
+                cache = json.load(f)
+            except json.JSONDecodeError:
+                print(f"Warning: Invalid JSON in {path}. Starting with an empty cache.")
+
+    if not registered:
+        atexit.register(close_phonetics_cache)
+        registered = True
+
+
+def find_snapshot_entry(key):
+    """Binary search the snapshot for key, returning its value or None."""
+    encoded = key.encode("utf-8")
+    low, high = 0, len(snapshot_offsets) - 1
+    while low < high:
+        middle = (low + high) // 2
+        row = snapshot_data[int(snapshot_offsets[middle]):int(snapshot_offsets[middle + 1]) - 1]
+        row_key = row[:row.index(b"\t")]
+        if row_key == encoded:
+            return json.loads(row[len(row_key) + 1:])
+        if row_key < encoded:
+            low = middle + 1
+        else:
+            high = middle
+    return None
+
+
+def peek(key):
+    """Return the cached value of key, or None, without counting it in the statistics."""
+    if key not in cache and connection is not None:
+        row = connection.execute("SELECT value FROM phonetics WHERE key = ?", (key,)).fetchone()
+        if row is not None:
+            cache[key] = json.loads(row[0])
+    elif key not in cache and snapshot_offsets is not None:
+        value = find_snapshot_entry(key)
+        if value is not None:
+            cache[key] = value
+    return cache.get(key)
+
+
+def lookup(key):
+    """Return the cached phonetisation of key, or None on a miss."""
+    global hits, misses
+    value = peek(key)
+    if value is None:
+        misses += 1
+    else:
+        hits += 1
+    return value
+
+
+def missing_keys(keys):
+    """Keys without a cached entry, without counting them as lookups in the statistics."""
+    keys = [key for key in keys if key not in cache]
+    if connection is not None and keys:
+        known = set()
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = connection.execute(
+                f"SELECT key FROM phonetics WHERE key IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall()
+            known.update(key for (key,) in rows)
+        keys = [key for key in keys if key not in known]
+    if snapshot_offsets is not None:
+        keys = [key for key in keys if find_snapshot_entry(key) is None]
+    return keys
+
+
+def iter_entries():
+    """Stream every (key, value) in the cache, including entries not yet flushed."""
+    if connection is not None:
+        flush()
+        for key, value in connection.execute("SELECT key, value FROM phonetics"):
+            yield key, json.loads(value)
+    elif snapshot_offsets is not None:
+        for k in range(len(snapshot_offsets) - 1):
+            key, value = snapshot_data[int(snapshot_offsets[k]):int(snapshot_offsets[k + 1]) - 1].split(b"\t", 1)
+            if key.decode("utf-8") not in pending:
+                yield key.decode("utf-8"), json.loads(value)
+        yield from list(pending.items())
+    else:
+        yield from list(cache.items())
+
+
+def store(key, value):
+    """Add an entry in memory; it reaches disk with the next batched flush."""
+    cache[key] = value
+    pending[key] = value
+    if len(pending) >= FLUSH_EVERY or time.monotonic() - last_flush >= FLUSH_INTERVAL:
+        flush()
+
+
+def flush():
+    global pending, last_flush
+    last_flush = time.monotonic()
+    # A snapshot is read-only, its new entries wait for take_pending
+    if not pending or cache_path is None or backend == "snapshot":
+        return
+    if connection is not None:
+        with connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO phonetics (key, value) VALUES (?, ?)",
+                [(key, json.dumps(value, ensure_ascii=False)) for key, value in pending.items()],
+            )
+    else:
+        directory = os.path.dirname(cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(cache, f, ensure_ascii=False, indent=4)
+        os.replace(tmp_path, cache_path)
+    pending = {}
+
+
+def take_pending():
+    """Return the entries added since the last call and forget them, for a snapshot worker to hand back."""
+    global pending
+    entries, pending = pending, {}
+    return entries
+
+
+def take_stats():
+    """Return (hits, misses) since the last call and reset them, for a snapshot worker to hand back."""
+    global hits, misses
+    stats = (hits, misses)
+    hits = misses = 0
+    return stats
+
+
+def merge_stats(stats):
+    """Add the (hits, misses) of a worker to this process's statistics."""
+    global hits, misses
+    hits += stats[0]
+    misses += stats[1]
+
+
+def merge_entries(entries):
+    """
+    Add entries collected from workers, keeping any value the cache already has.
+
+    Entries are added in key order, so merging the workers' results in a fixed order
+    gives the same cache whatever order the workers finished in.
+    """
+    for key in sorted(entries):
+        if peek(key) is None:
+            store(key, entries[key])
+
+
+def write_snapshot(directory):
+    """Write every entry, flushed first, to directory for the "snapshot" backend."""
+    flush()
+    rows = sorted((key.encode("utf-8"), f"{key}\t{json.dumps(value, ensure_ascii=False)}\n".encode("utf-8"))
+                  for key, value in iter_entries())
+    os.makedirs(directory, exist_ok=True)
+    row_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    row_offsets[1:] = np.cumsum([len(row) for _, row in rows])
+    entries_path = os.path.join(directory, SNAPSHOT_ENTRIES)
+    tmp_path = f"{entries_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.writelines(row for _, row in rows)
+    os.replace(tmp_path, entries_path)
+    offsets_path = os.path.join(directory, SNAPSHOT_OFFSETS)
+    tmp_path = f"{offsets_path}.{os.getpid()}.tmp.npy"
+    np.save(tmp_path, row_offsets)
+    os.replace(tmp_path, offsets_path)
+
+
+def report_stats():
+    total = hits + misses
+    rate = hits / total if total else 0
+    print(f"Phonetics cache {cache_path}: {hits} hits, {misses} misses ({rate:.1%} hit rate)")
+
+
+def close_phonetics_cache(report=True):
+    global connection, cache_path, snapshot_data, snapshot_offsets
+    if cache_path is None:
+        return
+    flush()
+    if report:
+        report_stats()
+    if connection is not None:
+        connection.close()
+        connection = None
+    snapshot_data = snapshot_offsets = None
+    cache_path = None
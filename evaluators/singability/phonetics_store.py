@@ -0,0 +1,132 @@
+import json
+import os
+import phonetics_cache
+
+# Word-level Abair phonetics shared by the syllable, stress and rhyme analysers.
+# Entries are keyed by (dialect, mapping, word) and hold the list Abair returns for
+# the word, so a sentence is built from its words and a new line whose words are
+# all known needs no request. Where a word is pronounced differently inside a
+# sentence than on its own (coarticulation), the whole sentence is kept as an
+# override. Keys are "dialect|mapping|text": words never contain spaces, so
+# sentence overrides cannot collide with word entries.
+PHONETICS_STORE_FILE = "singability_files/phonetics_store.json"
+# Caches written by earlier versions of the analysers, imported into the store once.
+# The paths imported so far are kept under LEGACY_IMPORTED_KEY, which has no "|" and so
+# is never read as a word or sentence.
+LEGACY_CACHE_FILES = ["rhyme_files_ga/phonetics_cache.json", "singability_files/phonetics_cache.json"]
+LEGACY_IMPORTED_KEY = "legacy_caches_imported"
+DIALECT = "co"
+MAPPING = "mrpai"
+
+
+def store_key(text, dialect=DIALECT, mapping=MAPPING):
+    return f"{dialect}|{mapping}|{text}"
+
+
+def open_phonetics_store(path=PHONETICS_STORE_FILE, backend="json"):
+    phonetics_cache.open_phonetics_cache(path, backend)
+    imported = phonetics_cache.peek(LEGACY_IMPORTED_KEY) or []
+    new_paths = [legacy_path for legacy_path in LEGACY_CACHE_FILES
+                 if legacy_path not in imported and os.path.exists(legacy_path)]
+    if new_paths:
+        import_legacy_caches(new_paths)
+        phonetics_cache.store(LEGACY_IMPORTED_KEY, imported + new_paths)
+
+
+def close_phonetics_store():
+    phonetics_cache.close_phonetics_cache()
+
+
+def import_legacy_caches(paths, dialect=DIALECT, mapping=MAPPING):
+    """
+    Merge sentence caches (text -> list) and word caches (word -> string) into the store.
+
+    Word entries of every file go in before any sentence, so whether a sentence is kept
+    as an override does not depend on the order of the files.
+    """
+    words, sentences = {}, {}
+    for path in paths:
+        if os.path.getsize(path) == 0:
+            continue
+        with open(path, "r", encoding="utf-8") as f:
+            try:
+                legacy_cache = json.load(f)
+            except json.JSONDecodeError:
+                print(f"Warning: Invalid JSON in {path}. Nothing imported.")
+                continue
+        for text, phonetics in legacy_cache.items():
+            if isinstance(phonetics, str):
+                words[text] = [phonetics]
+            elif phonetics:
+                sentences[text] = phonetics
+    add_words(words, dialect, mapping)
+    for sentence, phonetics in sentences.items():
+        add_sentence(sentence, phonetics, dialect, mapping)
+
+
+def add_words(words, dialect=DIALECT, mapping=MAPPING):
+    """Store a dict of word -> list of phonetisations, as returned by Abair for the word alone."""
+    for word, phonetics in words.items():
+        key = store_key(word, dialect, mapping)
+        if phonetics_cache.peek(key) != phonetics:
+            phonetics_cache.store(key, phonetics)
+
+
+def add_sentence(sentence, phonetics, dialect=DIALECT, mapping=MAPPING):
+    """
+    Store the phonetisation of a sentence through its words.
+
+    Unknown words get the form they have in the sentence. If a known word comes
+    out differently here, or Abair did not return one entry per word, the
+    sentence is kept as an override.
+    """
+    words = sentence.split()
+    override = len(words) != len(phonetics)
+    if not override:
+        for word, word_phonetics in zip(words, phonetics):
+            key = store_key(word, dialect, mapping)
+            known = phonetics_cache.peek(key)
+            if known is None:
+                phonetics_cache.store(key, [word_phonetics])
+            elif known != [word_phonetics]:
+                override = True
+    if override and len(words) > 1:
+        key = store_key(" ".join(words), dialect, mapping)
+        if phonetics_cache.peek(key) != phonetics:
+            phonetics_cache.store(key, phonetics)
+
+
+def word_phonetics(word, dialect=DIALECT, mapping=MAPPING):
+    """List of phonetisations of a word, or None if it has not been fetched."""
+    return phonetics_cache.lookup(store_key(word, dialect, mapping))
+
+
+def sentence_phonetics(sentence, dialect=DIALECT, mapping=MAPPING):
+    """List of word phonetisations of a sentence, or None if any of its words is missing."""
+    words = sentence.split()
+    if len(words) > 1:
+        override = phonetics_cache.peek(store_key(" ".join(words), dialect, mapping))
+        if override is not None:
+            return override
+    phonetics = []
+    for word in words:
+        entries = word_phonetics(word, dialect, mapping)
+        if entries is None:
+            return None
+        phonetics += entries
+    return phonetics
+
+
+def iter_words(dialect=DIALECT, mapping=MAPPING):
+    """Stream (word, list of phonetisations) for every word entry, leaving out sentence overrides."""
+    prefix = store_key("", dialect, mapping)
+    for key, phonetics in phonetics_cache.iter_entries():
+        if key.startswith(prefix) and " " not in key[len(prefix):]:
+            yield key[len(prefix):], phonetics
+
+
+def missing_words(words, dialect=DIALECT, mapping=MAPPING):
+    """Words of the iterable that have no entry in the store."""
+    words = list(dict.fromkeys(words))
+    missing = set(phonetics_cache.missing_keys([store_key(word, dialect, mapping) for word in words]))
+    return [word for word in words if store_key(word, dialect, mapping) in missing]
@@ -0,0 +1,118 @@
+import mmap
+import os
+import numpy as np
+import pronouncing
+import textstat
+
+# Precompiled English pronunciation index shared by the syllable, stress and rhyme analysers.
+# The CMU dictionary is compiled once into a sorted file of one row per word
+# (word, syllable count, stress string, first pronunciation, rhyme parts) and a
+# byte offset array. Both are memory-mapped and searched by binary search, so a
+# run loads nothing up front and every word costs one lookup, memoised in word_table.
+INDEX_DIR = "singability_files/pronunciation_index"
+INDEX_FILE = f"{INDEX_DIR}/pronunciations.tsv"
+OFFSETS_FILE = f"{INDEX_DIR}/offsets.npy"
+
+index_data = None
+offsets = None
+word_table = {}  # word -> (phones, syllables, stress, rhyme parts), for the words of this run
+
+
+def rhyme_part(phones):
+    """The last stressed vowel of a pronunciation and everything after it, or None."""
+    phonemes = phones.split(" ")
+    for i in range(len(phonemes) - 1, -1, -1):
+        phoneme = phonemes[i]
+        if phoneme[-1] in "12" and phoneme[0] in "AEIOU":  # Check for stress (1 or 2) and vowel
+            return " ".join(phonemes[i:])
+    return None
+
+
+def build_pronunciation_index():
+    pronouncing.init_cmu()
+    rows = []
+    for word, pronunciations in pronouncing.lookup.items():
+        phones = pronunciations[0]
+        rhyme_parts = [part for part in dict.fromkeys(rhyme_part(p) for p in pronunciations) if part]
+        row = f"{word}\t{pronouncing.syllable_count(phones)}\t{pronouncing.stresses(phones)}\t{phones}\t{'|'.join(rhyme_parts)}\n"
+        rows.append((word.encode("utf-8"), row.encode("utf-8")))
+    # Sorted as bytes, the order the binary search compares in
+    rows.sort()
+
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    row_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+    row_offsets[1:] = np.cumsum([len(row) for _, row in rows])
+    tmp_path = f"{INDEX_FILE}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.writelines(row for _, row in rows)
+    os.replace(tmp_path, INDEX_FILE)
+    tmp_path = f"{OFFSETS_FILE}.{os.getpid()}.tmp.npy"
+    np.save(tmp_path, row_offsets)
+    os.replace(tmp_path, OFFSETS_FILE)
+
+
+def load_pronunciation_index():
+    global index_data, offsets
+    if not os.path.exists(INDEX_FILE) or not os.path.exists(OFFSETS_FILE):
+        build_pronunciation_index()
+    with open(INDEX_FILE, "rb") as f:
+        index_data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    offsets = np.load(OFFSETS_FILE, mmap_mode="r")
+
+
+def find_row(word):
+    """Binary search the index for a lowercase word, returning its fields or None."""
+    key = word.encode("utf-8")
+    low, high = 0, len(offsets) - 1
+    while low < high:
+        middle = (low + high) // 2
+        start = int(offsets[middle])
+        row = index_data[start:int(offsets[middle + 1]) - 1]
+        row_word = row[:row.index(b"\t")]
+        if row_word == key:
+            return row.decode("utf-8").split("\t")
+        if row_word < key:
+            low = middle + 1
+        else:
+            high = middle
+    return None
+
+
+def syllable_count_fallback(word):
+    """Syllable count of a word missing from the CMU dictionary, using textstat."""
+    count = textstat.syllable_count(word)
+    return count if count else 1  # Default to 1 if all else fails
+
+
+def lookup_word(word):
+    """
+    Everything the analysers need about an English word, in one lookup.
+
+    :return: (phones, syllables, stress, rhyme parts) where phones is the first CMU
+        pronunciation, or None for a word missing from the dictionary. Missing words
+        get a textstat syllable count, an empty stress string and no rhyme parts.
+    """
+    entry = word_table.get(word)
+    if entry is not None:
+        return entry
+    if offsets is None:
+        load_pronunciation_index()
+    row = find_row(word.lower())
+    if row is None:
+        entry = (None, syllable_count_fallback(word), "", [])
+    else:
+        _, syllables, stress, phones, rhyme_parts = row
+        entry = (phones, int(syllables), stress, rhyme_parts.split("|") if rhyme_parts else [])
+    word_table[word] = entry
+    return entry
+
+
+def lookup_line(line):
+    """
+    Syllable count, stress pattern and end rhyme parts of an English line.
+
+    :return: (syllables, stress pattern, rhyme parts of the last word), the form of
+        singability_analyser.analyse_line, from the lookup_word entries of its words.
+    """
+    entries = [lookup_word(word) for word in line.split()]
+    return sum(entry[1] for entry in entries), "".join(entry[2] for entry in entries), entries[-1][3] if entries else []
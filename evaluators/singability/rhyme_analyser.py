@@ -5,49 +5,52 @@
 from collections import defaultdict
 import re
 import urllib.parse
-import json
 import os
+import sys
 import difflib
-import pronouncing
 import requests
+import phonetics_store
+import irish_g2p
+import pronunciation_index
+import rhyme_index
+# results_store.py is shared with the semantics evaluators
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import results_store
 
 
-# Cache file path of all Irish sentences with phonetic transcriptions
-CACHE_FILE = "rhyme_files/phonetics_cache.json"
-# Load cache from file if it exists
-if os.path.exists(CACHE_FILE):
-    with open(CACHE_FILE, "r", encoding="utf-8") as f:
-        cache = json.load(f)
-else:
-    cache = {}
+# Load the word-level phonetics shared with the other analysers, new entries are flushed in batches and at exit
+phonetics_store.open_phonetics_store()
+# Rhyme parts of every known English and Irish word
+rhyme_index.load_rhyme_index()
 
-VOWELS = "aeiou@"
+SLANT_RHYME_THRESHOLD = 0.7  # Adjust threshold as needed for slant rhyme matching
+
+# Rhyme parts seen so far and the memoised similarity of pairs of them
+rhyme_part_ids = {}
+rhyme_part_list = []
+slant_rhymes = {}
+# Memoised rhyme_match_score of (canonical reference scheme, canonical translated scheme)
+match_scores = {}
 
 
 def get_rhyme_part_english(word):
-    """Get the last stressed syllable and onward from the word's phonetic transcription."""
-    rhyme_parts = []
-    #rhyme_part = None
-    pronunciations = pronouncing.phones_for_word(word)
-    if pronunciations:
-        for pronunciation in pronunciations:
-            phonemes = pronunciation.split(" ")
-            """Loop through the list of phonemes in reverse and return the index of the first stressed vowel."""
-            for i in range(len(phonemes) - 1, -1, -1):  # Loop in reverse using index
-                phoneme = phonemes[i]
-                if phoneme[-1] in "12" and phoneme[0] in "AEIOU":  # Check for stress (1 or 2) and vowel
-                    rhyme_part = " ".join(phonemes[i:])  # Join the phonemes to form a string
-                    rhyme_parts.append(rhyme_part)  # Return the index of the first stressed vowel
-                    break
+    """Get the last stressed syllable and onward from the word's phonetic transcriptions."""
+    _, _, _, rhyme_parts = pronunciation_index.lookup_word(word)
     return rhyme_parts
 
 
 def get_rhyme_part_irish(word):
     """Extracts the last stressed vowel and all following phonemes from a word."""
+    # Words phonetised before are a lookup in the rhyme index
+    rhyme_parts = rhyme_index.rhyme_parts(word, "ga")
+    if rhyme_parts is not None:
+        return rhyme_parts[0] if rhyme_parts else None
+
     phonemes = None
-    if word in cache:
-        phonemes = cache[word]
-    else:
+    cached = phonetics_store.word_phonetics(word)
+    if cached:
+        phonemes = cached[0]
+    elif not irish_g2p.OFFLINE:
         # Call API
         base_url = "https://synthesis.abair.ie/api/phonetise"
         encoded_text = urllib.parse.quote(word)
@@ -60,11 +63,8 @@ def get_rhyme_part_irish(word):
                 # Check if result is a list and not empty
                 if result and isinstance(result, list):
                     phonemes = result[0]  # Get the first item if it exists
-                    # Save result to cache
-                    cache[word] = phonemes
-                    # Save cache to file
-                    with open(CACHE_FILE, "w", encoding="utf-8") as f:
-                        json.dump(cache, f, ensure_ascii=False, indent=4)
+                    # Save result to cache, it is written to disk with the next batched flush
+                    phonetics_store.add_words({word: result})
                 else:
                     print(f"Error: No valid phoneme data returned for word: {word}")
                     return "?"
@@ -73,32 +73,66 @@ def get_rhyme_part_irish(word):
         except Exception as e:
             print(f"Request failed: {e}")
 
-    # Find last stressed syllable
-    index = phonemes.rfind('1')
-    # Find stressed vowel and following phonemes
-    for i in range(index, len(phonemes)):
-        if phonemes[i] in VOWELS:
-            return phonemes[i:]
+    if phonemes is None:
+        # Offline or the API failed, the local phonetisation is not indexed so Abair's replaces it later
+        return rhyme_index.irish_rhyme_part(irish_g2p.phonetise_word(word))
+    rhyme_part = rhyme_index.irish_rhyme_part(phonemes)
+    rhyme_index.add_word("ga", word, [rhyme_part] if rhyme_part else [])
+    return rhyme_part
+
+
+def intern_rhyme_parts(rhyme_parts):
+    """Ids of the rhyme parts of a line, shared across the corpus so similarities are computed once."""
+    part_ids = []
+    for rhyme_part in rhyme_parts:
+        if rhyme_part is None:
+            continue
+        part_id = rhyme_part_ids.get(rhyme_part)
+        if part_id is None:
+            part_id = len(rhyme_part_list)
+            rhyme_part_ids[rhyme_part] = part_id
+            rhyme_part_list.append(rhyme_part)
+        part_ids.append(part_id)
+    return part_ids
+
+
+def parts_slant_rhyme(first, second):
+    """Whether two interned rhyme parts are more similar than SLANT_RHYME_THRESHOLD, memoised."""
+    key = (first, second)
+    similar = slant_rhymes.get(key)
+    if similar is None:
+        matcher = difflib.SequenceMatcher(None, rhyme_part_list[first], rhyme_part_list[second])
+        # quick_ratio is an upper bound of ratio, so most pairs are rejected without the full match
+        similar = matcher.quick_ratio() > SLANT_RHYME_THRESHOLD and matcher.ratio() > SLANT_RHYME_THRESHOLD
+        slant_rhymes[key] = similar
+    return similar
+
+
+def lines_slant_rhyme(first_ids, second_ids):
+    return any(parts_slant_rhyme(first, second) for first in first_ids for second in second_ids)
 
 
 def get_rhyme_scheme(stansa, lang):
     """Detects the rhyme scheme of given lyrics."""
     lines = stansa.strip().split("\n")
-    rhyme_map = {}
-    rhyme_scheme = []
-    next_label = 'A'
-    rhyme_parts = []
     end_phonemes = []
-
     for line in lines:
         words = line.split()
         last_word = words[-1]
         if lang == "en":
-            rhyme_parts = get_rhyme_part_english(last_word)
+            end_phonemes.append(get_rhyme_part_english(last_word))
         else:
-            rhyme_parts = [get_rhyme_part_irish(last_word)]
-        end_phonemes.append(rhyme_parts)
+            end_phonemes.append([get_rhyme_part_irish(last_word)])
+    return rhyme_scheme_of_parts(end_phonemes)
+
+
+def rhyme_scheme_of_parts(end_phonemes):
+    """Rhyme scheme of a stanza from the rhyme parts of the last word of each line."""
+    rhyme_map = {}
+    rhyme_scheme = []
+    next_label = 'A'
 
+    for rhyme_parts in end_phonemes:
         # Check for perfect rhyme match first
         rhyme_label = None
         for rhyme_part in rhyme_parts:
@@ -116,41 +150,58 @@ def get_rhyme_scheme(stansa, lang):
         rhyme_scheme.append(rhyme_label)
        
     # Second pass: Update rhyme scheme to reflect slant rhymes
-    for indexx, _ in enumerate(rhyme_scheme):
-        for x, _ in enumerate(rhyme_scheme):
-            if rhyme_scheme.count(rhyme_scheme[x]) > 1 or rhyme_scheme[x].islower():  # If it's a lowercase label (slant rhyme)
-                continue  # No update needed for already slant rhymes
+    # Each line in turn gives its label, in lowercase, to the first line that still has
+    # a label of its own (uppercase, used once) and slant-rhymes with it. Only such lines
+    # can be relabelled and a relabelled line never becomes one again, so they are kept
+    # in a shrinking list instead of recounting labels for every pair.
+    line_part_ids = [intern_rhyme_parts(rhyme_parts) for rhyme_parts in end_phonemes]
+    label_counts = defaultdict(int)
+    for label in rhyme_scheme:
+        label_counts[label] += 1
+    unmatched = [x for x, label in enumerate(rhyme_scheme) if label_counts[label] == 1 and not label.islower()]
+    for indexx in range(len(rhyme_scheme)):
+        for x in unmatched:
             if indexx == x:
                 continue
-            # Compare line i and line j for slant rhyme
-            similarity = 0
-            for pronounciation in end_phonemes[indexx]:
-                for pronounciation2 in end_phonemes[x]:
-                    similarity = max(similarity, difflib.SequenceMatcher(None, pronounciation, pronounciation2).ratio())
-            if similarity > 0.7:  # Adjust threshold as needed for slant rhyme matching
+            if lines_slant_rhyme(line_part_ids[indexx], line_part_ids[x]):
                 # If a slant rhyme is found, update line j's label to the same as line i
                 rhyme_scheme[x] = rhyme_scheme[indexx].lower()  # Lowercase to signify slant rhyme
-                if rhyme_scheme.count(rhyme_scheme[indexx]) == 1:
+                unmatched.remove(x)
+                if indexx in unmatched:
                     rhyme_scheme[indexx] = rhyme_scheme[indexx].lower()
+                    unmatched.remove(indexx)
                 break
 
     return "".join(rhyme_scheme)
 
 
+def canonical_scheme(scheme):
+    """
+    Relabel a rhyme scheme by first occurrence, keeping the case of each label.
+
+    "CDCd" and "ABAb" describe the same scheme and become the same string, so
+    repeated schemes share one entry in match_scores.
+    """
+    letters = {}
+    canonical = []
+    for label in scheme:
+        letter = letters.setdefault(label.upper(), chr(ord('A') + len(letters)))
+        canonical.append(letter.lower() if label.islower() else letter)
+    return "".join(canonical)
+
+
+def label_positions(scheme):
+    """Dict of label -> list of the positions it labels."""
+    positions = {}
+    for index, char in enumerate(scheme):
+        positions.setdefault(char, []).append(index)
+    return positions
+
+
 def check_perfect_match(ref, test):
-    index_map_ref = {}
-    for index, char in enumerate(ref):
-        if index_map_ref.get(char):
-            index_map_ref[char].append(index)
-        else:
-            index_map_ref[char] = [index]
-    index_map_test = {}
-    for x, ch in enumerate(test):
-        if index_map_test.get(ch):
-            index_map_test[ch].append(x)
-        else:
-            index_map_test[ch] = [x]
-    
+    index_map_ref = label_positions(ref)
+    index_map_test = label_positions(test)
+
     for indices in index_map_ref.values():
         if len(indices) > 1 and ref[indices[0]].isupper():
             if indices not in index_map_test.values():
@@ -159,54 +210,60 @@ def check_perfect_match(ref, test):
                 return False
             if ref[indices[0]].islower() and test[indices[0]].isupper():
                 return False
-            
+
     return True
 
 
 def check_good_match(ref, test):
-    index_map_ref = {}
-    for index, char in enumerate(ref):
-        if index_map_ref.get(char):
-            index_map_ref[char].append(index)
-        else:
-            index_map_ref[char] = [index]
-    index_map_test = {}
-    for x, ch in enumerate(test):
-        if index_map_test.get(ch):
-            index_map_test[ch].append(x)
-        else:
-            index_map_test[ch] = [x]
-    
+    index_map_ref = label_positions(ref)
+    index_map_test = label_positions(test)
+
     for indices in index_map_ref.values():
         if len(indices) > 1:
             if indices not in index_map_test.values():
                 return False
-            
+
     return True
 
 
 def check_partial_match(ref, test):
-    index_map_ref = {}
-    for index, char in enumerate(ref):
-        if index_map_ref.get(char):
-            index_map_ref[char].append(index)
-        else:
-            index_map_ref[char] = [index]
-    index_map_test = {}
-    for x, ch in enumerate(test):
-        if index_map_test.get(ch):
-            index_map_test[ch].append(x)
-        else:
-            index_map_test[ch] = [x]
-    
+    index_map_ref = label_positions(ref)
+    index_map_test = label_positions(test)
+
     for indices in index_map_ref.values():
         if len(indices) > 1:
             if indices in index_map_test.values():
                 return True
-            
+
     return False
 
 
+def rhyme_match_score(ref, test):
+    """
+    Score how well a translated stanza keeps the rhyme scheme of the original.
+
+    1 for the same scheme, 0.8 if every perfect rhyme group of the original is kept,
+    0.6 if every rhyme group is kept, 0.4 if at least one is, otherwise 0.
+    Memoised per pair of canonical schemes, which repeat heavily across songs and systems.
+    """
+    key = (canonical_scheme(ref), canonical_scheme(test))
+    score = match_scores.get(key)
+    if score is None:
+        ref, test = key
+        if ref == test:
+            score = 1
+        elif check_perfect_match(ref, test):
+            score = 0.8
+        elif check_good_match(ref, test):
+            score = 0.6
+        elif check_partial_match(ref, test):
+            score = 0.4
+        else:
+            score = 0
+        match_scores[key] = score
+    return score
+
+
 if __name__ == '__main__':
 
     # Step 1: Open and read the file
@@ -217,17 +274,7 @@ if __name__ == '__main__':
     ref_songs = references.split('*')
     hyp_songs = hypotheses.split('*')
 
-    # Ensure JSON file exists
-    json_path = "results_by_song/reference.json"
-    if os.path.exists(json_path) and os.path.getsize(json_path) > 0:
-        with open(json_path, "r", encoding="utf-8") as file:
-            try:
-                song_objects = json.load(file)
-            except json.JSONDecodeError:
-                print(f"Error: {json_path} is not valid. Resetting it.")
-                song_objects = []
-    else:
-        song_objects = []
+    rhyme_diffs = []
 
     # Step 3: Process each song
     for i, (og_song, hyp_song) in enumerate(zip(ref_songs, hyp_songs)):
@@ -248,23 +295,11 @@ if __name__ == '__main__':
                 continue
 
             rhyme_count += 1
-
-            if ref_rhyme_scheme == hyp_rhyme_scheme:
-                score += 1
-                continue
-            if check_perfect_match(ref_rhyme_scheme, hyp_rhyme_scheme):
-                score += 0.8
-                continue
-            if check_good_match(ref_rhyme_scheme, hyp_rhyme_scheme):
-                score += 0.6
-                continue
-            if check_partial_match(ref_rhyme_scheme, hyp_rhyme_scheme):
-                score += 0.4
+            score += rhyme_match_score(ref_rhyme_scheme, hyp_rhyme_scheme)
 
         if rhyme_count == 0:
-            song_objects[i]["rhyme_diff"] = 0
+            rhyme_diffs.append(0)
         else:
-            song_objects[i]["rhyme_diff"] =  1 - (score/rhyme_count)
+            rhyme_diffs.append(1 - (score/rhyme_count))
 
-    with open(json_path, "w", encoding="utf-8") as file:
-        json.dump(song_objects, file, indent=4, ensure_ascii=False)
+    results_store.write_column("reference", "rhyme_diff", rhyme_diffs)
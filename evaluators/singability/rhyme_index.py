@@ -0,0 +1,127 @@
+import atexit
+import json
+import os
+import sys
+import pronouncing
+import phonetics_store
+from pronunciation_index import rhyme_part as english_rhyme_part
+
+# Persistent rhyme index for English (CMU dictionary) and Irish (phonetics store).
+# Maps word -> rhyme parts and rhyme part -> words, so the rhyme analyser finds
+# rhyme parts with a dictionary lookup and "what rhymes with X" is answered
+# without scanning the dictionary. Only word -> rhyme parts is saved, the reverse
+# map is rebuilt on load. Irish words fetched since the last run are added on
+# load and the index is saved again at exit if it changed.
+#   python rhyme_index.py <en|ga> <word>
+RHYME_INDEX_FILE = "singability_files/rhyme_index.json"
+VOWELS = "aeiou@"
+
+word_rhymes = {"en": {}, "ga": {}}  # lang -> word -> rhyme parts
+rhyme_words = {"en": {}, "ga": {}}  # lang -> rhyme part -> words
+index_path = None
+changed = False
+
+
+def irish_rhyme_part(phonemes):
+    """Extracts the last stressed vowel and all following phonemes from an Abair phonetisation, None without one."""
+    if not phonemes:
+        return None
+    # Find last stressed syllable
+    index = phonemes.rfind('1')
+    # Find stressed vowel and following phonemes
+    for i in range(index, len(phonemes)):
+        if phonemes[i] in VOWELS:
+            return phonemes[i:]
+
+
+def add_word(lang, word, rhyme_parts):
+    global changed
+    if word_rhymes[lang].get(word) == rhyme_parts:
+        return
+    for rhyme_part in word_rhymes[lang].get(word, []):
+        rhyme_words[lang][rhyme_part].discard(word)
+    word_rhymes[lang][word] = rhyme_parts
+    for rhyme_part in rhyme_parts:
+        rhyme_words[lang].setdefault(rhyme_part, set()).add(word)
+    changed = True
+
+
+def build_english_rhymes():
+    pronouncing.init_cmu()
+    for word, pronunciations in pronouncing.lookup.items():
+        rhyme_parts = [part for part in dict.fromkeys(english_rhyme_part(p) for p in pronunciations) if part]
+        add_word("en", word, rhyme_parts)
+
+
+def update_irish_rhymes():
+    """Add the Irish words in the phonetics store that are not indexed yet."""
+    for word, phonetics in phonetics_store.iter_words():
+        if word not in word_rhymes["ga"] and phonetics:
+            rhyme_part = irish_rhyme_part(phonetics[0])
+            add_word("ga", word, [rhyme_part] if rhyme_part else [])
+
+
+def load_rhyme_index(path=RHYME_INDEX_FILE):
+    """Load the index, building the English part from the CMU dictionary the first time."""
+    global index_path, changed
+    if index_path is None:
+        atexit.register(save_rhyme_index)
+    index_path = path
+    for lang in word_rhymes:
+        word_rhymes[lang].clear()
+        rhyme_words[lang].clear()
+
+    saved = {}
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, "r", encoding="utf-8") as f:
+            try:
+                saved = json.load(f)
+            except json.JSONDecodeError:
+                print(f"Warning: Invalid JSON in {path}. Rebuilding the rhyme index.")
+    for lang, words in saved.items():
+        for word, rhyme_parts in words.items():
+            add_word(lang, word, rhyme_parts)
+    changed = False
+
+    if not word_rhymes["en"]:
+        build_english_rhymes()
+    update_irish_rhymes()
+    if changed:
+        save_rhyme_index()
+
+
+def save_rhyme_index():
+    global changed
+    if index_path is None or not changed:
+        return
+    directory = os.path.dirname(index_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(word_rhymes, f, ensure_ascii=False)
+    os.replace(tmp_path, index_path)
+    changed = False
+
+
+def rhyme_parts(word, lang):
+    """Rhyme parts of an indexed word, or None if the word is not in the index."""
+    if index_path is None:
+        load_rhyme_index()
+    return word_rhymes[lang].get(word.lower() if lang == "en" else word)
+
+
+def rhymes_with(word, lang):
+    """Sorted list of the indexed words that share a rhyme part with word."""
+    parts = rhyme_parts(word, lang) or []
+    rhymes = set()
+    for rhyme_part in parts:
+        rhymes.update(rhyme_words[lang][rhyme_part])
+    rhymes.discard(word.lower() if lang == "en" else word)
+    return sorted(rhymes)
+
+
+if __name__ == '__main__':
+    phonetics_store.open_phonetics_store()
+    load_rhyme_index()
+    print(" ".join(rhymes_with(sys.argv[2], sys.argv[1])))
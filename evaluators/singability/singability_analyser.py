@@ -0,0 +1,122 @@
+import re
+import os
+import sys
+import irish_g2p
+import pronunciation_index
+import rhyme_index
+from rhyme_analyser import rhyme_scheme_of_parts, rhyme_match_score
+from syllable_analyser import phonetise_text
+from song_arrays import align_songs, read_songs, song_offsets, song_syllable_stress_diffs
+# results_store.py is shared with the semantics evaluators
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import results_store
+
+# Single-pass singability analysis: syllable_diff, stress_diff and rhyme_diff together.
+# Every line is phonetised once, English lines word by word from the pronunciation
+# index and Irish lines as one Abair phonetisation, and its syllable count, stress
+# pattern and end rhyme parts are all read off that representation. The rhyme files
+# hold the same lines as ga_txt_files with blank lines between stanzas, so one read
+# gives both the song lines for syllables and stress and the stanzas for rhyme.
+#   python singability_analyser.py [--offline] [system ...]
+# --offline phonetises lines missing from the phonetics store with irish_g2p.
+SONG_DIR = "rhyme_files_ga"
+# Translations scored against the originals, by system
+SYSTEM_FILES = {"reference": "references.txt", "google": "googles.txt", "nllb": "nllbs.txt"}
+
+
+def analyse_line(line, language):
+    """
+    Syllable count, stress pattern and end rhyme parts of a line from one phonetisation.
+
+    :return: (syllables, stress pattern, rhyme parts of the last word) with the
+        rhyme parts in the form get_rhyme_scheme uses for the language.
+    """
+    words = line.split()
+    if language == "en":
+        return pronunciation_index.lookup_line(line)
+
+    phonetised = (phonetise_text(line) or []) if words else []
+    syllables = sum(word.count(".") + 1 for word in phonetised)
+    stress_pattern = re.sub(r"\D", "", "".join(phonetised))
+    return syllables, stress_pattern, [rhyme_index.irish_rhyme_part(phonetised[-1]) if phonetised else None]
+
+
+def analyse_songs(songs, language):
+    return [[[analyse_line(line, language) for line in stanza] for stanza in song] for song in songs]
+
+
+def song_rhyme_diff(og_song, og_analysis, hyp_analysis):
+    """
+    1 - the mean rhyme_match_score of the stanzas of a song, as in rhyme_analyser.py.
+
+    :param og_song: Stanzas of original lines, for the check that a stanza has rhymes.
+    :param og_analysis: analyse_line results of the original stanzas.
+    :param hyp_analysis: analyse_line results of the translated stanzas.
+    """
+    score = 0
+    rhyme_count = 0
+    for og_stanza, og_lines, hyp_lines in zip(og_song, og_analysis, hyp_analysis):
+        # If no rhyme in original, skip
+        og_text = "\n".join(og_stanza)
+        if len(og_text) == len(set(og_text)):
+            continue
+        ref_rhyme_scheme = rhyme_scheme_of_parts([rhyme_parts for _, _, rhyme_parts in og_lines])
+        hyp_rhyme_scheme = rhyme_scheme_of_parts([rhyme_parts for _, _, rhyme_parts in hyp_lines])
+        rhyme_count += 1
+        score += rhyme_match_score(ref_rhyme_scheme, hyp_rhyme_scheme)
+    return 0 if rhyme_count == 0 else 1 - (score / rhyme_count)
+
+
+def song_rhyme_diffs(og_songs, og_analysis, hyp_analysis):
+    """song_rhyme_diff of every original song against one system's songs."""
+    return [song_rhyme_diff(og_song, og_analysis[i], hyp_analysis[i] if i < len(hyp_analysis) else [])
+            for i, og_song in enumerate(og_songs)]
+
+
+def score_systems(og_songs, og_analysis, hyp_analysis, rhyme_diffs=None):
+    """
+    Per-song syllable_diff, stress_diff and rhyme_diff of every system.
+
+    :param og_songs: Stanzas of original lines of every song.
+    :param og_analysis: analyse_songs of the originals.
+    :param hyp_analysis: Dict of system -> analyse_songs of its translations.
+    :param rhyme_diffs: Dict of system -> song_rhyme_diffs, if already computed.
+    :return: Dict of system -> list of per-song dicts of the three metrics.
+    """
+    systems = list(hyp_analysis)
+    if rhyme_diffs is None:
+        rhyme_diffs = {system: song_rhyme_diffs(og_songs, og_analysis, hyp_analysis[system]) for system in systems}
+    # Syllables and stress over the lines of each song, aligned as in the syllable and stress analysers
+    og_lines, hyp_lines, song_lengths = align_songs(
+        [sum(song, []) for song in og_analysis],
+        {system: [sum(song, []) for song in songs] for system, songs in hyp_analysis.items()})
+    syllable_diffs, stress_diffs = song_syllable_stress_diffs(og_lines, hyp_lines, song_offsets(song_lengths))
+
+    results = {}
+    for s, system in enumerate(systems):
+        results[system] = []
+        for i in range(len(song_lengths)):
+            results[system].append({
+                "syllable_diff": float(syllable_diffs[s, i]),
+                "stress_diff": float(stress_diffs[s, i]),
+                "rhyme_diff": rhyme_diffs[system][i],
+            })
+    return results
+
+
+def write_results(results):
+    """Store the metrics of score_systems as results_store columns."""
+    for system, song_results in results.items():
+        for metric in ("syllable_diff", "stress_diff", "rhyme_diff"):
+            results_store.write_column(system, metric, [song_result[metric] for song_result in song_results])
+
+
+if __name__ == '__main__':
+    irish_g2p.OFFLINE = "--offline" in sys.argv[1:]
+    systems = [arg for arg in sys.argv[1:] if arg != "--offline"] or list(SYSTEM_FILES)
+
+    # One traversal: read and phonetise every line of the originals and of each system once
+    og_songs = read_songs(f"{SONG_DIR}/originals.txt")
+    og_analysis = analyse_songs(og_songs, "en")
+    hyp_analysis = {system: analyse_songs(read_songs(f"{SONG_DIR}/{SYSTEM_FILES[system]}"), "ga") for system in systems}
+    write_results(score_systems(og_songs, og_analysis, hyp_analysis))
@@ -0,0 +1,91 @@
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import abair_prefetch
+import irish_g2p
+import phonetics_cache
+import pronunciation_index
+from singability_analyser import SONG_DIR, SYSTEM_FILES, read_songs, analyse_songs, song_rhyme_diffs, score_systems, write_results
+
+# Multi-core singability_analyser.py: songs are sharded across a process pool.
+# The pronunciation index and a snapshot of the phonetics store are memory-mapped
+# by every worker, so read-only data is shared through the page cache instead of
+# being pickled to each process. Each shard returns its line analyses, the rhyme_diff
+# of its songs (rhyme schemes are most of the scoring time) and the new phonetics
+# entries it fetched, which are merged into the store in shard order at the end.
+# Lines missing from the store are prefetched from Abair before the snapshot is
+# taken, so workers read every phonetisation from it. The rest of the scoring and the
+# writing are the serial code, so the results are the same bytes as a serial run's.
+#   python singability_runner.py [--offline] [--workers N] [system ...]
+PHONETICS_SNAPSHOT_DIR = "singability_files/phonetics_snapshot"
+SHARDS_PER_WORKER = 4  # Smaller shards even out songs of different lengths
+
+
+def init_worker(offline):
+    irish_g2p.OFFLINE = offline
+    phonetics_cache.open_phonetics_cache(PHONETICS_SNAPSHOT_DIR, "snapshot")
+    pronunciation_index.load_pronunciation_index()
+
+
+def analyse_shard(og_songs, hyp_songs):
+    """
+    Analyse the songs of one shard in a worker.
+
+    :param hyp_songs: Dict of system -> the shard's songs of that system.
+    :return: (original analyses, dict of system -> analyses, dict of system ->
+        song_rhyme_diffs, new phonetics entries, phonetics cache (hits, misses)).
+    """
+    og_analysis = analyse_songs(og_songs, "en")
+    hyp_analysis = {system: analyse_songs(songs, "ga") for system, songs in hyp_songs.items()}
+    rhyme_diffs = {system: song_rhyme_diffs(og_songs, og_analysis, analysis) for system, analysis in hyp_analysis.items()}
+    return og_analysis, hyp_analysis, rhyme_diffs, phonetics_cache.take_pending(), phonetics_cache.take_stats()
+
+
+def shard_bounds(n_songs, n_shards):
+    """(start, end) song ranges of n_shards contiguous shards."""
+    n_shards = max(1, min(n_shards, n_songs))
+    edges = [n_songs * k // n_shards for k in range(n_shards + 1)]
+    return list(zip(edges, edges[1:]))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    offline = "--offline" in args
+    workers = os.cpu_count() or 1
+    if "--workers" in args:
+        workers = int(args[args.index("--workers") + 1])
+        del args[args.index("--workers"):args.index("--workers") + 2]
+    systems = [arg for arg in args if arg != "--offline"] or list(SYSTEM_FILES)
+    irish_g2p.OFFLINE = offline
+
+    og_songs = read_songs(f"{SONG_DIR}/originals.txt")
+    hyp_songs = {system: read_songs(f"{SONG_DIR}/{SYSTEM_FILES[system]}") for system in systems}
+
+    # Build what the workers map once, here, before they start
+    pronunciation_index.load_pronunciation_index()
+    if not offline:
+        abair_prefetch.prefetch([line for songs in hyp_songs.values() for song in songs for stanza in song
+                                 for line in stanza if line])
+    phonetics_cache.write_snapshot(PHONETICS_SNAPSHOT_DIR)
+
+    # Forked workers inherit the imported modules instead of loading the stores again on import
+    bounds = shard_bounds(max([len(og_songs)] + [len(songs) for songs in hyp_songs.values()]), workers * SHARDS_PER_WORKER)
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork"),
+                             initializer=init_worker, initargs=(offline,)) as executor:
+        shards = list(executor.map(analyse_shard,
+                                   [og_songs[start:end] for start, end in bounds],
+                                   [{system: songs[start:end] for system, songs in hyp_songs.items()}
+                                    for start, end in bounds]))
+
+    og_analysis = []
+    hyp_analysis = {system: [] for system in systems}
+    rhyme_diffs = {system: [] for system in systems}
+    for shard_og, shard_hyp, shard_rhyme_diffs, entries, stats in shards:
+        og_analysis += shard_og
+        for system in systems:
+            hyp_analysis[system] += shard_hyp[system]
+            rhyme_diffs[system] += shard_rhyme_diffs[system]
+        phonetics_cache.merge_entries(entries)
+        phonetics_cache.merge_stats(stats)
+    write_results(score_systems(og_songs, og_analysis, hyp_analysis, rhyme_diffs))
@@ -0,0 +1,108 @@
+import re
+import numpy as np
+from stress_patterns import encode_patterns, stress_ratios_systems
+
+# Flat per-line arrays with song offsets, shared by the singability analysers.
+# Every system's lines are aligned to the originals song by song, so one offsets
+# array describes them all, and per-song results for every system come from one
+# reduction over a (systems, lines) array instead of a Python loop per song.
+# Nothing here opens a store, so the evaluation runner reads songs and scores the
+# Spanish translations without the Irish phonetics.
+
+
+def read_songs(path):
+    """
+    Songs of a rhyme file, each a list of stanzas of lines.
+
+    Songs are separated by "*" and stanzas by blank lines, as in rhyme_analyser.py.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        songs = f.read().split("*")
+    if songs and not songs[-1].strip():
+        songs.pop()
+    return [[[line.strip() for line in stanza.strip().split("\n")]
+             for stanza in re.split(r"\n\s*\n", song) if stanza.strip()]
+            for song in songs]
+
+
+def align_songs(og_songs, hyp_songs_by_system):
+    """
+    Flatten songs, cutting every song to the line count that all systems share.
+
+    A song keeps its first n lines, where n is the smallest line count of the original
+    and of every system's version of it, rather than zipping each system with the
+    originals on its own. One system's syllable_diff and stress_diff for a song
+    therefore depend on the line counts of the other systems passed in.
+
+    :param og_songs: List of songs, each a list of original lines.
+    :param hyp_songs_by_system: Dict of system -> list of songs of translated lines.
+    :return: (original lines, dict of system -> translated lines, song lengths).
+    """
+    og_lines = []
+    hyp_lines = {system: [] for system in hyp_songs_by_system}
+    song_lengths = []
+    for i, og_song in enumerate(og_songs):
+        n_lines = min([len(og_song)] + [len(songs[i]) if i < len(songs) else 0 for songs in hyp_songs_by_system.values()])
+        og_lines += og_song[:n_lines]
+        for system, songs in hyp_songs_by_system.items():
+            hyp_lines[system] += songs[i][:n_lines] if i < len(songs) else []
+        song_lengths.append(n_lines)
+    return og_lines, hyp_lines, song_lengths
+
+
+def song_offsets(song_lengths):
+    """Offsets where song k is lines offsets[k]:offsets[k + 1]."""
+    offsets = np.zeros(len(song_lengths) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(song_lengths)
+    return offsets
+
+
+def song_means(line_values, offsets):
+    """
+    Mean of each song over the last axis, ignoring NaN lines.
+
+    :param line_values: Array of shape (..., lines).
+    :return: Array of shape (..., songs), 0 for songs without any non-NaN line.
+    """
+    valid = ~np.isnan(line_values)
+    if len(offsets) < 2:
+        return np.zeros(line_values.shape[:-1] + (0,))
+    # Each song is summed on its own, so its mean does not depend on the songs before it
+    # and scoring a few songs gives the same values as scoring the whole corpus. The zero
+    # column keeps the start of empty songs at the end in range, and reduceat gives an
+    # empty song the value at its start, so empty songs are zeroed.
+    pad = [(0, 0)] * (line_values.ndim - 1) + [(0, 1)]
+    empty = offsets[1:] == offsets[:-1]
+    song_sums = np.where(empty, 0, np.add.reduceat(np.pad(np.where(valid, line_values, 0), pad), offsets[:-1], axis=-1))
+    song_counts = np.where(empty, 0, np.add.reduceat(np.pad(valid.astype(np.int64), pad), offsets[:-1], axis=-1))
+    return np.where(song_counts > 0, song_sums / np.maximum(song_counts, 1), 0)
+
+
+def line_syllable_diffs(og_counts, hyp_counts):
+    """
+    Relative syllable difference of every line, |hyp - og| / og.
+
+    :param og_counts: Array of original line counts.
+    :param hyp_counts: Array of translated line counts, (lines,) or (systems, lines).
+    :return: Array shaped like hyp_counts, NaN where the original line has no
+        syllables (there is nothing to match, so the line is left out of song means).
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(og_counts > 0, np.abs(hyp_counts - og_counts) / og_counts, np.nan)
+
+
+def song_syllable_stress_diffs(og_lines, hyp_lines, offsets):
+    """
+    Per-song syllable_diff and stress_diff of every system.
+
+    :param og_lines: (syllables, stress pattern, ...) of every aligned original line.
+    :param hyp_lines: Dict of system -> (syllables, stress pattern, ...) of its aligned lines.
+    :return: (syllable_diffs, stress_diffs), arrays of shape (systems, songs).
+    """
+    og_counts = np.array([line[0] for line in og_lines], dtype=np.int32)
+    hyp_counts = np.stack([np.array([line[0] for line in lines], dtype=np.int32) for lines in hyp_lines.values()])
+    syllable_diffs = song_means(line_syllable_diffs(og_counts, hyp_counts), offsets)
+    og_patterns = encode_patterns([line[1] for line in og_lines])
+    hyp_patterns = [encode_patterns([line[1] for line in lines]) for lines in hyp_lines.values()]
+    stress_diffs = song_means(1 - stress_ratios_systems(*og_patterns, hyp_patterns), offsets)
+    return syllable_diffs, stress_diffs
@@ -1,11 +1,21 @@
 import urllib.parse
 import re
-import json
 import os
+import sys
 import requests
-import pronouncing
-import Levenshtein
-from nltk.corpus import cmudict
+import phonetics_store
+import irish_g2p
+import pronunciation_index
+from syllable_analyser_es import stress_pattern_es
+from song_arrays import align_songs, song_offsets, song_means
+from stress_patterns import encode_patterns, stress_ratios_systems
+# results_store.py is shared with the semantics evaluators
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import results_store
+
+# Translations scored against the originals, by system
+SYSTEM_FILES = {"reference": "references.txt", "google": "googles.txt", "nllb": "nllbs.txt"}
+
 
 def split_into_songs(lines):
     songs = []
@@ -23,57 +33,24 @@ def split_into_songs(lines):
 
 
 # Get stress pattern for sentence
-def phonetise_sentence(sentence, language, cache=None):
+def phonetise_sentence(sentence, language):
     if language == "en":
-        return phonetise_sentence_en(sentence, cache)
+        return phonetise_sentence_en(sentence)
+    elif language == "es":
+        return stress_pattern_es(sentence)
     else:
-        return phonetise_sentence_ga(sentence, cache)
+        return phonetise_sentence_ga(sentence)
 
 
 # Get stress pattern English
-def phonetise_sentence_en(sentence, cache):
-    # Using pronouncing
-    return get_stress_pattern_pronouncing(sentence, cache)
-
-
-def get_stress_pattern_pronouncing(sentence, cache):
-    words = sentence.split()
-    pattern = []
-    for word in words:
-        if word in cache:
-            return cache[word]
-        pronunciation = pronouncing.phones_for_word(word)
-        if pronunciation:
-            # Get stress pattern of first pronunciation
-            stress = pronouncing.stresses(pronunciation[0])
-            pattern.append(stress)
-        else:
-            # Back up - use NLTK when pronouncing fails
-            get_stress_pattern_nltk(word, cache)
-    return "".join(pattern).replace(" ", "")
-
-
-def get_stress_pattern_nltk(sentence, cache):
-    d = cmudict.dict()
-    words = sentence.split()
-    pattern = []
-    for word in words:
-        if word in cache:
-            return cache[word]
-        if word in d:
-            # Take first pronunciation
-            syllables = d[word][0]
-            # Extract stress digits (0, 1, or 2)
-            stress = ''.join([char[-1] for char in syllables if char[-1].isdigit()])
-            pattern.append(stress)
-        else:
-            pattern.append("?")  # Unknown word
-    return "".join(pattern)
+def phonetise_sentence_en(sentence):
+    # Stress pattern of the first CMU pronunciation of each word, words missing from the dictionary add nothing
+    return pronunciation_index.lookup_line(sentence)[1]
 
 
 # Get stress pattern Irish 
-def phonetise_sentence_ga(sentence, cache):
-    phonetised_sen = phonetise_text(sentence, cache)
+def phonetise_sentence_ga(sentence):
+    phonetised_sen = phonetise_text(sentence)
     stress_pattern = ""
     for pronunciation in phonetised_sen:
         stresses = re.sub(r"\D", "", pronunciation)
@@ -81,11 +58,14 @@ def phonetise_sentence_ga(sentence, cache):
     return stress_pattern
 
 
-def phonetise_text(text, cache, dialect="co", mapping="mrpai", add_origins="false"):
-    """Phonetise text using Abair API, but only if it's not cached."""
-    # Check cache first
-    if text in cache:
-        return cache[text]
+def phonetise_text(text, dialect="co", mapping="mrpai", add_origins="false"):
+    """Phonetise text using Abair API, but only if its words are not all cached, and locally if the API fails."""
+    # Check cache first, the sentence is built from its cached words
+    cached = phonetics_store.sentence_phonetics(text, dialect, mapping)
+    if cached is not None:
+        return cached
+    if irish_g2p.OFFLINE:
+        return irish_g2p.fallback_phonetics(text, dialect, mapping)
 
     # If not cached, call API
     base_url = "https://synthesis.abair.ie/api/phonetise"
@@ -96,60 +76,40 @@ def phonetise_text(text, cache, dialect="co", mapping="mrpai", add_origins="fals
         response = requests.get(url)
         if response.status_code == 200:
             result = response.json()
-            # Save result to cache
-            cache[text] = result
-            # Save cache to file
-            with open(CACHE_FILE, "w", encoding="utf-8") as f:
-                json.dump(cache, f, ensure_ascii=False, indent=4)
+            # Save the words of the result to cache, it is written to disk with the next batched flush
+            phonetics_store.add_sentence(text, result, dialect, mapping)
             return result
         else:
             print(f"Error: {response.status_code} - {response.text}")
-            return None
     except Exception as e:
         print(f"Request failed: {e}")
-        return None
+    # Fall back to the stored words and the rule-based phonetiser for the others, which is not cached
+    return irish_g2p.fallback_phonetics(text, dialect, mapping)
 
 
 if __name__ == '__main__':
-    # Cache file path of all Irish sentences with phonetic transcriptions
-    CACHE_FILE = "singability_files/phonetics_cache.json"
-
-    # Load cache from file if it exists
-    if os.path.exists(CACHE_FILE):
-        with open(CACHE_FILE, "r", encoding="utf-8") as f:
-            cache = json.load(f)
-    else:
-        cache = {}
+    # Load the word-level phonetics shared with the other analysers, new entries are flushed in batches and at exit
+    phonetics_store.open_phonetics_store()
 
     # Read reference and hypothesis files
     with open("ga_txt_files/originals.txt", "r", encoding="utf-8") as f:
-        originals = f.readlines()
-
-    with open("ga_txt_files/references.txt", "r", encoding="utf-8") as f:
-        hypotheses = f.readlines()
-
-    og_songs = split_into_songs([line.strip() for line in originals])
-    hyp_songs = split_into_songs([line.strip() for line in hypotheses])
-    
-    # Ensure JSON file exists
-    json_path = "results_by_song/reference.json"
-    if os.path.exists(json_path) and os.path.getsize(json_path) > 0:
-        with open(json_path, "r", encoding="utf-8") as file:
-            try:
-                song_objects = json.load(file)
-            except json.JSONDecodeError:
-                print(f"Error: {json_path} is not valid. Resetting it.")
-                song_objects = []
-    else:
-        song_objects = []
-
-    for i, (og_song, hyp_song) in enumerate(zip(og_songs, hyp_songs)):
-        similarities = []
-        for og_sen, hyp_sen in zip(og_song, hyp_song):
-            stress_pat_og = phonetise_sentence(og_sen, "en", cache)
-            stress_pat_hyp = phonetise_sentence(hyp_sen, "ga", cache)
-            similarities.append(Levenshtein.ratio(stress_pat_og, stress_pat_hyp))
-        song_objects[i]["stress_diff"] = 1 - (sum(similarities)/len(similarities))
-
-    with open(json_path, "w", encoding="utf-8") as file:
-        json.dump(song_objects, file, indent=4, ensure_ascii=False)
+        og_songs = split_into_songs([line.strip() for line in f.readlines()])
+
+    hyp_songs = {}
+    for system, file_name in SYSTEM_FILES.items():
+        with open(f"ga_txt_files/{file_name}", "r", encoding="utf-8") as f:
+            hyp_songs[system] = split_into_songs([line.strip() for line in f.readlines()])
+
+    # Every system is aligned to the originals, so one offsets array covers them all
+    og_lines, hyp_lines, song_lengths = align_songs(og_songs, hyp_songs)
+    offsets = song_offsets(song_lengths)
+    og_patterns = encode_patterns([phonetise_sentence(line, "en") for line in og_lines])
+    hyp_patterns = [encode_patterns([phonetise_sentence(line, "ga") for line in hyp_lines[system]])
+                    for system in SYSTEM_FILES]
+
+    # Levenshtein.ratio of every line pair of every system in one kernel call
+    similarities = stress_ratios_systems(*og_patterns, hyp_patterns)
+    song_diffs = song_means(1 - similarities, offsets)
+
+    for s, system in enumerate(SYSTEM_FILES):
+        results_store.write_column(system, "stress_diff", song_diffs[s])
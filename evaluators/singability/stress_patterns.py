@@ -0,0 +1,101 @@
+import numpy as np
+
+# Stress patterns as flat int8 arrays with line offsets, and a batched similarity kernel.
+# The similarity is Levenshtein.ratio, which for these patterns is 2 * LCS / (len1 + len2)
+# (indel distance). LCS lengths of all line pairs are computed together with the
+# bit-parallel algorithm of Allison and Dix: the shorter pattern of each pair is
+# turned into one 64-bit match mask per stress digit, and the longer one is walked
+# a digit at a time for every pair at once. Pairs whose shorter pattern is longer
+# than MAX_MASK_LENGTH fall back to the dynamic programming recurrence.
+MAX_MASK_LENGTH = 63
+
+
+def encode_patterns(patterns):
+    """
+    Encode stress pattern strings ("0102...") as one int8 array.
+
+    :return: (values, offsets) where line k is values[offsets[k]:offsets[k + 1]].
+    """
+    joined = "".join(patterns)
+    values = (np.frombuffer(joined.encode("ascii"), dtype=np.uint8) - ord("0")).astype(np.int8)
+    offsets = np.zeros(len(patterns) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(pattern) for pattern in patterns])
+    return values, offsets
+
+
+def popcount(masks):
+    return np.unpackbits(masks.view(np.uint8)).reshape(-1, 64).sum(axis=1)
+
+
+def lcs_dynamic(first, second):
+    previous = [0] * (len(second) + 1)
+    for symbol in first:
+        current = [0]
+        for j, other in enumerate(second):
+            current.append(previous[j] + 1 if symbol == other else max(previous[j + 1], current[j]))
+        previous = current
+    return previous[-1]
+
+
+def lcs_lengths(a_values, a_offsets, b_values, b_offsets):
+    """Length of the longest common subsequence of every aligned pair of patterns."""
+    values = np.concatenate([a_values, b_values]).astype(np.int64)
+    a_starts, a_lens = a_offsets[:-1], np.diff(a_offsets)
+    b_starts, b_lens = b_offsets[:-1] + len(a_values), np.diff(b_offsets)
+    swap = b_lens > a_lens
+    short_starts, short_lens = np.where(swap, a_starts, b_starts), np.minimum(a_lens, b_lens)
+    long_starts, long_lens = np.where(swap, b_starts, a_starts), np.maximum(a_lens, b_lens)
+
+    lengths = np.zeros(len(a_lens), dtype=np.int64)
+    fast = np.flatnonzero(short_lens <= MAX_MASK_LENGTH)
+    if len(fast):
+        # Longest first, so the pairs still being walked at step i are always a prefix
+        fast = fast[np.argsort(-long_lens[fast], kind="stable")]
+        fast_short_lens, fast_long_starts, fast_long_lens = short_lens[fast], long_starts[fast], long_lens[fast]
+
+        # Bit k of masks[symbol * pairs + pair] is set where the shorter pattern has that symbol at position k
+        n_symbols = int(values.max()) + 1 if len(values) else 1
+        pair = np.repeat(np.arange(len(fast)), fast_short_lens)
+        position = np.arange(len(pair)) - np.repeat(np.cumsum(fast_short_lens) - fast_short_lens, fast_short_lens)
+        symbol = values[short_starts[fast][pair] + position]
+        masks = np.zeros(n_symbols * len(fast), dtype=np.uint64)
+        np.add.at(masks, symbol * len(fast) + pair, np.left_shift(np.uint64(1), position.astype(np.uint64)))
+
+        vectors = np.full(len(fast), np.iinfo(np.uint64).max, dtype=np.uint64)
+        n_active = np.searchsorted(-fast_long_lens, -np.arange(int(fast_long_lens[0])), side="left")
+        for i, active in enumerate(n_active):
+            vector = vectors[:active]
+            matches = vector & masks[values[fast_long_starts[:active] + i] * len(fast) + np.arange(active)]
+            vectors[:active] = (vector + matches) | (vector - matches)
+        # Every zero among the low short_lens bits is one matched symbol
+        low_bits = np.left_shift(np.uint64(1), fast_short_lens.astype(np.uint64)) - np.uint64(1)
+        lengths[fast] = fast_short_lens - popcount(vectors & low_bits)
+
+    for k in np.flatnonzero(short_lens > MAX_MASK_LENGTH):
+        lengths[k] = lcs_dynamic(values[a_starts[k]:a_starts[k] + a_lens[k]], values[b_starts[k]:b_starts[k] + b_lens[k]])
+    return lengths
+
+
+def stress_ratios(a_values, a_offsets, b_values, b_offsets):
+    """Levenshtein.ratio of every aligned pair of patterns, 1 where both are empty."""
+    total = np.diff(a_offsets) + np.diff(b_offsets)
+    lengths = lcs_lengths(a_values, a_offsets, b_values, b_offsets)
+    return np.where(total > 0, 2 * lengths / np.maximum(total, 1), 1.0)
+
+
+def stress_ratios_systems(ref_values, ref_offsets, systems):
+    """
+    Compare one reference pattern array against several systems in one kernel call.
+
+    :param systems: List of (values, offsets) aligned line by line with the reference.
+    :return: Array of shape (systems, lines).
+    """
+    n_lines = len(ref_offsets) - 1
+    ref_lens = np.diff(ref_offsets)
+    tiled_offsets = np.zeros(len(systems) * n_lines + 1, dtype=np.int64)
+    tiled_offsets[1:] = np.cumsum(np.tile(ref_lens, len(systems)))
+    hyp_values = np.concatenate([values for values, _ in systems])
+    hyp_offsets = np.zeros(len(systems) * n_lines + 1, dtype=np.int64)
+    hyp_offsets[1:] = np.cumsum(np.concatenate([np.diff(offsets) for _, offsets in systems]))
+    ratios = stress_ratios(np.tile(ref_values, len(systems)), tiled_offsets, hyp_values, hyp_offsets)
+    return ratios.reshape(len(systems), n_lines)
@@ -1,9 +1,20 @@
-import pronouncing
-import textstat
 import requests
 import urllib.parse
-import json
 import os
+import sys
+import numpy as np
+import phonetics_store
+import irish_g2p
+import pronunciation_index
+from syllable_analyser_es import syllabize_sentence_es
+from song_arrays import align_songs, line_syllable_diffs, song_offsets, song_means
+# results_store.py is shared with the semantics evaluators
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import results_store
+
+# Translations scored against the originals, by system
+SYSTEM_FILES = {"reference": "references.txt", "google": "googles.txt", "nllb": "nllbs.txt"}
+
 
 def split_into_songs(lines):
     songs = []
@@ -21,41 +32,30 @@ def split_into_songs(lines):
 
 
 # Get syllable count for sentence
-def syllabize_sentence(sentence, language, cache=None):
-    words = sentence.split()
+def syllabize_sentence(sentence, language):
     if language == "en":
-        return sum(syllabize_word_en(word) for word in words)
-    else:
-        return syllabize_sentence_ga(sentence, cache)
-
-
-# Counting syllables of input English word using Pronouncing
-def syllabize_word_en(word):
-    phones = pronouncing.phones_for_word(word)  # Lowercase for CMU dictionary
-    if phones:
-        return pronouncing.syllable_count(phones[0])
+        return pronunciation_index.lookup_line(sentence)[0]
+    elif language == "es":
+        return syllabize_sentence_es(sentence)
     else:
-        return syllabize_word_en_fallback(word)  # Fallback to textstat
-
-
-# Fallback function using textstat if Pronouncing fails
-def syllabize_word_en_fallback(word):
-    count = textstat.syllable_count(word)
-    return count if count else 1  # Default to 1 if all else fails
+        return syllabize_sentence_ga(sentence)
 
 
 # Counting syllables of input Irish sentence using Abair
-def syllabize_sentence_ga(sentence, cache):
-    phonetised_sen = phonetise_text(sentence, cache)
+def syllabize_sentence_ga(sentence):
+    phonetised_sen = phonetise_text(sentence)
     syllables = sum([word.count(".") + 1 for word in phonetised_sen])
     return syllables
 
 
-def phonetise_text(text, cache, dialect="co", mapping="mrpai", add_origins="false"):
-    """Phonetise text using Abair API, but only if it's not cached."""
-    # Check cache first
-    if text in cache:
-        return cache[text]
+def phonetise_text(text, dialect="co", mapping="mrpai", add_origins="false"):
+    """Phonetise text using Abair API, but only if its words are not all cached, and locally if the API fails."""
+    # Check cache first, the sentence is built from its cached words
+    cached = phonetics_store.sentence_phonetics(text, dialect, mapping)
+    if cached is not None:
+        return cached
+    if irish_g2p.OFFLINE:
+        return irish_g2p.fallback_phonetics(text, dialect, mapping)
 
     # If not cached, call API
     base_url = "https://synthesis.abair.ie/api/phonetise"
@@ -66,60 +66,47 @@ def phonetise_text(text, cache, dialect="co", mapping="mrpai", add_origins="fals
         response = requests.get(url)
         if response.status_code == 200:
             result = response.json()
-            # Save result to cache
-            cache[text] = result
-            # Save cache to file
-            with open(CACHE_FILE, "w", encoding="utf-8") as f:
-                json.dump(cache, f, ensure_ascii=False, indent=4)
+            # Save the words of the result to cache, it is written to disk with the next batched flush
+            phonetics_store.add_sentence(text, result, dialect, mapping)
             return result
         else:
             print(f"Error: {response.status_code} - {response.text}")
-            return None
     except Exception as e:
         print(f"Request failed: {e}")
-        return None
+    # Fall back to the stored words and the rule-based phonetiser for the others, which is not cached
+    return irish_g2p.fallback_phonetics(text, dialect, mapping)
 
 
-if __name__ == '__main__':
-    # Cache file path of all Irish sentences with phonetic transcriptions
-    CACHE_FILE = "singability_files/phonetics_cache.json"
+def syllable_counts(lines, language):
+    """Syllable count of every line as an integer array."""
+    return np.array([syllabize_sentence(line, language) for line in lines], dtype=np.int32)
 
-    # Load cache from file if it exists
-    if os.path.exists(CACHE_FILE):
-        with open(CACHE_FILE, "r", encoding="utf-8") as f:
-            cache = json.load(f)
-    else:
-        cache = {}
+
+if __name__ == '__main__':
+    # Load the word-level phonetics shared with the other analysers, new entries are flushed in batches and at exit
+    phonetics_store.open_phonetics_store()
 
     # Read reference and hypothesis files
     with open("ga_txt_files/originals.txt", "r", encoding="utf-8") as f:
-        originals = f.readlines()
-
-    with open("ga_txt_files/references.txt", "r", encoding="utf-8") as f:
-        hypotheses = f.readlines()
-
-    # Ensure JSON file exists
-    json_path = "results_by_song/reference.json"
-    if os.path.exists(json_path) and os.path.getsize(json_path) > 0:
-        with open(json_path, "r", encoding="utf-8") as file:
-            try:
-                song_objects = json.load(file)
-            except json.JSONDecodeError:
-                print(f"Error: {json_path} is not valid. Resetting it.")
-                song_objects = []
-    else:
-        song_objects = []
-
-    og_songs = split_into_songs([line.strip() for line in originals])
-    hyp_songs = split_into_songs([line.strip() for line in hypotheses])
-
-    for i, (og_song, hyp_song) in enumerate(zip(og_songs, hyp_songs)):
-        differences = []
-        for og_sen, hyp_sen in zip(og_song, hyp_song):
-            count_og = syllabize_sentence(og_sen, 'en')
-            count_hyp = syllabize_sentence(hyp_sen, 'ga', cache)
-            differences.append(abs(count_og - count_hyp)/count_og)
-        song_objects[i]["syllable_diff"] = sum(differences)/len(differences)
-
-    with open("results_by_song/reference.json", "w", encoding="utf-8") as file:
-        json.dump(song_objects, file, indent=4, ensure_ascii=False)
+        og_songs = split_into_songs([line.strip() for line in f.readlines()])
+
+    hyp_songs = {}
+    for system, file_name in SYSTEM_FILES.items():
+        with open(f"ga_txt_files/{file_name}", "r", encoding="utf-8") as f:
+            hyp_songs[system] = split_into_songs([line.strip() for line in f.readlines()])
+
+    # Every system is aligned to the originals, so one offsets array covers them all
+    og_lines, hyp_lines, song_lengths = align_songs(og_songs, hyp_songs)
+    offsets = song_offsets(song_lengths)
+    og_counts = syllable_counts(og_lines, "en")
+    hyp_counts = np.stack([syllable_counts(hyp_lines[system], "ga") for system in SYSTEM_FILES])
+
+    line_diffs = line_syllable_diffs(og_counts, hyp_counts)
+    song_diffs = song_means(line_diffs, offsets)
+    percentiles = np.nanpercentile(line_diffs, [50, 90, 99], axis=-1)
+    print(f"{np.count_nonzero(og_counts == 0)} original lines without syllables left out")
+
+    for s, system in enumerate(SYSTEM_FILES):
+        print(f"{system}: line syllable_diff median {percentiles[0, s]:.3f}, "
+              f"p90 {percentiles[1, s]:.3f}, p99 {percentiles[2, s]:.3f}")
+        results_store.write_column(system, "syllable_diff", song_diffs[s])
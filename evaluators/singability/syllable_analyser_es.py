@@ -1 +1,209 @@
-# Use espeak_ng or freeling
\ No newline at end of file
+import re
+import os
+import sys
+import unicodedata
+import numpy as np
+import pronunciation_index
+from song_arrays import align_songs, line_syllable_diffs, song_offsets, song_means
+from stress_patterns import encode_patterns, stress_ratios_systems
+# results_store.py is shared with the semantics evaluators
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import results_store
+
+# Rule-based Spanish syllabifier and stress engine, the Spanish counterpart of the Abair path.
+# Spanish spelling is regular enough to syllabify in-process: vowels are grouped into
+# nuclei (diphthongs and triphthongs stay together, two strong vowels or an accented
+# i/u next to a strong vowel form a hiatus), consonants between nuclei go to the next
+# syllable as the longest valid onset, and stress falls on the accented syllable or,
+# without an accent, on the penultimate syllable of words ending in a vowel, n or s
+# and on the last syllable otherwise.
+
+# Translations scored against the originals, by system
+SYSTEM_FILES = {"reference": "references.txt", "google": "googles.txt", "nllb": "nllbs.txt", "deepl": "deepls.txt"}
+# Spanish results are kept apart from the Irish ones
+RESULTS_STORE_DIR = "results_store_es"
+
+STRONG_VOWELS = "aeoáéó"
+WEAK_VOWELS = "iuü"
+ACCENTED_WEAK_VOWELS = "íú"
+VOWELS = STRONG_VOWELS + WEAK_VOWELS + ACCENTED_WEAK_VOWELS
+ACCENTED_VOWELS = "áéíóú"
+# Consonant pairs that begin a syllable together and are never split
+INSEPARABLE_ONSETS = {"bl", "br", "cl", "cr", "dr", "fl", "fr", "gl", "gr", "kl", "kr", "pl", "pr", "tl", "tr"}
+# Unstressed function words (articles, clitic pronouns, prepositions, conjunctions)
+UNSTRESSED_WORDS = {
+    "el", "la", "los", "las", "lo", "un", "unos", "unas", "al", "del",
+    "me", "te", "se", "nos", "os", "le", "les", "mi", "mis", "tu", "tus", "su", "sus",
+    "a", "de", "en", "con", "por", "sin", "so", "tras", "y", "e", "o", "u", "ni",
+    "que", "si", "pues", "mas", "cuan", "cual", "quien", "cuando", "donde", "como",
+}
+
+word_table = {}  # word -> (syllable count, stress pattern), for the words of this run
+
+
+def normalise_word(word):
+    return re.sub(r"[^a-záéíóúüñ]", "", unicodedata.normalize("NFC", word.lower()))
+
+
+def word_units(word):
+    """
+    Split a normalised word into letters and digraphs, marking which are vowels.
+
+    ch, ll and rr are single consonants, the u of que/qui/gue/gui is silent and
+    belongs to the consonant, and y is a vowel on its own or after a vowel at the
+    end of a word (hoy, muy, rey).
+    """
+    units = []
+    i = 0
+    while i < len(word):
+        pair = word[i:i + 2]
+        if pair in ("ch", "ll", "rr"):
+            units.append((pair, False))
+            i += 2
+        elif pair in ("qu", "gu") and word[i + 2:i + 3] in ("e", "i", "é", "í"):
+            units.append((pair, False))
+            i += 2
+        elif word[i] == "y":
+            is_vowel = len(word) == 1 or (i == len(word) - 1 and word[i - 1] in VOWELS)
+            units.append(("y", is_vowel))
+            i += 1
+        else:
+            units.append((word[i], word[i] in VOWELS))
+            i += 1
+    return units
+
+
+def starts_hiatus(previous, current):
+    """Whether two adjacent vowels belong to different syllables."""
+    previous = "i" if previous == "y" else previous
+    current = "i" if current == "y" else current
+    if previous in STRONG_VOWELS and current in STRONG_VOWELS:
+        return True
+    if previous in ACCENTED_WEAK_VOWELS and current in STRONG_VOWELS:
+        return True
+    if previous in STRONG_VOWELS and current in ACCENTED_WEAK_VOWELS:
+        return True
+    return False
+
+
+def syllabify_word_es(word):
+    """
+    Split a Spanish word into syllables.
+
+    :return: List of syllable strings, the whole word as one syllable if it has no vowel.
+    """
+    units = word_units(normalise_word(word))
+    if not units:
+        return []
+
+    # Nuclei as [first unit, last unit] spans
+    nuclei = []
+    for i, (unit, is_vowel) in enumerate(units):
+        if not is_vowel:
+            continue
+        if nuclei and nuclei[-1][1] == i - 1 and not starts_hiatus(units[i - 1][0], unit):
+            nuclei[-1][1] = i
+        else:
+            nuclei.append([i, i])
+    if not nuclei:
+        return ["".join(unit for unit, _ in units)]
+
+    # Each syllable starts at the longest valid onset before its nucleus
+    starts = [0]
+    for (_, previous_end), (next_start, _) in zip(nuclei, nuclei[1:]):
+        consonants = next_start - previous_end - 1
+        onset = min(consonants, 1)
+        if consonants >= 2 and units[next_start - 2][0] + units[next_start - 1][0] in INSEPARABLE_ONSETS:
+            onset = 2
+        starts.append(next_start - onset)
+    starts.append(len(units))
+    return ["".join(unit for unit, _ in units[start:end]) for start, end in zip(starts, starts[1:])]
+
+
+def stressed_syllable(word, syllables):
+    """Index of the stressed syllable from the accent mark or the default stress rules."""
+    for i, syllable in enumerate(syllables):
+        if any(vowel in syllable for vowel in ACCENTED_VOWELS):
+            return i
+    if len(syllables) == 1:
+        return 0
+    if word[-1] in VOWELS or word[-1] in "ns":
+        return len(syllables) - 2
+    return len(syllables) - 1
+
+
+def analyse_word_es(word):
+    """
+    Syllable count and stress pattern of a word, memoised in word_table.
+
+    :return: (syllables, stress pattern) with "1" on the stressed syllable and "0"
+        elsewhere, or all "0" for unstressed function words.
+    """
+    entry = word_table.get(word)
+    if entry is None:
+        normalised = normalise_word(word)
+        syllables = syllabify_word_es(normalised)
+        if not syllables:
+            entry = (0, "")
+        elif normalised in UNSTRESSED_WORDS:
+            entry = (len(syllables), "0" * len(syllables))
+        else:
+            stressed = stressed_syllable(normalised, syllables)
+            entry = (len(syllables), "0" * stressed + "1" + "0" * (len(syllables) - stressed - 1))
+        word_table[word] = entry
+    return entry
+
+
+# Counting syllables of input Spanish sentence
+def syllabize_sentence_es(sentence):
+    return sum(analyse_word_es(word)[0] for word in sentence.split())
+
+
+# Get stress pattern Spanish
+def stress_pattern_es(sentence):
+    return "".join(analyse_word_es(word)[1] for word in sentence.split())
+
+
+def split_into_songs(lines):
+    songs = []
+    current_song = []
+    for line in lines:
+        if "*" in line.strip():
+            if current_song:
+                songs.append(current_song)
+                current_song = []
+        else:
+            current_song.append(line.strip())
+    if current_song:
+        songs.append(current_song)
+    return songs
+
+
+if __name__ == '__main__':
+    # Read reference and hypothesis files
+    with open("es_txt_files/originals.txt", "r", encoding="utf-8") as f:
+        og_songs = split_into_songs([line.strip() for line in f.readlines()])
+
+    hyp_songs = {}
+    for system, file_name in SYSTEM_FILES.items():
+        with open(f"es_txt_files/{file_name}", "r", encoding="utf-8") as f:
+            hyp_songs[system] = split_into_songs([line.strip() for line in f.readlines()])
+
+    # Every system is aligned to the originals, so one offsets array covers them all
+    og_lines, hyp_lines, song_lengths = align_songs(og_songs, hyp_songs)
+    offsets = song_offsets(song_lengths)
+
+    # English side from the CMU index, Spanish side from the rules above
+    og_analysis = [pronunciation_index.lookup_line(line) for line in og_lines]
+    og_counts = np.array([syllables for syllables, _, _ in og_analysis])
+    og_patterns = encode_patterns([pattern for _, pattern, _ in og_analysis])
+    hyp_counts = np.stack([[syllabize_sentence_es(line) for line in hyp_lines[system]] for system in SYSTEM_FILES])
+    hyp_patterns = [encode_patterns([stress_pattern_es(line) for line in hyp_lines[system]]) for system in SYSTEM_FILES]
+
+    # Same definitions as the Irish syllable_diff and stress_diff
+    syllable_diffs = song_means(line_syllable_diffs(og_counts, hyp_counts), offsets)
+    stress_diffs = song_means(1 - stress_ratios_systems(*og_patterns, hyp_patterns), offsets)
+
+    for s, system in enumerate(SYSTEM_FILES):
+        results_store.write_column(system, "syllable_diff", syllable_diffs[s], RESULTS_STORE_DIR)
+        results_store.write_column(system, "stress_diff", stress_diffs[s], RESULTS_STORE_DIR)